@@ -1,23 +1,36 @@
 # app.py
 from cortex.services.retrieval import RetrievalService
 from cortex.services.ingestion import IngestionService
+from cortex.services.importers import ChatExportImporter
 from cortex.services.storage import storage_service
+from cortex.services.startup import StartupTask
+from cortex.core.config import STARTUP_BACKGROUND_INIT, CHAINLIT_DEBUG_METRICS
+from cortex.core.llm_scheduler import llm_request_context
+from cortex.core.metrics import trace_stages
+from cortex.core.models import IngestResult
 import chainlit as cl
 from chainlit.element import Element
 import os
 import sys
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from cortex.logger.logger import get_logger
 import asyncio
+import contextlib
+import threading
+import time
 
 log = get_logger(__name__)
 
 sys.path.insert(0, os.path.abspath("./src"))
 
-# --- 在应用启动时，一次性加载所有需要的服务和模型 ---
+# --- 在应用启动时创建服务，向量数据库和嵌入模型在后台线程中加载 ---
 try:
     ingestion_service = IngestionService(storage_service=storage_service)
+    chat_importer = ChatExportImporter(ingestion_service)
     retrieval_service = RetrievalService(storage_service=storage_service)
+    startup_task = StartupTask(storage_service=storage_service)
+    if STARTUP_BACKGROUND_INIT:
+        startup_task.start()
 except Exception as e:
     log.error(f"Fatal error during service initialization: {e}")
     sys.exit(1)
@@ -28,35 +41,88 @@ async def start_chat():
     await cl.Message(
         content="欢迎使用 **Cortex** 记忆助手！\n\n"
                 "您可以直接向我提问，我会根据您的记忆库生成上下文。\n\n"
-                "或者，您可以上传一份文本文件（`.txt`, `.md`），并附上一句描述。",
+                "或者，您可以上传一份文本文件（`.txt`, `.md`），并附上一句描述；"
+                "也可以直接上传 ChatGPT 的 `conversations.json` 或 Gemini 的活动记录导出文件。",
         author="Cortex"
     ).send()
 
 
+# 会话中正在处理的请求，新消息到达、用户点击停止或断开连接时取消
+_ACTIVE_TASK_KEY = "active_task"
+
+
+def _cancel_active_task():
+    task = cl.user_session.get(_ACTIVE_TASK_KEY)
+    if task is not None and not task.done() and task is not asyncio.current_task():
+        task.cancel()
+
+
+@cl.on_stop
+async def stop_chat():
+    _cancel_active_task()
+
+
+@cl.on_chat_end
+async def end_chat():
+    _cancel_active_task()
+
+
 @cl.on_message
 async def main(message: cl.Message):
-    if message.elements:
-        description = message.content if message.content.strip() else None
-        await process_uploaded_files(message.elements, description)
-        return
+    # 同一会话只处理最新的消息；服务调用都是异步的，不会阻塞其他会话
+    _cancel_active_task()
+    cl.user_session.set(_ACTIVE_TASK_KEY, asyncio.current_task())
+    try:
+        # 每个会话是一个独立的LLM调度流，上传文件的元数据提取以后台优先级执行
+        with llm_request_context(flow=f"session:{cl.context.session.id}"):
+            if message.elements:
+                description = message.content if message.content.strip() else None
+                await process_uploaded_files(message.elements, description)
+                return
+
+            with trace_stages() as stage_trace:
+                await answer_query(message.content, stage_trace)
+    except asyncio.CancelledError:
+        log.info("Request cancelled by the user or superseded by a new message.")
+        raise
+    finally:
+        if cl.user_session.get(_ACTIVE_TASK_KEY) is asyncio.current_task():
+            cl.user_session.set(_ACTIVE_TASK_KEY, None)
+
+
+def _stage_trace_element(stage_trace: List[Tuple[str, str, float]]) -> cl.Text:
+    """将本次请求各阶段的耗时整理成表格，作为调试元素附加到回复中。"""
+    lines = ["| 阶段 | 耗时 (ms) |", "| --- | ---: |"]
+    lines.extend(f"| {pipeline}.{stage} | {seconds * 1000:.1f} |" for pipeline, stage, seconds in stage_trace)
+    return cl.Text(name="debug_timings.md", content="\n".join(lines), display="side")
 
-    query = message.content
+
+async def answer_query(query: str, stage_trace: List[Tuple[str, str, float]]):
     thinking_msg = cl.Message(content="", author="Cortex")
     await thinking_msg.send()
     await thinking_msg.stream_token("🧠 正在检索您的记忆库...")
-    await asyncio.sleep(0.5)
-    retrieval_result = retrieval_service.retrieve_and_prepare_context(query)
+    retrieval_result = await retrieval_service.aretrieve_and_prepare_context(query)
     if not retrieval_result:
         await thinking_msg.stream_token("\n\n未找到与您查询相关的记忆。")
         await thinking_msg.update()
         return
-    context_for_synthesis, sources = retrieval_result
+    context_for_synthesis, sources, chunk_ids = retrieval_result
     await thinking_msg.stream_token(f"\n\n📚 找到了 {len(sources)} 条相关记忆。")
-    await asyncio.sleep(0.5)
-    await thinking_msg.stream_token("\n\n✍️ 正在为您生成上下文摘要...")
-    await asyncio.sleep(0.5)
-    synthesized_context = retrieval_service.synthesize_context(
-        context_for_synthesis)
+    await thinking_msg.stream_token("\n\n✍️ 正在为您生成上下文摘要...\n\n")
+    synthesis_stream = retrieval_service.asynthesize_context_stream(context_for_synthesis, chunk_ids)
+    synthesized_parts = []
+    try:
+        async for token in synthesis_stream:
+            synthesized_parts.append(token)
+            await thinking_msg.stream_token(token)
+    except asyncio.CancelledError:
+        # 关闭与模型的流式连接，保留已生成的部分并标注
+        await synthesis_stream.aclose()
+        with contextlib.suppress(Exception):
+            await thinking_msg.stream_token("\n\n⏹️ 已停止生成。")
+            await thinking_msg.update()
+        raise
+    synthesized_context = "".join(synthesized_parts)
     memory_packet_element = cl.Text(
         name="memory_packet.md", content=synthesized_context, display="inline")
     final_content = (
@@ -66,36 +132,130 @@ async def main(message: cl.Message):
     )
     thinking_msg.content = final_content
     thinking_msg.elements = [memory_packet_element]
+    if CHAINLIT_DEBUG_METRICS:
+        thinking_msg.elements.append(_stage_trace_element(stage_trace))
     await thinking_msg.update()
 
 
 async def process_uploaded_files(files: List[Element], description: Optional[str]):
+    documents: List[Element] = []
     for file in files:
         try:
-            with open(file.path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            if not content.strip():
+            export_format = None
+            if file.name.lower().endswith(".json"):
+                export_format = await asyncio.to_thread(chat_importer.detect_format, file.path)
+            if export_format:
+                await import_chat_export(file, export_format)
+                continue
+            if await asyncio.to_thread(_is_blank_file, file.path):
                 await cl.Message(content=f"文件 `{file.name}` 已跳过 (文件内容为空)。", author="Cortex").send()
                 continue
-            final_description = description
-            if not final_description:
-                res = await cl.AskUserMessage(
-                    content=f"✅ 文件 `{file.name}` 已收到。\n\n请用一句话描述这份记忆的内容（例如：‘这是关于用Java实现工作流的Gemini对话’），或者直接回复‘跳过’。",
-                    timeout=120,
-                    author="Cortex"
-                ).send()
-                if res and res['content'].lower().strip() not in ["跳过", "skip"]:
-                    final_description = res['content']
-            processing_msg = cl.Message(
-                content=f"正在处理 `{file.name}`...", author="Cortex")
-            await processing_msg.send()
-            ingestion_service.process(
-                content=content,
-                source_filename=file.name,
-                description=final_description
-            )
-            processing_msg.content = f"✅ 记忆文件 `{file.name}` 已成功摄入！"
-            await processing_msg.update()
+            documents.append(file)
         except Exception as e:
             log.error(f"Error processing file {file.name}: {e}")
             await cl.Message(content=f"❌ 处理文件 `{file.name}` 时发生错误。", author="Cortex").send()
+    if not documents:
+        return
+
+    final_description = description
+    if not final_description:
+        # 一次上传的多个文件只询问一次描述
+        if len(documents) == 1:
+            prompt = f"✅ 文件 `{documents[0].name}` 已收到。"
+        else:
+            prompt = f"✅ 已收到 {len(documents)} 个文件。"
+        res = await cl.AskUserMessage(
+            content=f"{prompt}\n\n请用一句话描述这份记忆的内容（例如：‘这是关于用Java实现工作流的Gemini对话’），或者直接回复‘跳过’。",
+            timeout=120,
+            author="Cortex"
+        ).send()
+        if res and res['content'].lower().strip() not in ["跳过", "skip"]:
+            final_description = res['content']
+
+    progress = _UploadProgress([file.name for file in documents])
+    await progress.send()
+    # 各文件的元数据提取和分块并发进行，嵌入和写入跨文件合并批次；取消时回滚未完成文件已写入的片段
+    try:
+        await ingestion_service.aprocess_files(
+            [(file.path, file.name, final_description) for file in documents],
+            on_progress=progress.report)
+    except Exception as e:
+        log.error(f"Error processing uploaded files: {e}")
+        await cl.Message(content="❌ 处理上传的文件时发生错误。", author="Cortex").send()
+    await progress.update(force=True)
+
+
+_STAGE_LABELS = {
+    "queued": "⏳ 等待处理",
+    "hashing": "🔍 检查是否重复",
+    "extracting_metadata": "🏷️ 提取元数据并分块",
+    "embedding": "🧮 计算嵌入并写入",
+}
+_RESULT_LABELS = {
+    "ingested": "✅ 已摄入",
+    "updated": "✅ 已更新",
+    "duplicate": "⏭️ 已存在",
+    "empty": "⏭️ 内容为空",
+    "failed": "❌ 处理失败",
+}
+
+
+class _UploadProgress:
+    """在一条消息中展示多个上传文件的处理进度，更新频率受限，避免大量文件时刷屏。"""
+
+    def __init__(self, names: List[str], min_interval: float = 0.5):
+        self.names = names
+        self.statuses = [_STAGE_LABELS["queued"]] * len(names)
+        self.min_interval = min_interval
+        self.message = cl.Message(content=self._render(), author="Cortex")
+        self._last_update = 0.0
+
+    def _render(self) -> str:
+        done = sum(1 for status in self.statuses if status in _RESULT_LABELS.values())
+        lines = [f"正在处理上传的文件（{done}/{len(self.names)}）：", "", "| 文件 | 状态 |", "| --- | --- |"]
+        lines.extend(f"| `{name}` | {status} |" for name, status in zip(self.names, self.statuses))
+        return "\n".join(lines)
+
+    async def send(self):
+        await self.message.send()
+        self._last_update = time.monotonic()
+
+    async def report(self, index: int, stage: str, result: Optional[IngestResult]):
+        if result is not None:
+            self.statuses[index] = _RESULT_LABELS.get(result.status, result.status)
+        else:
+            self.statuses[index] = _STAGE_LABELS.get(stage, stage)
+        await self.update()
+
+    async def update(self, force: bool = False):
+        if not force and time.monotonic() - self._last_update < self.min_interval:
+            return
+        self.message.content = self._render()
+        await self.message.update()
+        self._last_update = time.monotonic()
+
+
+async def import_chat_export(file: Element, export_format: str):
+    """对话导出文件按对话逐个导入，元数据取自导出文件，无需用户描述。"""
+    processing_msg = cl.Message(
+        content=f"正在导入 `{file.name}`（{export_format} 导出文件）...", author="Cortex")
+    await processing_msg.send()
+    # 线程中的导入无法被直接中断，任务被取消时通知其在下一批之前停止
+    cancel_event = threading.Event()
+    try:
+        counts = await asyncio.to_thread(
+            chat_importer.import_file, file.path, export_format, cancel_event=cancel_event)
+    except asyncio.CancelledError:
+        cancel_event.set()
+        log.info(f"Import of {file.name} cancelled.")
+        raise
+    imported = counts.get("ingested", 0) + counts.get("updated", 0)
+    processing_msg.content = (
+        f"✅ `{file.name}` 导入完成：{imported} 个对话已摄入，"
+        f"{counts.get('duplicate', 0)} 个已存在，{counts.get('failed', 0)} 个失败。")
+    await processing_msg.update()
+
+
+def _is_blank_file(path: str) -> bool:
+    with open(path, 'r', encoding='utf-8') as f:
+        return all(not line.strip() for line in f)
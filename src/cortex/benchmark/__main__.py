@@ -0,0 +1,11 @@
+import os
+
+# 基准测试默认离线运行，并减少日志输出对测量结果的干扰；需在导入 cortex 模块之前设置
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+from cortex.benchmark.runner import main  # noqa: E402
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+from cortex.core.models import IngestRequest
+from cortex.services.importers import chatgpt_document
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+import json
+import random
+import uuid
+
+# 每个主题的关键词，生成的对话和查询都围绕这些主题，使检索能命中相关记忆
+_TOPICS: Dict[str, List[str]] = {
+    "向量数据库": ["chroma", "embedding", "向量", "索引", "召回率", "HNSW", "相似度", "分片"],
+    "Python 性能优化": ["profiling", "GIL", "多线程", "asyncio", "缓存", "numpy", "内存", "cProfile"],
+    "个人知识管理": ["笔记", "Zettelkasten", "标签", "双向链接", "复盘", "Obsidian", "卡片", "回顾"],
+    "家庭烹饪": ["食谱", "火候", "调味", "红烧", "发酵", "烤箱", "刀工", "高汤"],
+    "马拉松训练": ["配速", "心率", "间歇跑", "长距离", "恢复", "跑鞋", "补给", "乳酸阈"],
+    "Kubernetes 运维": ["pod", "deployment", "ingress", "helm", "探针", "扩缩容", "日志", "节点"],
+    "投资理财": ["指数基金", "定投", "资产配置", "回撤", "复利", "债券", "现金流", "风险"],
+    "旅行计划": ["签证", "行程", "酒店", "机票", "预算", "当地美食", "交通卡", "攻略"],
+}
+_FILLER = ["我们", "需要", "考虑", "然后", "另外", "具体来说", "一般", "建议", "比如", "所以",
+           "the", "and", "with", "for", "when", "because", "also", "which", "should", "could"]
+_QUERY_TEMPLATES = [
+    "{topic}",
+    "关于{topic}的{keyword}",
+    "{keyword} 相关的讨论",
+    "上周关于{topic}的对话",
+    "最近7天的{keyword}",
+    "chatgpt 里关于{keyword}的内容",
+    "how to improve {keyword}",
+    "2023年以前讨论过的{topic}",
+]
+
+
+class SyntheticCorpus:
+    """
+    确定性的合成语料生成器。
+
+    生成与 ChatGPT conversations.json 结构相同的对话（标题、用户/助手交替的消息树），
+    同一个 seed 总是生成完全相同的语料和查询，便于跨提交比较基准测试结果。
+    """
+
+    def __init__(self, seed: int = 42, words_per_doc: int = 400, turns_per_doc: int = 6,
+                 start_ts: int = 1700000000):
+        self.seed = seed
+        self.words_per_doc = max(10, words_per_doc)
+        self.turns_per_doc = max(2, turns_per_doc)
+        self.start_ts = start_ts
+
+    def _rng(self, *key: Any) -> random.Random:
+        return random.Random(f"{self.seed}:" + ":".join(str(k) for k in key))
+
+    def _paragraph(self, rng: random.Random, keywords: List[str], words: int) -> str:
+        tokens = [rng.choice(keywords) if rng.random() < 0.35 else rng.choice(_FILLER) for _ in range(words)]
+        sentences = [" ".join(tokens[i:i + 12]) + "。" for i in range(0, len(tokens), 12)]
+        if rng.random() < 0.2:
+            # 部分消息带有代码块，覆盖分块器对 Markdown 结构的处理
+            sentences.append(f"\n```python\nresult = {rng.choice(keywords)!r}\n```\n")
+        return "".join(sentences)
+
+    def conversation(self, index: int) -> Dict[str, Any]:
+        """生成第 index 个对话，格式与 ChatGPT 导出文件中的单个对话一致。"""
+        rng = self._rng("conversation", index)
+        topic = rng.choice(sorted(_TOPICS))
+        keywords = _TOPICS[topic] + [topic]
+        words_per_turn = max(5, self.words_per_doc // self.turns_per_doc)
+        create_time = self.start_ts + index * 3600
+        mapping: Dict[str, Any] = {}
+        parent = None
+        for turn in range(self.turns_per_doc):
+            node_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            mapping[node_id] = {
+                "id": node_id,
+                "parent": parent,
+                "children": [],
+                "message": {
+                    "author": {"role": "user" if turn % 2 == 0 else "assistant"},
+                    "create_time": create_time + turn * 60,
+                    "content": {"content_type": "text",
+                                "parts": [self._paragraph(rng, keywords, words_per_turn)]},
+                },
+            }
+            if parent:
+                mapping[parent]["children"].append(node_id)
+            parent = node_id
+        return {
+            "id": f"bench-{index:08d}",
+            "conversation_id": f"bench-{index:08d}",
+            "title": f"{topic} 讨论 #{index}",
+            "create_time": create_time,
+            "update_time": create_time + self.turns_per_doc * 60,
+            "current_node": parent,
+            "mapping": mapping,
+        }
+
+    def iter_conversations(self, start: int, stop: int) -> Iterator[Dict[str, Any]]:
+        for index in range(start, stop):
+            yield self.conversation(index)
+
+    def iter_documents(self, start: int, stop: int, with_metadata: bool = True) -> Iterator[IngestRequest]:
+        """
+        以摄入请求的形式产出对话，与导入 ChatGPT 导出文件得到的文档相同。
+        with_metadata 为 False 时不带元数据，摄入时由LLM提取。
+        """
+        for conversation in self.iter_conversations(start, stop):
+            document = chatgpt_document(conversation)
+            if not with_metadata:
+                document = document.model_copy(update={"metadata": None, "description": document.metadata["title"]})
+            yield document
+
+    def write_chatgpt_export(self, path: Path, start: int, stop: int):
+        """将 [start, stop) 范围内的对话写成 conversations.json 导出文件。"""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("[")
+            for i, conversation in enumerate(self.iter_conversations(start, stop)):
+                if i:
+                    f.write(",")
+                json.dump(conversation, f, ensure_ascii=False)
+            f.write("]")
+
+    def queries(self, count: int) -> List[str]:
+        """生成 count 个查询，覆盖规则可直接解析的查询和需要LLM拆解的查询。"""
+        rng = self._rng("queries")
+        queries = []
+        for i in range(count):
+            topic = rng.choice(sorted(_TOPICS))
+            template = _QUERY_TEMPLATES[i % len(_QUERY_TEMPLATES)]
+            queries.append(template.format(topic=topic, keyword=rng.choice(_TOPICS[topic])))
+        return queries
@@ -0,0 +1,256 @@
+from cortex.benchmark.corpus import SyntheticCorpus
+from cortex.benchmark.stubs import StubLLM, HashingEmbeddingFunction, write_prompt_templates
+from cortex.core import model_chat, prompt
+from cortex.core.chunk import chunk
+from cortex.core.config import EMBEDDING_BACKEND, IMPORT_BATCH_DOCUMENTS
+from cortex.core.embedding import create_embedding_function
+from cortex.core.metrics import trace_stages
+from cortex.services.importers import ChatExportImporter
+from cortex.services.ingestion import IngestionService
+from cortex.services.retrieval import RetrievalService
+from cortex.services.storage import StorageService
+from cortex.logger.logger import get_logger, flush_logs
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+log = get_logger(__name__)
+
+INGEST_MODES = ("import", "batch", "process")
+
+
+@contextmanager
+def offline_environment(work_dir: Path, llm: StubLLM) -> Iterator[None]:
+    """
+    在代码块内将LLM调用替换为桩模型，并使用基准测试自带的Prompt模板，
+    使结果不依赖网络、模型服务和 prompt 目录中的正式模板。
+    """
+    prompt_dir = work_dir / "prompts"
+    write_prompt_templates(prompt_dir)
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.object(prompt, "PROMPT_DIR", prompt_dir))
+        stack.enter_context(mock.patch.dict(prompt._prompt_template_cache, clear=True))
+        stack.enter_context(mock.patch.object(model_chat, "SYNTHESIS_MODEL_PROVIDER", "local"))
+        stack.enter_context(mock.patch.object(model_chat, "_call_local_ollama", llm))
+        stack.enter_context(mock.patch.object(model_chat, "_stream_local_ollama", llm.stream))
+        yield
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """延迟样本（秒）的统计摘要，单位为毫秒。"""
+    if not samples:
+        return {}
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def _stage_totals(traces: List[List[Tuple[str, str, float]]]) -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for trace in traces:
+        for pipeline, stage, seconds in trace:
+            key = f"{pipeline}.{stage}"
+            totals[key] = totals.get(key, 0.0) + seconds
+    return {key: round(seconds, 4) for key, seconds in sorted(totals.items())}
+
+
+class BenchmarkRunner:
+    """
+    在临时 Chroma 目录上运行的基准测试。
+
+    语料按 corpus_sizes 逐级追加摄入，每达到一个规模，记录该段摄入的吞吐量，
+    再以不同并发度执行查询，记录端到端延迟分布和各阶段耗时。
+    """
+
+    def __init__(self, work_dir: Path, corpus: SyntheticCorpus, llm: StubLLM, embedding: str = "hash",
+                 ingest_mode: str = "import", batch_documents: int = IMPORT_BATCH_DOCUMENTS):
+        if ingest_mode not in INGEST_MODES:
+            raise ValueError(f"Unknown ingest mode '{ingest_mode}', expected one of {INGEST_MODES}.")
+        self.work_dir = work_dir
+        self.corpus = corpus
+        self.llm = llm
+        self.ingest_mode = ingest_mode
+        self.batch_documents = batch_documents
+        embedding_function = HashingEmbeddingFunction() if embedding == "hash" \
+            else create_embedding_function(EMBEDDING_BACKEND)
+        self.storage_service = StorageService(
+            db_path=work_dir / "chroma", embedding_function=embedding_function,
+            hash_index_path=work_dir / "file_hash_index.bin")
+        self.ingestion_service = IngestionService(storage_service=self.storage_service)
+        self.retrieval_service = RetrievalService(storage_service=self.storage_service)
+        self.importer = ChatExportImporter(self.ingestion_service, batch_documents=batch_documents)
+        self.ingested = 0
+        # 数据库、嵌入模型和分块用的分词器在测量开始前加载
+        self.storage_service.initialize()
+        self.storage_service.embedding_function(["warmup"])
+        chunk.count_tokens("warmup")
+
+    def ingest_to(self, corpus_size: int) -> Dict[str, Any]:
+        """把语料追加摄入到 corpus_size 个文档，返回这一段摄入的吞吐量。"""
+        start, stop = self.ingested, max(self.ingested, corpus_size)
+        chunks_before = self.storage_service.collection.count()
+        llm_calls_before = self.llm.calls
+        export_path = self.work_dir / f"conversations_{start}_{stop}.json"
+        if self.ingest_mode == "import":
+            # 导出文件的生成不计入摄入耗时
+            self.corpus.write_chatgpt_export(export_path, start, stop)
+        with trace_stages() as trace:
+            started_at = time.perf_counter()
+            if self.ingest_mode == "import":
+                self.importer.import_file(str(export_path), export_format="chatgpt")
+            elif self.ingest_mode == "batch":
+                documents = self.corpus.iter_documents(start, stop)
+                while batch := list(islice(documents, self.batch_documents)):
+                    self.ingestion_service.process_batch(batch)
+            else:
+                for document in self.corpus.iter_documents(start, stop, with_metadata=False):
+                    self.ingestion_service.process(document.content, document.source, document.description)
+            elapsed = time.perf_counter() - started_at
+        export_path.unlink(missing_ok=True)
+        self.ingested = stop
+        documents, chunks = stop - start, self.storage_service.collection.count() - chunks_before
+        return {
+            "documents": documents,
+            "chunks": chunks,
+            "seconds": round(elapsed, 4),
+            "docs_per_sec": round(documents / elapsed, 2) if elapsed else None,
+            "chunks_per_sec": round(chunks / elapsed, 2) if elapsed else None,
+            "llm_calls": self.llm.calls - llm_calls_before,
+            "stage_seconds": _stage_totals([trace]),
+        }
+
+    def run_queries(self, queries: List[str], concurrency: int, synthesize: bool = True) -> Dict[str, Any]:
+        """以给定并发度执行全部查询，返回端到端延迟分布。"""
+        # 清空缓存，各轮测量互不影响
+        self.retrieval_service.query_cache.clear()
+        self.retrieval_service.synthesis_cache.clear()
+
+        def run_one(query: str) -> Tuple[float, List[Tuple[str, str, float]]]:
+            with trace_stages() as trace:
+                started_at = time.perf_counter()
+                if synthesize:
+                    self.retrieval_service.query_and_synthesize(query)
+                else:
+                    self.retrieval_service.retrieve_and_prepare_context(query)
+                return time.perf_counter() - started_at, trace
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="bench-query") as executor:
+            outcomes = list(executor.map(run_one, queries))
+        elapsed = time.perf_counter() - started_at
+        return {
+            "concurrency": concurrency,
+            "synthesize": synthesize,
+            "queries_per_sec": round(len(queries) / elapsed, 2) if elapsed else None,
+            "latency": latency_summary([latency for latency, _ in outcomes]),
+            "stage_seconds": _stage_totals([trace for _, trace in outcomes]),
+        }
+
+    def run(self, corpus_sizes: List[int], queries: List[str], concurrency_levels: List[int],
+            synthesize: bool = True) -> List[Dict[str, Any]]:
+        results = []
+        for corpus_size in sorted(corpus_sizes):
+            log.info(f"Benchmark: ingesting up to {corpus_size} documents...")
+            ingest = self.ingest_to(corpus_size)
+            log.info(f"Benchmark: ingested {ingest['documents']} documents in {ingest['seconds']}s.")
+            query_results = []
+            for concurrency in concurrency_levels:
+                query_results.append(self.run_queries(queries, concurrency, synthesize))
+                log.info(f"Benchmark: corpus={corpus_size} concurrency={concurrency} "
+                         f"latency={query_results[-1]['latency']}")
+            results.append({
+                "corpus_size": corpus_size,
+                "total_chunks": self.storage_service.collection.count(),
+                "ingest": ingest,
+                "query": query_results,
+            })
+        self.storage_service.save_hash_index()
+        return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m cortex.benchmark",
+        description="离线基准测试：合成语料的摄入吞吐量，以及不同语料规模与并发度下的查询延迟。")
+    parser.add_argument("--corpus-sizes", type=_int_list, default=[200, 1000],
+                        help="逐级摄入的语料规模（文档数），逗号分隔")
+    parser.add_argument("--words-per-doc", type=int, default=400, help="每个对话的大致词数")
+    parser.add_argument("--turns-per-doc", type=int, default=6, help="每个对话的消息数")
+    parser.add_argument("--queries", type=int, default=100, help="每轮测量执行的查询数")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4], help="查询并发度，逗号分隔")
+    parser.add_argument("--no-synthesis", action="store_true", help="只测量检索，不调用（桩）LLM合成摘要")
+    parser.add_argument("--ingest-mode", choices=INGEST_MODES, default="import",
+                        help="import: 流式导入 ChatGPT 导出文件; batch: process_batch; "
+                             "process: 逐个摄入并由LLM提取元数据")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="桩模型每次调用的延迟（秒）")
+    parser.add_argument("--llm-jitter", type=float, default=0.2, help="桩模型延迟的相对抖动幅度")
+    parser.add_argument("--embedding", choices=("hash", "configured"), default="hash",
+                        help="hash: 无需模型的哈希嵌入; configured: 按 EMBEDDING_BACKEND 使用本地已缓存的模型")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", type=Path, default=None, help="数据库目录，默认使用并在结束后删除临时目录")
+    parser.add_argument("--output", type=Path, default=None, help="结果 JSON 文件，默认只输出到标准输出")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    corpus = SyntheticCorpus(seed=args.seed, words_per_doc=args.words_per_doc, turns_per_doc=args.turns_per_doc)
+    llm = StubLLM(latency=args.llm_latency, jitter=args.llm_jitter, seed=args.seed)
+    with ExitStack() as stack:
+        if args.data_dir is None:
+            work_dir = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="cortex-bench-")))
+        else:
+            work_dir = args.data_dir
+            work_dir.mkdir(parents=True, exist_ok=True)
+        stack.enter_context(offline_environment(work_dir, llm))
+        runner = BenchmarkRunner(work_dir, corpus, llm, embedding=args.embedding, ingest_mode=args.ingest_mode)
+        results = runner.run(args.corpus_sizes, corpus.queries(args.queries), args.concurrency,
+                             synthesize=not args.no_synthesis)
+
+    report = {
+        "git_commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    # 日志同样输出到标准输出，先写完再输出结果，避免交错
+    flush_logs(timeout=5)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(output + "\n", encoding='utf-8')
+    sys.stdout.write(output + "\n")
+    return report
@@ -0,0 +1,113 @@
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from cortex.core.config import PROMPT_TEMPLATE_NAME, METADATA_BATCH_TEMPLATE_NAME
+from pathlib import Path
+from typing import Any, Dict
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+import numpy as np
+
+_METADATA_MARKER = "<<bench:metadata>>"
+_METADATA_BATCH_MARKER = "<<bench:metadata_batch>>"
+_QUERY_MARKER = "<<bench:query>>"
+
+# 基准测试使用的最小Prompt模板，占位符与正式模板相同；标记行供桩模型识别请求类型
+PROMPT_TEMPLATES: Dict[str, str] = {
+    "cortex_sys_metadata_v1.md": f"{_METADATA_MARKER}\nfilename: {{filename}}\ndescription: {{description}}\n",
+    METADATA_BATCH_TEMPLATE_NAME: f"{_METADATA_BATCH_MARKER}\n{{documents}}\n",
+    "cortex_sys_v1.md": f"{_QUERY_MARKER}\nnow: {{current_timestamp}}\nquery: {{user_query}}\n",
+    PROMPT_TEMPLATE_NAME: "请总结以下记忆片段：\n\n{context}\n",
+}
+
+
+def write_prompt_templates(prompt_dir: Path):
+    prompt_dir.mkdir(parents=True, exist_ok=True)
+    for name, content in PROMPT_TEMPLATES.items():
+        (prompt_dir / name).write_text(content, encoding='utf-8')
+
+
+class StubLLM:
+    """
+    确定性的本地桩模型，替代真实的LLM调用。
+
+    按Prompt类型返回格式正确的响应（元数据JSON、查询拆解JSON、摘要文本），
+    并按配置的延迟休眠，延迟抖动由Prompt内容决定，相同输入总是得到相同的延迟和输出。
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.2, seed: int = 42):
+        self.latency = max(0.0, latency)
+        self.jitter = max(0.0, min(jitter, 1.0))
+        self.seed = seed
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+        rng = random.Random(f"{self.seed}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}")
+        if self.latency:
+            time.sleep(self.latency * (1 + self.jitter * (2 * rng.random() - 1)))
+        if prompt.startswith(_METADATA_MARKER):
+            filename = re.search(r'^filename: (.*)$', prompt, re.M).group(1)
+            return "[JSON_START]" + json.dumps(self._metadata(filename, rng)) + "[JSON_END]"
+        if prompt.startswith(_METADATA_BATCH_MARKER):
+            documents = json.loads(prompt[len(_METADATA_BATCH_MARKER):])
+            return "[JSON_START]" + json.dumps(
+                [{"index": d["index"], **self._metadata(d["filename"], rng)} for d in documents]) + "[JSON_END]"
+        if prompt.startswith(_QUERY_MARKER):
+            query = re.search(r'^query: (.*)$', prompt, re.M).group(1)
+            return json.dumps({"core_query": query, "filters": []}, ensure_ascii=False)
+        # 摘要：截取上下文开头，长度与输入相关
+        context = prompt.split("\n\n", 1)[-1]
+        return "摘要：" + context[:200].replace("\n", " ")
+
+    def stream(self, prompt: str):
+        yield self(prompt)
+
+    @staticmethod
+    def _metadata(filename: str, rng: random.Random) -> Dict[str, Any]:
+        return {
+            "source": filename.split('/')[0].split('_')[0].lower(),
+            "source_type": "llm_chat",
+            "tags": sorted(rng.sample(["bench", "chat", "notes", "work", "life"], 2)),
+        }
+
+
+class HashingEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    无需下载模型的确定性嵌入函数：对词和汉字做特征哈希后归一化。
+
+    语义质量远不如真实模型，但词汇重叠的文本向量相近，检索结果有意义，
+    计算开销稳定，适合离线测量除模型推理以外的流水线开销。
+    """
+
+    _TOKEN_RE = re.compile(r'[A-Za-z0-9_]+|[\u4e00-\u9fff]')
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def __call__(self, input: Documents) -> Embeddings:
+        embeddings = []
+        for text in input:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for token in self._TOKEN_RE.findall(text.lower()):
+                digest = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+                vector[digest % self.dim] += 1.0 if (digest >> 32) & 1 else -1.0
+            norm = np.linalg.norm(vector)
+            embeddings.append(vector / norm if norm else vector)
+        return embeddings
+
+    @staticmethod
+    def name() -> str:
+        return "cortex_bench_hashing"
+
+    def get_config(self) -> Dict[str, Any]:
+        return {"dim": self.dim}
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> "EmbeddingFunction[Documents]":
+        return HashingEmbeddingFunction(**config)
@@ -0,0 +1,58 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from cortex.core.chunk import Chunk, _estimate_tokens
+
+from .corpus import SyntheticCorpus
+from .runner import BenchmarkRunner, latency_summary, offline_environment
+from .stubs import StubLLM
+
+
+class TestSyntheticCorpus(unittest.TestCase):
+
+    def test_deterministic_chat_export(self):
+        """测试：相同 seed 生成完全相同的对话和查询，导出文件可被 ChatGPT 导入器解析。"""
+        corpus = SyntheticCorpus(seed=7, words_per_doc=60)
+        self.assertEqual(corpus.conversation(3), SyntheticCorpus(seed=7, words_per_doc=60).conversation(3))
+        self.assertNotEqual(corpus.conversation(3), SyntheticCorpus(seed=8, words_per_doc=60).conversation(3))
+        self.assertEqual(corpus.queries(5), SyntheticCorpus(seed=7).queries(5))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "conversations.json"
+            corpus.write_chatgpt_export(path, 0, 3)
+            self.assertEqual(len(json.loads(path.read_text(encoding='utf-8'))), 3)
+        documents = list(corpus.iter_documents(0, 3))
+        self.assertEqual([d.source for d in documents], [f"chatgpt/bench-{i:08d}" for i in range(3)])
+
+
+@patch('cortex.services.ingestion.chunk', Chunk(token_counter=_estimate_tokens))
+@patch('cortex.benchmark.runner.chunk', Chunk(token_counter=_estimate_tokens))
+class TestBenchmarkRunner(unittest.TestCase):
+
+    def test_runs_offline_against_temporary_store(self):
+        """测试：在临时目录中使用桩模型和哈希嵌入完成摄入与查询，并输出延迟分布。"""
+        corpus = SyntheticCorpus(seed=1, words_per_doc=120)
+        llm = StubLLM(latency=0)
+        with tempfile.TemporaryDirectory() as tmp_dir, offline_environment(Path(tmp_dir), llm):
+            runner = BenchmarkRunner(Path(tmp_dir), corpus, llm, ingest_mode="process")
+            results = runner.run([4, 6], corpus.queries(8), [1, 2])
+
+        self.assertEqual([r["corpus_size"] for r in results], [4, 6])
+        self.assertEqual(results[1]["ingest"]["documents"], 2)
+        self.assertGreater(results[1]["total_chunks"], results[0]["total_chunks"])
+        # 逐个摄入时每个文档调用一次LLM提取元数据
+        self.assertEqual(results[0]["ingest"]["llm_calls"], 4)
+        query = results[0]["query"][1]
+        self.assertEqual((query["concurrency"], query["latency"]["count"]), (2, 8))
+        self.assertIn("query.vector_search", query["stage_seconds"])
+
+    def test_latency_summary(self):
+        summary = latency_summary([0.001 * i for i in range(1, 101)])
+        self.assertEqual((summary["p50_ms"], summary["max_ms"]), (50.5, 100.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
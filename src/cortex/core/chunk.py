@@ -1,10 +1,51 @@
+from cortex.core.config import (
+    EMBEDDING_MODEL,
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    CHUNK_TOKENIZER
+)
 from cortex.logger.logger import get_logger
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+import io
 import re
+import threading
 
 log = get_logger(__name__)
 
+_HEADING_RE = re.compile(r'^\s{0,3}#{1,6}\s')
+_FENCE_RE = re.compile(r'^\s{0,3}(```|~~~)')
+# 句子边界：中文句末标点之后，或英文句末标点后跟空白
+_SENTENCE_RE = re.compile(r'(?<=[。！？；])|(?<=[.!?;])\s+')
+# 近似的分词单元：单个CJK字符、连续的字母数字、单个标点
+_TOKEN_RE = re.compile(
+    r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_]')
+# 单个段落在内存中累积的上限，超过后即使没有空行也当作一个段落处理
+_MAX_BLOCK_CHARS = 64 * 1024
+
+
+def _token_starts(text: str) -> Iterator[int]:
+    """产出每个近似token的起始位置：CJK字符和标点各算一个，字母数字串约每6个字符一个。"""
+    for match in _TOKEN_RE.finditer(text):
+        if match.group().isascii() and match.group()[0].isalnum():
+            yield from range(match.start(), match.end(), 6)
+        else:
+            yield match.start()
+
+
+def _estimate_tokens(text: str) -> int:
+    """在没有模型分词器时，按 WordPiece 的大致行为估算token数。"""
+    return sum(1 for _ in _token_starts(text))
+
 
 class Chunk:
+    def __init__(self, token_counter: Optional[Callable[[str], int]] = None):
+        """
+        Args:
+            token_counter: 可选的token计数函数；未提供时按配置加载嵌入模型的分词器，加载失败则使用估算。
+        """
+        self._token_counter = token_counter
+        self._lock = threading.Lock()
+
     def clean_text(self, text: str) -> str:
         """
         执行基础的文本清洗。
@@ -14,20 +55,151 @@ class Chunk:
         text = re.sub(r'\s+', ' ', text).strip()
         return text
 
-    def chunk_text(self, text: str, chunk_size: int = 512, chunk_overlap: int = 50) -> list[str]:
+    def count_tokens(self, text: str) -> int:
+        """返回文本在嵌入模型下的token数量。"""
+        if self._token_counter is None:
+            with self._lock:
+                if self._token_counter is None:
+                    self._token_counter = self._load_token_counter()
+        return self._token_counter(text)
+
+    def _load_token_counter(self) -> Callable[[str], int]:
+        if CHUNK_TOKENIZER == "model":
+            try:
+                from transformers import AutoTokenizer
+                model_id = EMBEDDING_MODEL if "/" in EMBEDDING_MODEL else f"sentence-transformers/{EMBEDDING_MODEL}"
+                tokenizer = AutoTokenizer.from_pretrained(model_id)
+                log.info(f"Chunking with tokenizer of '{model_id}'.")
+                return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+            except Exception as e:
+                log.warn(f"Failed to load tokenizer for '{EMBEDDING_MODEL}': {e}. Falling back to estimation.")
+        return _estimate_tokens
+
+    def chunk_text(self, text: str, max_tokens: int = CHUNK_MAX_TOKENS,
+                   overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list[str]:
         """
-        一个简单的递归字符文本分块器。
+        将文本切分为记忆片段，结果与 iter_chunks 相同。
         """
-        if len(text) <= chunk_size:
-            return [text]
+        return list(self.iter_chunks(text, max_tokens, overlap_tokens))
 
-        chunks = []
+    def iter_chunks(self, source: Union[str, Iterable[str]], max_tokens: int = CHUNK_MAX_TOKENS,
+                    overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+        """
+        按文档结构增量地切分文本，逐个产出记忆片段。
+
+        - source 可以是字符串，也可以是按行迭代的文本流（如打开的文件），不会一次性读入全部内容
+        - 优先在 Markdown 标题、段落处切分，段落过长时按句子切分，句子过长时按token硬切分
+        - 每个片段不超过 max_tokens 个token（与嵌入模型的最大序列长度匹配），
+          同一章节内相邻片段以不超过 overlap_tokens 的完整句子重叠
+        """
+        lines = io.StringIO(source) if isinstance(source, str) else source
+        current: List[Tuple[str, int, int]] = []  # (文本, token数, 所属段落编号)
+        current_tokens = 0
+
+        def flush(keep_overlap: bool) -> Optional[str]:
+            nonlocal current, current_tokens
+            if not current:
+                return None
+            text = self._join_units(current)
+            carried: List[Tuple[str, int, int]] = []
+            if keep_overlap and overlap_tokens > 0:
+                carried_tokens = 0
+                for unit in reversed(current[1:]):
+                    if carried_tokens + unit[1] > overlap_tokens:
+                        break
+                    carried.insert(0, unit)
+                    carried_tokens += unit[1]
+            current = carried
+            current_tokens = sum(unit[1] for unit in carried)
+            return text
+
+        for block_id, (block, is_heading) in enumerate(self._iter_blocks(lines)):
+            if is_heading:
+                # 新章节开始，不与上一章节的内容合并或重叠
+                text = flush(keep_overlap=False)
+                if text:
+                    yield text
+            for unit_text, unit_tokens in self._split_block(block, max_tokens):
+                if current and current_tokens + unit_tokens > max_tokens:
+                    yield flush(keep_overlap=True)
+                    # 重叠部分加上新单元仍超限时，放弃重叠
+                    if current and current_tokens + unit_tokens > max_tokens:
+                        current, current_tokens = [], 0
+                current.append((unit_text, unit_tokens, block_id))
+                current_tokens += unit_tokens
+        text = flush(keep_overlap=False)
+        if text:
+            yield text
+
+    def _iter_blocks(self, lines: Iterable[str]) -> Iterator[Tuple[str, bool]]:
+        """将文本行组合为结构块：(块文本, 是否为标题)。代码块内部不做切分。"""
+        buffer: List[str] = []
+        buffer_chars = 0
+        in_fence = False
+        for line in lines:
+            if _FENCE_RE.match(line):
+                in_fence = not in_fence
+            elif not in_fence:
+                if _HEADING_RE.match(line):
+                    if buffer:
+                        yield "".join(buffer), False
+                    buffer, buffer_chars = [], 0
+                    yield line, True
+                    continue
+                if not line.strip():
+                    if buffer:
+                        yield "".join(buffer), False
+                    buffer, buffer_chars = [], 0
+                    continue
+            buffer.append(line)
+            buffer_chars += len(line)
+            if buffer_chars >= _MAX_BLOCK_CHARS:
+                yield "".join(buffer), False
+                buffer, buffer_chars = [], 0
+        if buffer:
+            yield "".join(buffer), False
+
+    def _split_block(self, block: str, max_tokens: int) -> Iterator[Tuple[str, int]]:
+        """将结构块切分为不超过 max_tokens 的单元：整块、句子或硬切分的片段。"""
+        text = self.clean_text(block)
+        if not text:
+            return
+        tokens = self.count_tokens(text)
+        if tokens <= max_tokens:
+            yield text, tokens
+            return
+        for sentence in _SENTENCE_RE.split(text):
+            sentence = sentence.strip() if sentence else ""
+            if not sentence:
+                continue
+            tokens = self.count_tokens(sentence)
+            if tokens <= max_tokens:
+                yield sentence, tokens
+            else:
+                yield from self._hard_split(sentence, max_tokens)
+
+    def _hard_split(self, text: str, max_tokens: int) -> Iterator[Tuple[str, int]]:
+        """在近似的token边界处硬切分过长的句子。"""
         start = 0
-        while start < len(text):
-            end = start + chunk_size
-            chunks.append(text[start:end])
-            start += chunk_size - chunk_overlap
-        return chunks
+        budget = 0
+        for position in _token_starts(text):
+            if budget >= max_tokens:
+                piece = text[start:position].strip()
+                if piece:
+                    yield piece, self.count_tokens(piece)
+                start, budget = position, 0
+            budget += 1
+        piece = text[start:].strip()
+        if piece:
+            yield piece, self.count_tokens(piece)
+
+    @staticmethod
+    def _join_units(units: List[Tuple[str, int, int]]) -> str:
+        """同一段落的句子以空格连接，不同段落之间换行。"""
+        parts = [units[0][0]]
+        for prev, unit in zip(units, units[1:]):
+            parts.append(("\n" if unit[2] != prev[2] else " ") + unit[0])
+        return "".join(parts)
 
 
 chunk = Chunk()
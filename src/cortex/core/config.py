@@ -22,7 +22,24 @@ DB_PATH = BASE_DIR / "data"
 COLLECTION_NAME = "personal_memory"
 
 # 1. 嵌入模型 (Embedding Model)
-EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# 嵌入计算后端: 'sentence_transformer'（PyTorch）或 'onnx'（ONNX Runtime，适合仅有CPU的服务器）
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence_transformer")
+# ONNX 后端是否使用 int8 动态量化，以及导出模型的存放目录
+EMBEDDING_ONNX_QUANTIZE = os.getenv("EMBEDDING_ONNX_QUANTIZE", "false").lower() == "true"
+EMBEDDING_ONNX_DIR = Path(os.getenv("EMBEDDING_ONNX_DIR", str(DB_PATH / "onnx_models")))
+# 单次前向计算的文本数量，以及计算线程数（0 表示使用后端默认值）
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_NUM_THREADS = int(os.getenv("EMBEDDING_NUM_THREADS", 0))
+# 嵌入模型的最大序列长度，超出部分截断
+EMBEDDING_MAX_SEQ_LENGTH = int(os.getenv("EMBEDDING_MAX_SEQ_LENGTH", 256))
+
+# 分块配置：单个记忆片段的最大token数应不超过嵌入模型的最大序列长度
+# （all-MiniLM-L6-v2 为 256，预留 [CLS]/[SEP] 等特殊token），相邻片段以完整句子重叠
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 240))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 32))
+# token计数方式: 'model' 使用嵌入模型的分词器（加载失败时回退为估算），'estimate' 直接估算
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "model")
 
 # 2. 上下文合成模型 (Synthesis Model)
 SYNTHESIS_MODEL_PROVIDER = os.getenv("SYNTHESIS_MODEL_PROVIDER", "local")
@@ -32,6 +49,23 @@ SYNTHESIS_MODEL = os.getenv("SYNTHESIS_MODEL", "SYNTHESIS_MODEL")
 MODEL_API_KEY = os.getenv("MODEL_API_KEY", "")
 MODEL_API_URL = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
 
+# LLM 客户端连接池配置
+# 本地Ollama服务地址，为空时使用 ollama 库的默认值（或 OLLAMA_HOST 环境变量）
+OLLAMA_HOST = os.getenv("OLLAMA_HOST") or None
+# 单次LLM请求的超时时间（秒），以及建立连接的超时时间
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+# 连接失败、超时或服务端错误时的重试次数，以及指数退避的初始间隔（秒）
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", 0.5))
+# 每个模型提供方允许的最大并发请求数，同时也是连接池大小
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 4))
+# 为交互式请求（查询拆解、上下文合成）保留的并发槽位，后台摄入的元数据提取不会占用；
+# 并发上限为1时后台请求仍可使用唯一的槽位，但交互式请求总是优先调度
+LLM_INTERACTIVE_RESERVED_SLOTS = int(os.getenv("LLM_INTERACTIVE_RESERVED_SLOTS", 1))
+# 相同Prompt的并发请求合并为一次调用，共享结果（流式请求除外）
+LLM_SINGLE_FLIGHT_ENABLED = os.getenv("LLM_SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
 # 3. Prompt模板配置
 # 从环境变量读取模板文件名，默认为 'qwen3_v1.md'
 PROMPT_TEMPLATE_NAME = os.getenv("PROMPT_TEMPLATE_NAME", "qwen3_v1.md")
@@ -39,4 +73,116 @@ PROMPT_TEMPLATE_NAME = os.getenv("PROMPT_TEMPLATE_NAME", "qwen3_v1.md")
 
 # --- 检索配置 ---
 RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 5))
+# 批量查询时同时进行查询拆解和上下文合成的查询数量，默认与LLM并发上限一致
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", LLM_MAX_CONCURRENCY))
 CORTEX_SYS_PROMPT_TEMPLATE = os.getenv("CORTEX_SYS_PROMPT_TEMPLATE", "")
+
+
+# --- 后台摄入任务配置 ---
+# 任务持久化文件（SQLite），服务重启后未完成的任务会重新入队
+INGEST_JOB_DB_PATH = Path(os.getenv("INGEST_JOB_DB_PATH", str(DB_PATH / "ingest_jobs.sqlite3")))
+# 同时等待处理的任务上限，超过后拒绝新的摄入请求
+INGEST_QUEUE_MAX_SIZE = int(os.getenv("INGEST_QUEUE_MAX_SIZE", 1000))
+# 后台摄入工作线程数量
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+# LLM 暂时不可用时的最大重试次数，以及指数退避的初始间隔（秒）
+INGEST_JOB_MAX_RETRIES = int(os.getenv("INGEST_JOB_MAX_RETRIES", 3))
+INGEST_JOB_RETRY_BACKOFF = float(os.getenv("INGEST_JOB_RETRY_BACKOFF", 2.0))
+# 运行中任务的租约时长（秒），执行任务的进程定期续约；租约过期的任务视为执行者已退出，由其他进程重新入队
+INGEST_JOB_LEASE_SECONDS = float(os.getenv("INGEST_JOB_LEASE_SECONDS", 60))
+
+# --- 批量摄入配置 ---
+# 每次写入数据库（并触发嵌入计算）的记忆片段数量
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 256))
+# 一次上传多个文件时，同时进行元数据提取和分块的文件数量（写入阶段跨文件合并批次）
+INGEST_UPLOAD_CONCURRENCY = int(os.getenv("INGEST_UPLOAD_CONCURRENCY", 4))
+
+# --- 元数据批量提取配置 ---
+# 批量摄入时一次LLM调用提取多个文档的元数据；PROMPT_DIR 中没有该模板时使用内置的默认提示词
+METADATA_BATCH_TEMPLATE_NAME = os.getenv("METADATA_BATCH_TEMPLATE_NAME", "cortex_sys_metadata_batch_v1.md")
+METADATA_BATCH_SIZE = int(os.getenv("METADATA_BATCH_SIZE", 20))
+# 以（文件名模式，描述）为键缓存LLM提取的元数据，文件名中的日期、序号和哈希不同的导出文件共用缓存结果
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", 1024))
+METADATA_CACHE_TTL = float(os.getenv("METADATA_CACHE_TTL", 86400))
+
+# --- 查询理解缓存配置 ---
+# 缓存LLM对查询的结构化拆解结果，相同（归一化后）的查询在有效期内不再调用LLM
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 512))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 600))
+
+# --- 上下文合成缓存配置 ---
+# 以（Prompt模板及其版本，检索到的记忆片段ID序列）为键缓存合成结果；写入新记忆后检索结果变化，键随之变化，
+# 无需清空缓存，旧条目按容量淘汰
+SYNTHESIS_CACHE_SIZE = int(os.getenv("SYNTHESIS_CACHE_SIZE", 256))
+# 设置后将合成缓存持久化到该 SQLite 文件，服务重启后依然有效；为空时仅缓存在内存中
+SYNTHESIS_CACHE_PATH = os.getenv("SYNTHESIS_CACHE_PATH", "")
+
+# --- 嵌入缓存配置 ---
+# 以（嵌入模型，文本内容哈希）为键的磁盘缓存，重建或迁移数据库时无需重新计算相同文本的嵌入
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = Path(os.getenv("EMBEDDING_CACHE_DIR", str(DB_PATH / "embedding_cache")))
+# 缓存的最大向量数量，超出后淘汰最久未使用的向量
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200000))
+
+# --- 对话记录导入配置 ---
+# 流式导入 ChatGPT/Gemini 导出文件时，每批交给批量摄入的对话数量
+IMPORT_BATCH_DOCUMENTS = int(os.getenv("IMPORT_BATCH_DOCUMENTS", 64))
+# 每次从导出文件读取的字符数
+IMPORT_READ_SIZE = int(os.getenv("IMPORT_READ_SIZE", 1024 * 1024))
+
+# --- 文件哈希索引配置 ---
+# 摄入时的重复检测使用内存中的文件哈希索引，而不是逐次查询数据库元数据
+HASH_INDEX_ENABLED = os.getenv("HASH_INDEX_ENABLED", "true").lower() == "true"
+HASH_INDEX_PATH = Path(os.getenv("HASH_INDEX_PATH", str(DB_PATH / "file_hash_index.bin")))
+# 启用后只在内存中保留 Bloom 过滤器（按容量预估约每个文件10bit），可能存在时再查询数据库确认
+HASH_INDEX_BLOOM = os.getenv("HASH_INDEX_BLOOM", "false").lower() == "true"
+HASH_INDEX_BLOOM_CAPACITY = int(os.getenv("HASH_INDEX_BLOOM_CAPACITY", 1000000))
+# 索引写回磁盘的最短间隔（秒），进程退出时总会写回
+HASH_INDEX_SAVE_INTERVAL = float(os.getenv("HASH_INDEX_SAVE_INTERVAL", 30))
+
+# --- 规则查询解析配置 ---
+# 先用本地规则解析查询中的相对时间、来源和标签，置信度足够时跳过LLM查询拆解
+QUERY_RULE_PARSER_ENABLED = os.getenv("QUERY_RULE_PARSER_ENABLED", "true").lower() == "true"
+QUERY_PARSER_MIN_CONFIDENCE = float(os.getenv("QUERY_PARSER_MIN_CONFIDENCE", 0.8))
+# 可在查询中直接识别的记忆来源名称（与元数据中的 source 字段一致），逗号分隔
+QUERY_KNOWN_SOURCES = [s.strip() for s in os.getenv(
+    "QUERY_KNOWN_SOURCES", "chatgpt,gemini,qwen,claude,deepseek,kimi,doubao,copilot").split(",") if s.strip()]
+
+# --- 推测性检索配置 ---
+# 规则解析置信度不足、需要LLM拆解查询时，同时用原始查询执行一次无过滤条件的检索，
+# 拆解结果返回后复用或在内存中筛选该检索结果，隐藏向量检索与嵌入计算的延迟
+SPECULATIVE_RETRIEVAL_ENABLED = os.getenv("SPECULATIVE_RETRIEVAL_ENABLED", "true").lower() == "true"
+# 推测性检索多取的倍数（相对 RETRIEVAL_TOP_K），便于在内存中按过滤条件筛选
+SPECULATIVE_RETRIEVAL_OVERFETCH = int(os.getenv("SPECULATIVE_RETRIEVAL_OVERFETCH", 3))
+
+# --- 上下文打包配置 ---
+# 交给合成模型的记忆片段上下文的token上限（近似估算），超出时按相关性截断；0 表示不限制
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+# MMR 排序中相关性的权重（0~1），越小越倾向于选择与已选片段内容不同的片段
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))
+# 与已选片段内容重合度（词二元组 Jaccard 相似度）达到该值的片段视为近似重复并丢弃
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", 0.8))
+# 剩余预算不足该token数时，不再截断放入后续片段
+CONTEXT_MIN_FRAGMENT_TOKENS = int(os.getenv("CONTEXT_MIN_FRAGMENT_TOKENS", 64))
+
+# --- 存储后端配置 ---
+# 'embedded'：进程内直接打开向量数据库并加载嵌入模型；
+# 'client'：通过 Unix socket 调用独立的存储服务进程（python -m cortex.services.storage_server），
+# 多个 API worker 与 Chainlit 进程共用同一个数据库、嵌入模型和文件哈希索引
+STORAGE_MODE = os.getenv("STORAGE_MODE", "embedded")
+STORAGE_SERVER_SOCKET = Path(os.getenv("STORAGE_SERVER_SOCKET", str(DB_PATH / "storage.sock")))
+# 客户端单次调用的超时时间（秒），批量写入需要在服务端计算嵌入；也是等待存储服务就绪的最长时间
+STORAGE_CLIENT_TIMEOUT = float(os.getenv("STORAGE_CLIENT_TIMEOUT", 300))
+# API 服务的工作进程数，大于1时要求 STORAGE_MODE=client
+API_WORKERS = int(os.getenv("API_WORKERS", 1))
+
+# --- 启动与预热配置 ---
+# 服务启动后在后台线程中初始化向量数据库、嵌入模型和文件哈希索引，端口立即可用（就绪前 /health/ready 返回503）；
+# 关闭时各组件在首次使用时才初始化
+STARTUP_BACKGROUND_INIT = os.getenv("STARTUP_BACKGROUND_INIT", "true").lower() == "true"
+# 初始化完成后执行一次预热：计算一条嵌入并向LLM发送一次最小请求，避免首个真实请求承担模型加载的开销
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+
+# --- 指标配置 ---
+# 开启后在 Chainlit 的回复中附加本次请求各阶段耗时的调试元素
+CHAINLIT_DEBUG_METRICS = os.getenv("CHAINLIT_DEBUG_METRICS", "false").lower() == "true"
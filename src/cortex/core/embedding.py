@@ -0,0 +1,243 @@
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
+from cortex.core.config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_BACKEND,
+    EMBEDDING_ONNX_QUANTIZE,
+    EMBEDDING_ONNX_DIR,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_NUM_THREADS,
+    EMBEDDING_MAX_SEQ_LENGTH
+)
+from cortex.logger.logger import get_logger
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import re
+import threading
+import numpy as np
+
+log = get_logger(__name__)
+
+EMBEDDING_BACKENDS = ("sentence_transformer", "onnx")
+
+
+class EmbeddingMismatchError(RuntimeError):
+    """当前配置的嵌入模型与集合中已有向量所用的模型不一致。"""
+    pass
+
+
+def _hf_model_id(model_name: str) -> str:
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+class BatchedSentenceTransformerEmbeddingFunction(SentenceTransformerEmbeddingFunction):
+    """可配置批大小的 SentenceTransformer 嵌入函数，名称与配置与 Chroma 内置的版本相同。"""
+
+    def __init__(self, model_name: str, batch_size: int = 32, **kwargs: Any):
+        super().__init__(model_name=model_name, **kwargs)
+        self.batch_size = batch_size
+
+    def __call__(self, input: Documents) -> Embeddings:
+        embeddings = self._model.encode(
+            list(input),
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=self.normalize_embeddings,
+        )
+        return [np.array(embedding, dtype=np.float32) for embedding in embeddings]
+
+
+class OnnxEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    基于 ONNX Runtime 的 CPU 嵌入函数。
+
+    首次使用时将 HuggingFace 上的 sentence-transformers 模型导出为 ONNX（均值池化和L2归一化一并导出，
+    与 all-MiniLM-L6-v2 等模型的 sentence-transformers 输出一致），可选地进行 int8 动态量化，
+    之后直接加载导出的文件。推理时按文本长度排序分批，减少填充带来的无效计算。
+    导出和量化需要安装 onnx 包，推理只需要 onnxruntime 和 tokenizers。
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, quantize: bool = False,
+                 batch_size: int = 64, num_threads: int = 0,
+                 max_seq_length: int = 256, model_dir: Optional[str] = None):
+        self.model_name = model_name
+        self.quantize = quantize
+        self.batch_size = max(1, batch_size)
+        self.num_threads = num_threads
+        self.max_seq_length = max_seq_length
+        slug = re.sub(r'[^A-Za-z0-9._-]', '_', model_name)
+        self.model_dir = Path(model_dir) if model_dir else EMBEDDING_ONNX_DIR / slug
+        self._session = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    @property
+    def model_path(self) -> Path:
+        return self.model_dir / ("model.int8.onnx" if self.quantize else "model.onnx")
+
+    def _load(self):
+        with self._lock:
+            if self._session is not None:
+                return
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+            if not self.model_path.exists():
+                self._export()
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.num_threads > 0:
+                options.intra_op_num_threads = self.num_threads
+                options.inter_op_num_threads = 1
+            self._session = ort.InferenceSession(
+                str(self.model_path), sess_options=options, providers=["CPUExecutionProvider"])
+            self._input_names = {i.name for i in self._session.get_inputs()}
+            tokenizer = Tokenizer.from_file(str(self.model_dir / "tokenizer.json"))
+            tokenizer.enable_truncation(max_length=self.max_seq_length)
+            tokenizer.enable_padding()
+            self._tokenizer = tokenizer
+            log.info(f"Loaded ONNX embedding model {self.model_path}.")
+
+    def _export(self):
+        """导出 ONNX 模型（以及量化版本）和分词器到 model_dir。"""
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        model_id = _hf_model_id(self.model_name)
+        self.model_dir.mkdir(parents=True, exist_ok=True)
+        fp32_path = self.model_dir / "model.onnx"
+        if not fp32_path.exists():
+            log.info(f"Exporting '{model_id}' to ONNX at {fp32_path}...")
+            tokenizer = AutoTokenizer.from_pretrained(model_id)
+            tokenizer.save_pretrained(str(self.model_dir))
+            model = AutoModel.from_pretrained(model_id, attn_implementation="eager")
+
+            class _SentenceEncoder(torch.nn.Module):
+                def __init__(self, encoder):
+                    super().__init__()
+                    self.encoder = encoder
+
+                def forward(self, input_ids, attention_mask, token_type_ids):
+                    hidden = self.encoder(input_ids=input_ids, attention_mask=attention_mask,
+                                          token_type_ids=token_type_ids).last_hidden_state
+                    mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+                    pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+                    return torch.nn.functional.normalize(pooled, p=2, dim=1)
+
+            encoder = _SentenceEncoder(model).eval()
+            sample = tokenizer(["cortex"], return_tensors="pt")
+            inputs = ("input_ids", "attention_mask", "token_type_ids")
+            tmp_path = fp32_path.with_name("model.onnx.tmp")
+            torch.onnx.export(
+                encoder,
+                tuple(sample.get(name, torch.zeros_like(sample["input_ids"])) for name in inputs),
+                str(tmp_path),
+                input_names=list(inputs),
+                output_names=["sentence_embedding"],
+                dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in inputs},
+                              "sentence_embedding": {0: "batch"}},
+                opset_version=17,
+                dynamo=False,
+            )
+            tmp_path.replace(fp32_path)
+        if self.quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            log.info(f"Quantizing {fp32_path} to int8...")
+            quantize_dynamic(str(fp32_path), str(self.model_path), weight_type=QuantType.QInt8)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if self._session is None:
+            self._load()
+        texts = list(input)
+        if not texts:
+            return []
+        # 按长度排序后分批，同一批内的文本长度接近，填充更少
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings: List[Optional[np.ndarray]] = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            encoded = self._tokenizer.encode_batch([texts[i] for i in batch])
+            feeds = {
+                "input_ids": np.array([e.ids for e in encoded], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encoded], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encoded], dtype=np.int64),
+            }
+            outputs = self._session.run(
+                None, {name: value for name, value in feeds.items() if name in self._input_names})[0]
+            for i, vector in zip(batch, outputs):
+                embeddings[i] = np.asarray(vector, dtype=np.float32)
+        return embeddings
+
+    @staticmethod
+    def name() -> str:
+        return "cortex_onnx"
+
+    def get_config(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "quantize": self.quantize,
+                "max_seq_length": self.max_seq_length}
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> "EmbeddingFunction[Documents]":
+        return OnnxEmbeddingFunction(**config)
+
+
+def embedding_variant(backend: str = EMBEDDING_BACKEND, quantize: bool = EMBEDDING_ONNX_QUANTIZE) -> str:
+    """
+    描述嵌入向量数值特征的标识。
+    同一模型的 PyTorch 与 ONNX fp32 输出在数值误差范围内一致，视为同一种向量；int8 量化后的向量略有偏差。
+    """
+    return "int8" if backend == "onnx" and quantize else "fp32"
+
+
+def create_embedding_function(backend: str = EMBEDDING_BACKEND) -> EmbeddingFunction:
+    """按配置创建嵌入函数。"""
+    if backend == "onnx":
+        return OnnxEmbeddingFunction(
+            model_name=EMBEDDING_MODEL,
+            quantize=EMBEDDING_ONNX_QUANTIZE,
+            batch_size=EMBEDDING_BATCH_SIZE,
+            num_threads=EMBEDDING_NUM_THREADS,
+            max_seq_length=EMBEDDING_MAX_SEQ_LENGTH
+        )
+    if backend == "sentence_transformer":
+        if EMBEDDING_NUM_THREADS > 0:
+            import torch
+            torch.set_num_threads(EMBEDDING_NUM_THREADS)
+        return BatchedSentenceTransformerEmbeddingFunction(
+            model_name=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE)
+    raise ValueError(
+        f"Unknown EMBEDDING_BACKEND '{backend}', expected one of {EMBEDDING_BACKENDS}.")
+
+
+def check_embedding_compatibility(collection_metadata: Optional[Dict[str, Any]], has_vectors: bool,
+                                  model_name: str = EMBEDDING_MODEL,
+                                  variant: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    检查当前嵌入配置能否写入/检索已有的集合。
+
+    Returns:
+        需要写回集合元数据的嵌入信息；集合已记录且与当前配置一致时返回 None。
+
+    Raises:
+        EmbeddingMismatchError: 集合中的向量由其他嵌入模型生成。
+    """
+    variant = variant or embedding_variant()
+    metadata = collection_metadata or {}
+    stored_model = metadata.get("embedding_model")
+    stored_variant = metadata.get("embedding_variant")
+    if stored_model is None:
+        if has_vectors:
+            # 早期版本创建的集合未记录嵌入信息，当时固定使用 all-MiniLM-L6-v2（PyTorch）
+            stored_model, stored_variant = "all-MiniLM-L6-v2", "fp32"
+        else:
+            return {"embedding_model": model_name, "embedding_variant": variant}
+    if stored_model != model_name:
+        raise EmbeddingMismatchError(
+            f"Collection vectors were produced by '{stored_model}' but EMBEDDING_MODEL is '{model_name}'. "
+            f"Use a different COLLECTION_NAME or re-ingest into a new collection.")
+    if stored_variant != variant:
+        log.warn(
+            f"Collection vectors are {stored_variant} but the '{EMBEDDING_BACKEND}' backend produces {variant} "
+            f"vectors of the same model; retrieval quality may differ slightly.")
+    if "embedding_model" not in metadata:
+        return {"embedding_model": stored_model, "embedding_variant": stored_variant}
+    return None
@@ -0,0 +1,171 @@
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings, Space
+from cortex.logger.logger import get_logger
+from pathlib import Path
+from typing import Any, Dict, List
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+
+log = get_logger(__name__)
+
+
+class EmbeddingCache:
+    """
+    以（模型名称，文本内容哈希）为键的磁盘嵌入缓存。
+
+    向量以 float16 存储在预分配的内存映射文件中，SQLite 索引记录每个键所在的槽位和最近访问时间；
+    条目数达到上限后，淘汰最久未访问的条目并复用其槽位。每个模型使用独立的文件。
+    """
+
+    def __init__(self, cache_dir: Path, model_name: str, max_entries: int):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9._-]', '_', model_name)
+        self.model_name = model_name
+        self.vectors_path = cache_dir / f"{slug}.f16"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(cache_dir / f"{slug}.index.sqlite3"), check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, accessed_ts REAL NOT NULL)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed_ts)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        meta = dict(self._conn.execute("SELECT name, value FROM meta").fetchall())
+        self.dim = meta.get("dim")
+        # 容量在向量文件创建时确定，之后修改配置不会改变已有文件的大小
+        self.capacity = meta.get("capacity", max(1, max_entries))
+        if self.capacity != max_entries:
+            log.warn(
+                f"Embedding cache for '{model_name}' keeps its existing capacity {self.capacity}.")
+        self._vectors = None
+        if self.dim is not None and self.vectors_path.exists():
+            self._vectors = np.memmap(
+                self.vectors_path, dtype=np.float16, mode="r+", shape=(self.capacity, self.dim))
+
+    @staticmethod
+    def key_for(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """返回已缓存的向量（float32），未命中的键不出现在结果中。"""
+        if self._vectors is None or not keys:
+            return {}
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key, slot in self._lookup(list(set(keys))):
+                found[key] = np.asarray(self._vectors[slot], dtype=np.float32)
+            if found:
+                now = time.time()
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE entries SET accessed_ts = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        """写入新的向量，必要时按最近访问时间淘汰旧条目。"""
+        if not items:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._create_vectors_file(len(next(iter(items.values()))))
+            existing = {key for key, _ in self._lookup(list(items))}
+            new_items = [(key, vec) for key, vec in items.items() if key not in existing]
+            new_items = new_items[:self.capacity]
+            if not new_items:
+                return
+            used = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            free_slots = list(range(used, min(self.capacity, used + len(new_items))))
+            shortfall = len(new_items) - len(free_slots)
+            with self._conn:
+                if shortfall > 0:
+                    evicted = self._conn.execute(
+                        "SELECT key, slot FROM entries ORDER BY accessed_ts LIMIT ?", (shortfall,)).fetchall()
+                    self._conn.executemany(
+                        "DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                    free_slots.extend(slot for _, slot in evicted)
+                now = time.time()
+                for (key, vec), slot in zip(new_items, free_slots):
+                    self._vectors[slot] = np.asarray(vec, dtype=np.float16)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (key, slot, accessed_ts) VALUES (?, ?, ?)",
+                    [(key, slot, now) for (key, _), slot in zip(new_items, free_slots)])
+            self._vectors.flush()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _lookup(self, keys: List[str]) -> List[tuple]:
+        """分批查询键所在的槽位，避免超出 SQLite 的参数数量上限。"""
+        rows = []
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows.extend(self._conn.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall())
+        return rows
+
+    def _create_vectors_file(self, dim: int):
+        self.dim = dim
+        self._vectors = np.memmap(
+            self.vectors_path, dtype=np.float16, mode="w+", shape=(self.capacity, dim))
+        with self._conn:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                [("dim", dim), ("capacity", self.capacity)])
+        log.info(
+            f"Created embedding cache file {self.vectors_path} ({self.capacity} x {dim} float16).")
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    为任意 Chroma 嵌入函数加上磁盘缓存：只对缓存中不存在的文本调用模型。
+
+    对 Chroma 而言它与被包装的嵌入函数等价（名称与配置相同），已有集合可以直接使用。
+    """
+
+    def __init__(self, embedding_function: EmbeddingFunction, cache: EmbeddingCache):
+        self._embedding_function = embedding_function
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [EmbeddingCache.key_for(text) for text in input]
+        cached = self.cache.get_many(keys)
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, input):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            computed = self._embedding_function(list(missing.values()))
+            new_vectors = {key: np.asarray(vec, dtype=np.float32)
+                           for key, vec in zip(missing, computed)}
+            self.cache.put_many(new_vectors)
+            cached.update(new_vectors)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        return [cached[key] for key in keys]
+
+    # --- 以下方法委托给被包装的嵌入函数，使集合配置保持不变 ---
+
+    def name(self) -> str:
+        return self._embedding_function.name()
+
+    def get_config(self) -> Dict[str, Any]:
+        return self._embedding_function.get_config()
+
+    def build_from_config(self, config: Dict[str, Any]) -> EmbeddingFunction:
+        return self._embedding_function.build_from_config(config)
+
+    def default_space(self) -> Space:
+        return self._embedding_function.default_space()
+
+    def supported_spaces(self) -> List[Space]:
+        return self._embedding_function.supported_spaces()
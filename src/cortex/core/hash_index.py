@@ -0,0 +1,185 @@
+from cortex.logger.logger import get_logger
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+import hashlib
+import json
+import math
+import os
+import re
+import struct
+import threading
+
+log = get_logger(__name__)
+
+_RECORD = struct.Struct("<32sI")  # SHA-256 原始字节 + 引用该哈希的记忆片段数
+# 可以按原始字节存储的哈希：小写十六进制的 SHA-256（与 hashlib.hexdigest() 一致），其他形式无法无损还原
+_SHA256_HEX_RE = re.compile(r'[0-9a-f]{64}')
+
+
+def _is_sha256_hex(file_hash: str) -> bool:
+    return isinstance(file_hash, str) and _SHA256_HEX_RE.fullmatch(file_hash) is not None
+
+
+class FileHashIndex:
+    """
+    文件哈希 -> 记忆片段数量的内存索引，用于摄入时的重复检测。
+
+    持久化为紧凑的二进制旁路文件：首行为JSON头（记录保存时集合中的片段总数），其后每条记录36字节。
+    不是标准 SHA-256 十六进制串的哈希（如旧数据中的其他格式）无法按字节存储，保存在JSON头中。
+    索引在内存中被修改后即删除旁路文件，直到下次保存；因此进程在保存前退出时下次启动会重建索引，
+    而不会加载过期的数据。加载时还会核对保存时的片段总数与集合是否一致。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.dirty = False
+
+    def lookup(self, file_hash: str) -> Optional[bool]:
+        """返回哈希是否存在；精确索引总能给出确定答案。"""
+        return file_hash in self._counts
+
+    def add(self, file_hashes: Iterable[str]):
+        with self._lock:
+            _invalidate(self)
+            for file_hash in file_hashes:
+                self._counts[file_hash] = self._counts.get(file_hash, 0) + 1
+
+    def remove(self, file_hashes: Iterable[str]):
+        with self._lock:
+            _invalidate(self)
+            for file_hash in file_hashes:
+                count = self._counts.get(file_hash, 0) - 1
+                if count > 0:
+                    self._counts[file_hash] = count
+                else:
+                    self._counts.pop(file_hash, None)
+
+    def rebuild(self, file_hashes: Iterable[str]):
+        with self._lock:
+            self._counts = {}
+        self.add(file_hashes)
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def load(self, expected_chunks: int) -> bool:
+        """从旁路文件加载索引，文件不存在、损坏或已过期时返回 False。"""
+        try:
+            with open(self.path, 'rb') as f:
+                header = json.loads(f.readline())
+                if header.get("chunks") != expected_chunks:
+                    return False
+                data = f.read()
+            counts = {raw.hex(): count for raw, count in _RECORD.iter_unpack(data)}
+            counts.update(header.get("other", {}))
+        except (OSError, ValueError, AttributeError, struct.error):
+            return False
+        with self._lock:
+            self._counts = counts
+            self.dirty = False
+        return True
+
+    def save(self, total_chunks: int):
+        """原子地写入旁路文件。"""
+        with self._lock:
+            records = []
+            other: Dict[str, int] = {}
+            for file_hash, count in self._counts.items():
+                if _is_sha256_hex(file_hash):
+                    records.append(_RECORD.pack(bytes.fromhex(file_hash), count))
+                else:
+                    other[str(file_hash)] = count
+            if other:
+                log.warn(f"{len(other)} file hashes are not SHA-256 hex digests, storing them in the index header.")
+            records = b"".join(records)
+            header = json.dumps({"chunks": total_chunks, "entries": len(self._counts), "other": other},
+                                ensure_ascii=False)
+            _atomic_write(self.path, header.encode('utf-8') + b"\n" + records)
+            self.dirty = False
+
+
+class BloomFilter:
+    """
+    文件哈希的 Bloom 过滤器，内存占用远小于精确索引。
+
+    判断为不存在时结果确定；判断为可能存在时需要调用方查询数据库确认。
+    Bloom 过滤器不支持删除，已删除文档的哈希只会导致多一次数据库查询。
+    """
+
+    def __init__(self, path: Path, capacity: int, error_rate: float = 0.01):
+        self.path = path
+        self.num_bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = threading.Lock()
+        self.dirty = False
+
+    def _positions(self, file_hash: str):
+        # 文件哈希本身是均匀分布的 SHA-256，取其中两段做双重哈希即可；其他格式的哈希先做一次 SHA-256
+        if not _is_sha256_hex(file_hash):
+            file_hash = hashlib.sha256(str(file_hash).encode('utf-8')).hexdigest()
+        h1, h2 = int(file_hash[:16], 16), int(file_hash[16:32], 16) | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def lookup(self, file_hash: str) -> Optional[bool]:
+        """不存在时返回 False，可能存在时返回 None。"""
+        for pos in self._positions(file_hash):
+            if not self._bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return None
+
+    def add(self, file_hashes: Iterable[str]):
+        with self._lock:
+            _invalidate(self)
+            for file_hash in file_hashes:
+                for pos in self._positions(file_hash):
+                    self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def remove(self, file_hashes: Iterable[str]):
+        pass
+
+    def rebuild(self, file_hashes: Iterable[str]):
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+        self.add(file_hashes)
+
+    def load(self, expected_chunks: int) -> bool:
+        try:
+            with open(self.path, 'rb') as f:
+                header = json.loads(f.readline())
+                if header.get("num_bits") != self.num_bits or header.get("num_hashes") != self.num_hashes:
+                    return False
+                bits = f.read()
+        except (OSError, ValueError):
+            return False
+        # 删除不会使过滤器失效，只有片段数变多时才需要重建
+        if header.get("chunks", -1) < expected_chunks or len(bits) != len(self._bits):
+            return False
+        with self._lock:
+            self._bits = bytearray(bits)
+            self.dirty = False
+        return True
+
+    def save(self, total_chunks: int):
+        with self._lock:
+            header = json.dumps({"chunks": total_chunks, "num_bits": self.num_bits,
+                                 "num_hashes": self.num_hashes})
+            _atomic_write(self.path, header.encode('utf-8') + b"\n" + bytes(self._bits))
+            self.dirty = False
+
+
+def _invalidate(index):
+    """内存中的索引即将与旁路文件不一致：第一次修改时删除旁路文件。"""
+    if not index.dirty:
+        index.dirty = True
+        index.path.unlink(missing_ok=True)
+
+
+def _atomic_write(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
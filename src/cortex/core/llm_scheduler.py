@@ -0,0 +1,361 @@
+from cortex.core.config import LLM_MAX_CONCURRENCY, LLM_INTERACTIVE_RESERVED_SLOTS
+from cortex.core.metrics import metrics
+from cortex.logger.logger import get_logger
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+log = get_logger(__name__)
+
+
+class Priority(IntEnum):
+    """LLM请求的优先级，数值越小越先调度。"""
+    INTERACTIVE = 0  # 用户正在等待的请求：查询拆解、上下文合成
+    BACKGROUND = 1   # 批量任务：摄入时的元数据提取
+
+
+QUEUE_SECONDS = metrics.histogram(
+    "cortex_llm_queue_seconds", "Time LLM requests wait for a concurrency slot.", ("provider", "priority"),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+COALESCED_REQUESTS = metrics.counter(
+    "cortex_llm_coalesced_total", "LLM requests served by an identical in-flight request.", ("provider",))
+
+_priority: ContextVar[Priority] = ContextVar("cortex_llm_priority", default=Priority.INTERACTIVE)
+_flow: ContextVar[str] = ContextVar("cortex_llm_flow", default="default")
+
+
+@contextmanager
+def llm_request_context(priority: Optional[Priority] = None, flow: Optional[str] = None):
+    """
+    设置代码块内LLM请求的默认优先级和所属的流（如会话ID、任务ID）。
+    同一优先级内各流轮流获得并发槽位，单个流的大量请求不会让其他流一直等待。
+    """
+    tokens = []
+    if priority is not None:
+        tokens.append((_priority, _priority.set(priority)))
+    if flow is not None:
+        tokens.append((_flow, _flow.set(flow)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def current_priority(priority: Optional[Priority] = None) -> Priority:
+    return _priority.get() if priority is None else priority
+
+
+def current_flow() -> str:
+    return _flow.get()
+
+
+class _Ticket:
+    """一次等待并发槽位的请求。"""
+
+    def __init__(self, scheduler: "ProviderScheduler", priority: Priority, flow: str,
+                 on_grant: Callable[[], None]):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.flow = flow
+        self.on_grant = on_grant
+        self.enqueued_at = time.perf_counter()
+        self.state = "queued"  # queued -> granted -> released；排队时被取消则为 withdrawn
+
+
+class ProviderScheduler:
+    """
+    单个模型提供方的并发槽位调度器，同步线程和各个事件循环中的请求共用同一组槽位。
+
+    - 槽位空闲时总是先调度高优先级的请求
+    - 后台请求最多同时占用 max_concurrency - reserved_interactive 个槽位（至少1个），
+      其余槽位留给交互式请求，后台批量任务运行时交互式请求也无需等待正在进行的生成完成
+    - 同一优先级内按流轮转调度，流内先进先出
+    """
+
+    def __init__(self, provider: str, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 reserved_interactive: int = LLM_INTERACTIVE_RESERVED_SLOTS):
+        self.provider = provider
+        self.max_concurrency = max(1, max_concurrency)
+        self.background_limit = max(1, self.max_concurrency - max(0, reserved_interactive))
+        self._lock = threading.Lock()
+        self._queues: Dict[Priority, "OrderedDict[str, Deque[_Ticket]]"] = {p: OrderedDict() for p in Priority}
+        self._active: Dict[Priority, int] = {p: 0 for p in Priority}
+
+    def _can_start(self, priority: Priority) -> bool:
+        if sum(self._active.values()) >= self.max_concurrency:
+            return False
+        return priority is not Priority.BACKGROUND or self._active[priority] < self.background_limit
+
+    def _enqueue(self, ticket: _Ticket):
+        self._queues[ticket.priority].setdefault(ticket.flow, deque()).append(ticket)
+
+    def _remove(self, ticket: _Ticket):
+        flows = self._queues[ticket.priority]
+        waiting = flows.get(ticket.flow)
+        if waiting is not None:
+            waiting.remove(ticket)
+            if not waiting:
+                del flows[ticket.flow]
+
+    def _dispatch(self) -> List[_Ticket]:
+        """在持有锁时分配空闲槽位，返回获得槽位的请求，由调用方在锁外通知。"""
+        granted = []
+        for priority in Priority:
+            flows = self._queues[priority]
+            while flows and self._can_start(priority):
+                flow, waiting = next(iter(flows.items()))
+                ticket = waiting.popleft()
+                # 该流还有等待的请求时轮转到队尾
+                del flows[flow]
+                if waiting:
+                    flows[flow] = waiting
+                ticket.state = "granted"
+                self._active[priority] += 1
+                granted.append(ticket)
+        return granted
+
+    def _notify(self, granted: List[_Ticket]):
+        now = time.perf_counter()
+        for ticket in granted:
+            QUEUE_SECONDS.observe(now - ticket.enqueued_at, provider=self.provider,
+                                  priority=ticket.priority.name.lower())
+            ticket.on_grant()
+
+    def submit(self, ticket: _Ticket):
+        with self._lock:
+            self._enqueue(ticket)
+            granted = self._dispatch()
+        self._notify(granted)
+
+    def release(self, ticket: _Ticket):
+        with self._lock:
+            if ticket.state != "granted":
+                return
+            ticket.state = "released"
+            self._active[ticket.priority] -= 1
+            granted = self._dispatch()
+        self._notify(granted)
+
+    def withdraw(self, ticket: _Ticket) -> bool:
+        """撤回仍在排队的请求；已获得槽位时返回 False，调用方需要释放槽位。"""
+        with self._lock:
+            if ticket.state != "queued":
+                return False
+            self._remove(ticket)
+            ticket.state = "withdrawn"
+            return True
+
+    def promote(self, ticket: _Ticket, priority: Priority):
+        """提升仍在排队的请求的优先级（如交互式请求合并到了后台请求上）。"""
+        with self._lock:
+            if ticket.state != "queued" or priority >= ticket.priority:
+                return
+            self._remove(ticket)
+            ticket.priority = priority
+            self._enqueue(ticket)
+            granted = self._dispatch()
+        self._notify(granted)
+
+    def acquire(self, priority: Priority, flow: str,
+                on_enqueue: Optional[Callable[[_Ticket], None]] = None) -> _Ticket:
+        """阻塞直到获得槽位。"""
+        granted = threading.Event()
+        ticket = _Ticket(self, priority, flow, granted.set)
+        if on_enqueue:
+            on_enqueue(ticket)
+        self.submit(ticket)
+        granted.wait()
+        return ticket
+
+    async def aacquire(self, priority: Priority, flow: str,
+                       on_enqueue: Optional[Callable[[_Ticket], None]] = None) -> _Ticket:
+        """acquire 的异步版本，等待期间不阻塞事件循环；被取消时撤回请求或归还已分配的槽位。"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def on_grant():
+            try:
+                loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+            except RuntimeError:
+                # 事件循环已关闭，没有人会使用这个槽位
+                self.release(ticket)
+
+        ticket = _Ticket(self, priority, flow, on_grant)
+        if on_enqueue:
+            on_enqueue(ticket)
+        self.submit(ticket)
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if not self.withdraw(ticket):
+                self.release(ticket)
+            raise
+        return ticket
+
+    def stats(self) -> Dict[str, Tuple[int, int]]:
+        """各优先级的 (排队数, 占用槽位数)。"""
+        with self._lock:
+            return {p.name.lower(): (sum(len(w) for w in self._queues[p].values()), self._active[p])
+                    for p in Priority}
+
+
+class LLMScheduler:
+    """按模型提供方管理调度器，所有LLM调用在发出前都需要从这里获得槽位。"""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 reserved_interactive: int = LLM_INTERACTIVE_RESERVED_SLOTS):
+        self.max_concurrency = max_concurrency
+        self.reserved_interactive = reserved_interactive
+        self._providers: Dict[str, ProviderScheduler] = {}
+        self._lock = threading.Lock()
+
+    def provider(self, name: str) -> ProviderScheduler:
+        with self._lock:
+            scheduler = self._providers.get(name)
+            if scheduler is None:
+                scheduler = ProviderScheduler(name, self.max_concurrency, self.reserved_interactive)
+                self._providers[name] = scheduler
+            return scheduler
+
+    @contextmanager
+    def slot(self, provider: str, priority: Priority, flow: str,
+             on_enqueue: Optional[Callable[[_Ticket], None]] = None) -> Iterator[_Ticket]:
+        scheduler = self.provider(provider)
+        ticket = scheduler.acquire(priority, flow, on_enqueue)
+        try:
+            yield ticket
+        finally:
+            scheduler.release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, provider: str, priority: Priority, flow: str,
+                    on_enqueue: Optional[Callable[[_Ticket], None]] = None) -> AsyncIterator[_Ticket]:
+        scheduler = self.provider(provider)
+        ticket = await scheduler.aacquire(priority, flow, on_enqueue)
+        try:
+            yield ticket
+        finally:
+            scheduler.release(ticket)
+
+    def stats(self) -> Dict[Tuple[str, str], Tuple[int, int]]:
+        with self._lock:
+            providers = list(self._providers.values())
+        return {(scheduler.provider, priority): value
+                for scheduler in providers for priority, value in scheduler.stats().items()}
+
+
+class _LeaderCancelled(Exception):
+    """执行请求的调用方被取消，等待同一结果的其他调用方需要重新发起请求。"""
+
+
+class Flight:
+    """一次正在进行的LLM请求，相同请求的调用方共享其结果。"""
+
+    def __init__(self, priority: Priority, flow: str):
+        self.priority = priority
+        self.flow = flow
+        self.ticket: Optional[_Ticket] = None
+        self.future: "concurrent.futures.Future[Any]" = concurrent.futures.Future()
+
+    def set_ticket(self, ticket: _Ticket):
+        self.ticket = ticket
+
+    def join(self, priority: Priority):
+        """更高优先级的调用方加入时，提升仍在排队的请求的优先级，后续重试也使用提升后的优先级。"""
+        if priority < self.priority:
+            self.priority = priority
+            ticket = self.ticket
+            if ticket is not None:
+                ticket.scheduler.promote(ticket, priority)
+
+
+class SingleFlight:
+    """
+    相同键的并发调用只执行一次，其余调用等待并共享结果（包括异常）。
+    同步线程与事件循环中的调用可以互相合并。
+    """
+
+    def __init__(self, provider_label: Callable[[Any], str] = lambda key: str(key[0])):
+        self._lock = threading.Lock()
+        self._flights: Dict[Any, Flight] = {}
+        self._provider_label = provider_label
+
+    def _join_or_lead(self, key: Any, priority: Priority, flow: str) -> Tuple[Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = Flight(priority, flow)
+                self._flights[key] = flight
+                return flight, True
+        flight.join(priority)
+        COALESCED_REQUESTS.inc(provider=self._provider_label(key))
+        return flight, False
+
+    def _finish(self, key: Any, flight: Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def do(self, key: Any, priority: Priority, flow: str, fn: Callable[[Flight], Any]) -> Any:
+        while True:
+            flight, leader = self._join_or_lead(key, priority, flow)
+            if not leader:
+                try:
+                    return flight.future.result()
+                except _LeaderCancelled:
+                    continue
+            try:
+                result = fn(flight)
+            except BaseException as e:
+                self._finish(key, flight)
+                flight.future.set_exception(e)
+                raise
+            self._finish(key, flight)
+            flight.future.set_result(result)
+            return result
+
+    async def ado(self, key: Any, priority: Priority, flow: str, fn: Callable[[Flight], Awaitable[Any]]) -> Any:
+        while True:
+            flight, leader = self._join_or_lead(key, priority, flow)
+            if not leader:
+                try:
+                    # shield：当前调用被取消时不影响共享的结果
+                    return await asyncio.shield(asyncio.wrap_future(flight.future))
+                except _LeaderCancelled:
+                    continue
+            try:
+                result = await fn(flight)
+            except asyncio.CancelledError:
+                self._finish(key, flight)
+                flight.future.set_exception(_LeaderCancelled())
+                raise
+            except BaseException as e:
+                self._finish(key, flight)
+                flight.future.set_exception(e)
+                raise
+            self._finish(key, flight)
+            flight.future.set_result(result)
+            return result
+
+
+llm_scheduler = LLMScheduler()
+single_flight = SingleFlight()
+
+
+def _queue_stats(index: int) -> Dict[Tuple[str, str], float]:
+    return {key: value[index] for key, value in llm_scheduler.stats().items()}
+
+
+metrics.register_callback(
+    "cortex_llm_queue_depth", "LLM requests waiting for a concurrency slot.", "gauge",
+    ("provider", "priority"), lambda: _queue_stats(0))
+metrics.register_callback(
+    "cortex_llm_active_requests", "LLM requests holding a concurrency slot.", "gauge",
+    ("provider", "priority"), lambda: _queue_stats(1))
@@ -0,0 +1,236 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from cortex.logger.logger import get_logger
+import abc
+import bisect
+import threading
+import time
+
+log = get_logger(__name__)
+
+# 默认的耗时直方图分桶（秒），覆盖从内存缓存命中到LLM调用的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(abc.ABC):
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, Any]) -> _LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric '{self.name}' expects labels {self.labelnames}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[str]:
+        """逐行生成该指标的样本（不含 HELP/TYPE 行）。"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    """只增不减的计数器。"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[_LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """按分桶统计观测值分布的直方图，同时记录总和与次数。"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签: [各分桶计数..., 超出最大分桶的计数], 总和
+        self._values: Dict[_LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._label_values(labels), ([], [0.0]))
+            return sum(counts)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted((key, list(counts), total[0]) for key, (counts, total) in self._values.items())
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class CallbackMetric(_Metric):
+    """采集时才通过回调读取当前值的指标，用于队列长度、缓存统计等已由其他组件维护的数值。"""
+
+    def __init__(self, name: str, documentation: str, type_name: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[_LabelValues, float]]):
+        super().__init__(name, documentation, labelnames)
+        self.type_name = type_name
+        self.callback = callback
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self.callback().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，以 Prometheus 文本格式导出全部指标。"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric, replace: bool = False) -> _Metric:
+        with self._lock:
+            if not replace and metric.name in self._metrics:
+                return self._metrics[metric.name]
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_callback(self, name: str, documentation: str, type_name: str, labelnames: Sequence[str],
+                          callback: Callable[[], Dict[_LabelValues, float]]) -> CallbackMetric:
+        """注册回调指标；同名指标已存在时替换，使重新创建的服务实例能接管采集。"""
+        return self._register(CallbackMetric(name, documentation, type_name, labelnames, callback), replace=True)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        parts = []
+        for metric in metrics:
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                # 单个回调指标采集失败不影响其他指标的导出
+                log.error(f"Failed to collect metric '{metric.name}': {e}")
+        return "".join(parts)
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "cortex_stage_duration_seconds", "Duration of each pipeline stage in seconds.", ("pipeline", "stage"))
+LLM_REQUESTS = metrics.counter(
+    "cortex_llm_requests_total", "LLM requests by provider and outcome.", ("provider", "status"))
+LLM_TOKENS = metrics.counter(
+    "cortex_llm_tokens_total", "LLM tokens reported by the provider.", ("provider", "kind"))
+
+# 当前请求的各阶段耗时记录，供调试输出（如 Chainlit 的调试元素）使用
+_current_trace: ContextVar[Optional[List[Tuple[str, str, float]]]] = ContextVar("cortex_stage_trace", default=None)
+
+
+def record_stage(pipeline: str, stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, pipeline=pipeline, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.append((pipeline, stage, seconds))
+
+
+@contextmanager
+def timed(pipeline: str, stage: str):
+    """统计代码块的耗时，计入 cortex_stage_duration_seconds{pipeline, stage}。"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(pipeline, stage, time.perf_counter() - started_at)
+
+
+def timed_iter(items: Iterable[Any], pipeline: str, stage: str) -> Iterator[Any]:
+    """统计惰性迭代器产出元素所花的总耗时（不包括调用方处理元素的时间），迭代结束时记录一次。"""
+    iterator = iter(items)
+    elapsed = 0.0
+    try:
+        while True:
+            started_at = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started_at
+            yield item
+    finally:
+        record_stage(pipeline, stage, elapsed)
+
+
+@contextmanager
+def trace_stages() -> Iterator[List[Tuple[str, str, float]]]:
+    """在代码块内收集当前上下文中记录的 (pipeline, stage, 耗时) 列表。"""
+    trace: List[Tuple[str, str, float]] = []
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record_llm_usage(provider: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, provider=provider, kind="prompt")
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, provider=provider, kind="completion")
@@ -1,24 +1,165 @@
 # /src/cortex/core/model_chat.py
+import asyncio
+import httpx
 import ollama
 import requests
+import threading
+import time
+import weakref
+from requests.adapters import HTTPAdapter
 from cortex.core.config import (
     SYNTHESIS_MODEL_PROVIDER,
     SYNTHESIS_MODEL,
     MODEL_API_KEY,
-    MODEL_API_URL
+    MODEL_API_URL,
+    OLLAMA_HOST,
+    LLM_TIMEOUT,
+    LLM_CONNECT_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BACKOFF,
+    LLM_MAX_CONCURRENCY,
+    LLM_SINGLE_FLIGHT_ENABLED
 )
+from cortex.core.llm_scheduler import (
+    Flight,
+    Priority,
+    current_flow,
+    current_priority,
+    llm_scheduler,
+    single_flight
+)
+from cortex.core.metrics import LLM_REQUESTS, record_stage, record_llm_usage
 from cortex.logger.logger import get_logger
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, AsyncIterator, Tuple, Optional
+import json
 
 log = get_logger(__name__)
 
+LLM_ERROR_MESSAGE = "无法连接到语言模型进行摘要合成。"
+
+
+class LLMUnavailableError(Exception):
+    """LLM调用失败（连接失败、超时、服务端错误等），调用方可以据此决定是否重试。"""
+
+
+# --- 连接池 ---
+# 同步客户端在进程内共享；异步客户端与事件循环绑定，按事件循环分别创建。
+# 并发控制由 llm_scheduler 统一负责，同步与异步请求共用每个提供方的并发槽位。
+
+_client_lock = threading.Lock()
+_ollama_client: Optional[ollama.Client] = None
+_qwen_session: Optional[requests.Session] = None
+
+
+def _httpx_timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def _httpx_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=LLM_MAX_CONCURRENCY,
+                        max_keepalive_connections=LLM_MAX_CONCURRENCY)
+
+
+def _get_ollama_client() -> ollama.Client:
+    global _ollama_client
+    with _client_lock:
+        if _ollama_client is None:
+            _ollama_client = ollama.Client(
+                host=OLLAMA_HOST, timeout=_httpx_timeout(), limits=_httpx_limits())
+        return _ollama_client
+
+
+def _get_qwen_session() -> requests.Session:
+    global _qwen_session
+    with _client_lock:
+        if _qwen_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=LLM_MAX_CONCURRENCY)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _qwen_session = session
+        return _qwen_session
+
+
+class _AsyncClients:
+    """某个事件循环内共享的异步客户端。"""
+
+    def __init__(self):
+        self.ollama = ollama.AsyncClient(
+            host=OLLAMA_HOST, timeout=_httpx_timeout(), limits=_httpx_limits())
+        self.http = httpx.AsyncClient(
+            timeout=_httpx_timeout(), limits=_httpx_limits())
+
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncClients]" = weakref.WeakKeyDictionary()
+
+
+def _get_async_clients() -> _AsyncClients:
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = _AsyncClients()
+        _async_clients[loop] = clients
+    return clients
+
+
+async def aclose_llm_clients():
+    """关闭当前事件循环上的异步LLM客户端，应在应用关闭时调用。"""
+    clients = _async_clients.pop(asyncio.get_running_loop(), None)
+    if clients is not None:
+        await clients.http.aclose()
+        await clients.ollama.close()
+
+
+def _check_provider() -> str:
+    if SYNTHESIS_MODEL_PROVIDER not in ("local", "qwen"):
+        log.error(
+            f"Unsupported model provider: {SYNTHESIS_MODEL_PROVIDER}")
+        raise ValueError(
+            f"Unsupported model provider: {SYNTHESIS_MODEL_PROVIDER}")
+    return SYNTHESIS_MODEL_PROVIDER
+
+
+def _is_transient_error(e: Exception) -> bool:
+    """判断错误是否值得重试：连接失败、超时、限流或服务端错误。"""
+    if isinstance(e, (ConnectionError, TimeoutError, requests.ConnectionError,
+                      requests.Timeout, httpx.TransportError)):
+        return True
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+def _retry_delay(attempt: int) -> float:
+    return LLM_RETRY_BACKOFF * (2 ** attempt)
+
 
-def generate_chat_completion(prompt: str) -> str:
+def _record_request(status: str, started_at: float, stage: str = "completion"):
+    """记录一次LLM调用的结果，成功的调用同时计入 llm 阶段的耗时（包括重试）。"""
+    LLM_REQUESTS.inc(provider=SYNTHESIS_MODEL_PROVIDER, status=status)
+    if status == "ok":
+        record_stage("llm", stage, time.perf_counter() - started_at)
+
+
+def _flight_key(provider: str, prompt: str) -> Tuple[str, str, str]:
+    return provider, SYNTHESIS_MODEL, prompt
+
+
+# --- 对外接口 ---
+
+def generate_chat_completion(prompt: str, raise_on_error: bool = False,
+                             priority: Optional[Priority] = None) -> str:
     """
     根据配置，调用本地或远程的LLM生成聊天响应。
 
+    请求先由 llm_scheduler 按优先级分配并发槽位；相同Prompt的并发请求只调用一次模型。
+
     Args:
         prompt: 发送给模型的完整Prompt。
+        raise_on_error: 为True时，调用失败抛出 LLMUnavailableError，而不是返回标准错误信息。
+        priority: 请求优先级，未指定时使用 llm_request_context 设置的值（默认为交互式）。
 
     Returns:
         模型生成的文本响应。
@@ -27,33 +168,257 @@ def generate_chat_completion(prompt: str) -> str:
         f"Generating chat completion using provider: {SYNTHESIS_MODEL_PROVIDER}")
 
     try:
-        if SYNTHESIS_MODEL_PROVIDER == "local":
-            return _call_local_ollama(prompt)
-        elif SYNTHESIS_MODEL_PROVIDER == "qwen":
-            return _call_remote_qwen(prompt)
-        else:
-            log.error(
-                f"Unsupported model provider: {SYNTHESIS_MODEL_PROVIDER}")
-            raise ValueError(
-                f"Unsupported model provider: {SYNTHESIS_MODEL_PROVIDER}")
+        provider = _check_provider()
+        priority, flow = current_priority(priority), current_flow()
+        if LLM_SINGLE_FLIGHT_ENABLED:
+            return single_flight.do(_flight_key(provider, prompt), priority, flow,
+                                    lambda flight: _complete(provider, prompt, flight))
+        return _complete(provider, prompt, Flight(priority, flow))
     except Exception as e:
         log.error(
             f"Error calling LLM provider '{SYNTHESIS_MODEL_PROVIDER}': {e}")
+        if raise_on_error:
+            raise LLMUnavailableError(str(e)) from e
         # 在调用失败时返回一个标准的错误信息，而不是原始的上下文
-        return "无法连接到语言模型进行摘要合成。"
+        return LLM_ERROR_MESSAGE
+
+
+def _complete(provider: str, prompt: str, flight: Flight) -> str:
+    """实际调用模型：每次尝试前获取并发槽位，退避等待期间不占用槽位。"""
+    started_at = time.perf_counter()
+    call = _call_local_ollama if provider == "local" else _call_remote_qwen
+    attempt = 0
+    try:
+        while True:
+            try:
+                with llm_scheduler.slot(provider, flight.priority, flight.flow, flight.set_ticket):
+                    response = call(prompt)
+                _record_request("ok", started_at)
+                return response
+            except Exception as e:
+                if attempt >= LLM_MAX_RETRIES or not _is_transient_error(e):
+                    raise
+                log.warn(
+                    f"LLM call failed ({e}), retrying in {_retry_delay(attempt):.1f}s...")
+                time.sleep(_retry_delay(attempt))
+                attempt += 1
+    except Exception:
+        _record_request("error", started_at)
+        raise
+
+
+async def agenerate_chat_completion(prompt: str, raise_on_error: bool = False,
+                                    priority: Optional[Priority] = None) -> str:
+    """generate_chat_completion 的异步版本，使用与事件循环绑定的连接池，不阻塞事件循环。"""
+    log.info(
+        f"Generating async chat completion using provider: {SYNTHESIS_MODEL_PROVIDER}")
+
+    try:
+        provider = _check_provider()
+        priority, flow = current_priority(priority), current_flow()
+        if LLM_SINGLE_FLIGHT_ENABLED:
+            return await single_flight.ado(_flight_key(provider, prompt), priority, flow,
+                                           lambda flight: _acomplete(provider, prompt, flight))
+        return await _acomplete(provider, prompt, Flight(priority, flow))
+    except Exception as e:
+        log.error(
+            f"Error calling LLM provider '{SYNTHESIS_MODEL_PROVIDER}': {e}")
+        if raise_on_error:
+            raise LLMUnavailableError(str(e)) from e
+        return LLM_ERROR_MESSAGE
+
+
+async def _acomplete(provider: str, prompt: str, flight: Flight) -> str:
+    started_at = time.perf_counter()
+    clients = _get_async_clients()
+    call = _acall_local_ollama if provider == "local" else _acall_remote_qwen
+    attempt = 0
+    try:
+        while True:
+            try:
+                async with llm_scheduler.aslot(provider, flight.priority, flight.flow, flight.set_ticket):
+                    response = await call(clients, prompt)
+                _record_request("ok", started_at)
+                return response
+            except Exception as e:
+                if attempt >= LLM_MAX_RETRIES or not _is_transient_error(e):
+                    raise
+                log.warn(
+                    f"LLM call failed ({e}), retrying in {_retry_delay(attempt):.1f}s...")
+                await asyncio.sleep(_retry_delay(attempt))
+                attempt += 1
+    except Exception:
+        _record_request("error", started_at)
+        raise
+
+
+def generate_chat_completion_stream(prompt: str, priority: Optional[Priority] = None) -> Iterator[str]:
+    """
+    generate_chat_completion 的流式版本，模型每生成一段文本就立即产出。
+
+    Args:
+        prompt: 发送给模型的完整Prompt。
+        priority: 请求优先级，未指定时使用 llm_request_context 设置的值（默认为交互式）。
+
+    Yields:
+        模型增量生成的文本片段。调用失败且尚未产出任何内容时，产出标准错误信息。
+    """
+    log.info(
+        f"Streaming chat completion using provider: {SYNTHESIS_MODEL_PROVIDER}")
+
+    has_output = False
+    started_at = time.perf_counter()
+    try:
+        provider = _check_provider()
+        priority, flow = current_priority(priority), current_flow()
+        stream = _stream_local_ollama if provider == "local" else _stream_remote_qwen
+        attempt = 0
+        while True:
+            try:
+                with llm_scheduler.slot(provider, priority, flow):
+                    for token in stream(prompt):
+                        if token:
+                            has_output = True
+                            yield token
+                _record_request("ok", started_at, stage="stream")
+                return
+            except Exception as e:
+                # 已经输出过内容时不再重试，避免重复的文本
+                if has_output or attempt >= LLM_MAX_RETRIES or not _is_transient_error(e):
+                    raise
+                log.warn(
+                    f"LLM stream failed ({e}), retrying in {_retry_delay(attempt):.1f}s...")
+                time.sleep(_retry_delay(attempt))
+                attempt += 1
+    except Exception as e:
+        _record_request("error", started_at)
+        log.error(
+            f"Error streaming from LLM provider '{SYNTHESIS_MODEL_PROVIDER}': {e}")
+        if not has_output:
+            yield LLM_ERROR_MESSAGE
+
+
+async def agenerate_chat_completion_stream(prompt: str, priority: Optional[Priority] = None) -> AsyncIterator[str]:
+    """generate_chat_completion_stream 的异步版本。"""
+    log.info(
+        f"Streaming async chat completion using provider: {SYNTHESIS_MODEL_PROVIDER}")
+
+    has_output = False
+    started_at = time.perf_counter()
+    try:
+        provider = _check_provider()
+        priority, flow = current_priority(priority), current_flow()
+        clients = _get_async_clients()
+        stream = _astream_local_ollama if provider == "local" else _astream_remote_qwen
+        attempt = 0
+        while True:
+            try:
+                async with llm_scheduler.aslot(provider, priority, flow):
+                    async for token in stream(clients, prompt):
+                        if token:
+                            has_output = True
+                            yield token
+                _record_request("ok", started_at, stage="stream")
+                return
+            except Exception as e:
+                if has_output or attempt >= LLM_MAX_RETRIES or not _is_transient_error(e):
+                    raise
+                log.warn(
+                    f"LLM stream failed ({e}), retrying in {_retry_delay(attempt):.1f}s...")
+                await asyncio.sleep(_retry_delay(attempt))
+                attempt += 1
+    except Exception as e:
+        _record_request("error", started_at)
+        log.error(
+            f"Error streaming from LLM provider '{SYNTHESIS_MODEL_PROVIDER}': {e}")
+        if not has_output:
+            yield LLM_ERROR_MESSAGE
+
+
+def warmup_llm():
+    """
+    向LLM发送一次最小请求，提前建立连接池中的连接；本地Ollama会同时把模型加载进内存。
+
+    Raises:
+        LLMUnavailableError: 预热请求失败。
+    """
+    started_at = time.perf_counter()
+    try:
+        provider = _check_provider()
+        if provider == "local":
+            # 空 prompt 只加载模型，不生成内容
+            _get_ollama_client().generate(model=SYNTHESIS_MODEL, prompt="")
+        else:
+            headers, payload = _build_qwen_request("ping")
+            payload["parameters"] = {"max_tokens": 1}
+            response = _get_qwen_session().post(
+                MODEL_API_URL, headers=headers, json=payload,
+                timeout=(LLM_CONNECT_TIMEOUT, LLM_TIMEOUT))
+            response.raise_for_status()
+    except Exception as e:
+        log.warn(f"LLM warmup with provider '{SYNTHESIS_MODEL_PROVIDER}' failed: {e}")
+        raise LLMUnavailableError(str(e)) from e
+    log.info(f"LLM '{SYNTHESIS_MODEL}' warmed up in {time.perf_counter() - started_at:.2f}s.")
+
+
+# --- Ollama ---
+
+def _ollama_messages(prompt: str):
+    return [{'role': 'user', 'content': prompt}]
+
+
+def _record_ollama_usage(response):
+    record_llm_usage("local", response.get('prompt_eval_count'), response.get('eval_count'))
 
 
 def _call_local_ollama(prompt: str) -> str:
     """调用本地Ollama模型。"""
-    response = ollama.chat(
+    response = _get_ollama_client().chat(
         model=SYNTHESIS_MODEL,
-        messages=[{'role': 'user', 'content': prompt}]
+        messages=_ollama_messages(prompt)
     )
+    _record_ollama_usage(response)
     return response['message']['content']
 
 
-def _call_remote_qwen(prompt: str) -> str:
-    """调用远程的通义千问（Qwen）API。"""
+def _stream_local_ollama(prompt: str) -> Iterator[str]:
+    """以流式方式调用本地Ollama模型。"""
+    stream = _get_ollama_client().chat(
+        model=SYNTHESIS_MODEL,
+        messages=_ollama_messages(prompt),
+        stream=True
+    )
+    for part in stream:
+        if part.get('done'):
+            _record_ollama_usage(part)
+        yield part['message']['content']
+
+
+async def _acall_local_ollama(clients: _AsyncClients, prompt: str) -> str:
+    response = await clients.ollama.chat(
+        model=SYNTHESIS_MODEL,
+        messages=_ollama_messages(prompt)
+    )
+    _record_ollama_usage(response)
+    return response['message']['content']
+
+
+async def _astream_local_ollama(clients: _AsyncClients, prompt: str) -> AsyncIterator[str]:
+    stream = await clients.ollama.chat(
+        model=SYNTHESIS_MODEL,
+        messages=_ollama_messages(prompt),
+        stream=True
+    )
+    async for part in stream:
+        if part.get('done'):
+            _record_ollama_usage(part)
+        yield part['message']['content']
+
+
+# --- 通义千问（Qwen） ---
+
+def _build_qwen_request(prompt: str) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """构造通义千问（Qwen）API的请求头和请求体。"""
     if not MODEL_API_KEY or not MODEL_API_URL:
         raise ValueError("Qwen API key or URL is not configured.")
 
@@ -69,10 +434,80 @@ def _call_remote_qwen(prompt: str) -> str:
             ]
         }
     }
+    return headers, payload
+
+
+def _build_qwen_stream_request(prompt: str) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """构造开启SSE增量输出的Qwen请求。"""
+    headers, payload = _build_qwen_request(prompt)
+    headers["X-DashScope-SSE"] = "enable"
+    payload["parameters"] = {"incremental_output": True}
+    return headers, payload
+
+
+def _parse_qwen_response(response_data: Dict[str, Any]) -> str:
+    return response_data['output']['choices'][0]['message']['content']
+
+
+def _record_qwen_usage(response_data: Dict[str, Any]):
+    usage = response_data.get('usage') or {}
+    record_llm_usage("qwen", usage.get('input_tokens'), usage.get('output_tokens'))
 
-    response = requests.post(MODEL_API_URL, headers=headers, json=payload)
+
+def _parse_qwen_sse_line(line: str) -> Optional[str]:
+    """解析一行SSE数据，非数据行返回 None。"""
+    # SSE 数据行形如 "data:{...}"，其余为 id/event 等控制行
+    if not line or not line.startswith("data:"):
+        return None
+    response_data = json.loads(line[len("data:"):])
+    # 增量输出时每个事件都带有累计的用量，只在最后一个事件记录
+    if response_data['output']['choices'][0].get('finish_reason') == "stop":
+        _record_qwen_usage(response_data)
+    return _parse_qwen_response(response_data)
+
+
+def _call_remote_qwen(prompt: str) -> str:
+    """调用远程的通义千问（Qwen）API。"""
+    headers, payload = _build_qwen_request(prompt)
+
+    response = _get_qwen_session().post(
+        MODEL_API_URL, headers=headers, json=payload,
+        timeout=(LLM_CONNECT_TIMEOUT, LLM_TIMEOUT))
     response.raise_for_status()  # 如果HTTP请求失败，则抛出异常
 
     # 解析Qwen API的响应结构
     response_data = response.json()
-    return response_data['output']['choices'][0]['message']['content']
+    _record_qwen_usage(response_data)
+    return _parse_qwen_response(response_data)
+
+
+def _stream_remote_qwen(prompt: str) -> Iterator[str]:
+    """以SSE方式调用远程的通义千问（Qwen）API，开启增量输出。"""
+    headers, payload = _build_qwen_stream_request(prompt)
+
+    with _get_qwen_session().post(MODEL_API_URL, headers=headers, json=payload, stream=True,
+                                  timeout=(LLM_CONNECT_TIMEOUT, LLM_TIMEOUT)) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            token = _parse_qwen_sse_line(line)
+            if token is not None:
+                yield token
+
+
+async def _acall_remote_qwen(clients: _AsyncClients, prompt: str) -> str:
+    headers, payload = _build_qwen_request(prompt)
+    response = await clients.http.post(MODEL_API_URL, headers=headers, json=payload)
+    response.raise_for_status()
+    response_data = response.json()
+    _record_qwen_usage(response_data)
+    return _parse_qwen_response(response_data)
+
+
+async def _astream_remote_qwen(clients: _AsyncClients, prompt: str) -> AsyncIterator[str]:
+    headers, payload = _build_qwen_stream_request(prompt)
+    async with clients.http.stream("POST", MODEL_API_URL, headers=headers, json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            token = _parse_qwen_sse_line(line)
+            if token is not None:
+                yield token
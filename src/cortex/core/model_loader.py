@@ -1,6 +1,5 @@
 from cortex.logger.logger import get_logger
 import gc
-import torch
 
 log = get_logger(__name__)
 
@@ -16,6 +15,8 @@ def release_all_models():
     """
     log.info("Attempting to release model memory...")
     gc.collect()
+    # 延迟导入 torch，避免导入 cortex.core 时拖慢启动
+    import torch
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
         torch.cuda.ipc_collect()
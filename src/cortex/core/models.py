@@ -1,6 +1,6 @@
 # core/models.py
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Any, Dict, List, Optional
 
 
 class IngestRequest(BaseModel):
@@ -8,6 +8,14 @@ class IngestRequest(BaseModel):
     content: str = Field(..., description="需要摄入的原始文本内容")
     source: str = Field(...,
                         description="记忆来源，例如 'chatgpt_export.json' 或 'ide_plugin'")
+    description: Optional[str] = Field(None, description="对这份记忆的一句话描述，用于元数据提取")
+    metadata: Optional[Dict[str, Any]] = Field(
+        None, description="已知的元数据（source, source_type, tags, creation_ts, title），提供时不再调用LLM提取")
+
+
+class BatchIngestRequest(BaseModel):
+    """批量记忆摄入请求体"""
+    documents: List[IngestRequest] = Field(..., description="需要摄入的文档列表")
 
 
 class QueryRequest(BaseModel):
@@ -15,6 +23,12 @@ class QueryRequest(BaseModel):
     query: str = Field(..., description="用户查询的主题")
 
 
+class BatchQueryRequest(BaseModel):
+    """批量记忆查询请求体"""
+    queries: List[str] = Field(..., description="用户查询的主题列表")
+    synthesize: bool = Field(True, description="是否对每个查询调用LLM合成摘要；为False时直接返回检索到的上下文")
+
+
 class ContextResponse(BaseModel):
     """
     记忆查询的上下文响应体。
@@ -22,3 +36,39 @@ class ContextResponse(BaseModel):
     """
     context: str = Field(..., description="由LLM提炼和总结后的上下文摘要")
     retrieved_sources: List[str] = Field(..., description="生成该摘要所参考的原始记忆来源列表")
+
+
+class IngestResult(BaseModel):
+    """单个文档的摄入结果"""
+    source: str = Field(..., description="记忆来源（文件名）")
+    status: str = Field(...,
+                        description="摄入结果: 'ingested' | 'updated' | 'duplicate' | 'empty' | 'failed'")
+    chunks: int = Field(0, description="新计算嵌入并写入数据库的记忆片段数量")
+    reused_chunks: int = Field(0, description="重新摄入已修改文档时，内容未变而保留的记忆片段数量")
+    deleted_chunks: int = Field(0, description="重新摄入已修改文档时，删除的旧记忆片段数量")
+    file_hash: Optional[str] = Field(None, description="文档内容的SHA-256哈希值")
+    error: Optional[str] = Field(None, description="失败时的错误信息")
+
+
+class IngestJobResponse(BaseModel):
+    """摄入任务的状态响应体"""
+    job_id: str = Field(..., description="摄入任务ID")
+    status: str = Field(...,
+                        description="任务状态: 'queued' | 'running' | 'succeeded' | 'failed'")
+    stage: Optional[str] = Field(None, description="任务当前所处的处理阶段")
+    source: str = Field(..., description="记忆来源")
+    attempts: int = Field(0, description="已尝试执行的次数")
+    error: Optional[str] = Field(None, description="最近一次失败的错误信息")
+    result: Optional[IngestResult] = Field(None, description="任务完成后的摄入结果")
+    created_ts: int = Field(..., description="任务创建时间（Unix时间戳）")
+    updated_ts: int = Field(..., description="任务最近更新时间（Unix时间戳）")
+
+
+class BatchIngestResponse(BaseModel):
+    """批量记忆摄入的响应体，按请求顺序返回每个文档的摄入结果"""
+    results: List[IngestResult] = Field(..., description="每个文档的摄入结果")
+
+
+class BatchQueryResponse(BaseModel):
+    """批量记忆查询的响应体，按请求顺序返回每个查询的上下文"""
+    results: List[ContextResponse] = Field(..., description="每个查询的上下文响应")
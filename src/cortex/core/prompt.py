@@ -2,6 +2,7 @@
 from cortex.core.config import PROMPT_DIR, PROMPT_TEMPLATE_NAME
 from cortex.logger.logger import get_logger
 from typing import Dict, Any
+import hashlib
 
 log = get_logger(__name__)
 
@@ -29,6 +30,11 @@ def _load_prompt_template(template_name: str) -> str:
         raise
 
 
+def template_exists(template_name: str) -> bool:
+    """模板文件是否存在，不存在时不记录错误日志，供带有内置默认提示词的可选模板使用。"""
+    return template_name in _prompt_template_cache or (PROMPT_DIR / template_name).is_file()
+
+
 def get_formatted_prompt(template_name: str, substitutions: Dict[str, Any]) -> str:
     """
     加载指定的Prompt模板，并使用.replace()方法安全地替换所有占位符。
@@ -50,6 +56,12 @@ def get_formatted_prompt(template_name: str, substitutions: Dict[str, Any]) -> s
     return template
 
 
+def get_template_version(template_name: str) -> str:
+    """返回模板内容的短哈希，模板文件修改后版本随之变化。"""
+    template = _load_prompt_template(template_name)
+    return hashlib.sha256(template.encode('utf-8')).hexdigest()[:12]
+
+
 def get_synthesis_prompt(context: str) -> str:
     """获取用于上下文合成的Prompt。"""
     return get_formatted_prompt(
@@ -0,0 +1,48 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from .cache import TTLCache, SQLiteCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = TTLCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 1, "size": 2})
+
+    @patch('cortex.core.cache.time')
+    def test_expiry(self, mock_time):
+        cache = TTLCache(max_size=2, ttl=10)
+        mock_time.time.return_value = 100
+        cache.set("a", 1)
+        mock_time.time.return_value = 111
+        self.assertIsNone(cache.get("a"))
+
+
+class TestSQLiteCache(unittest.TestCase):
+
+    def test_persistence_and_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "cache.sqlite3"
+            cache = SQLiteCache(path, max_size=2)
+            cache.set("a", "x")
+            cache.set("b", {"y": 1})
+            cache.set("c", "z")
+            self.assertEqual(len(cache), 2)
+
+            reopened = SQLiteCache(path, max_size=2)
+            self.assertEqual(reopened.get("b"), {"y": 1})
+            reopened.clear()
+            self.assertIsNone(reopened.get("c"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import io
+import unittest
+
+from .chunk import Chunk, _estimate_tokens
+
+
+class TestStructureAwareChunking(unittest.TestCase):
+
+    def setUp(self):
+        self.chunker = Chunk(token_counter=_estimate_tokens)
+
+    def test_headings_start_new_chunks(self):
+        """测试：标题处切分，不同章节的内容不会合并到同一片段。"""
+        text = "# Java\n工作流引擎的设计。\n\n# Python\n异步任务队列。\n"
+        chunks = self.chunker.chunk_text(text, max_tokens=100)
+        self.assertEqual(chunks, ["# Java\n工作流引擎的设计。", "# Python\n异步任务队列。"])
+
+    def test_chunks_respect_token_limit_and_overlap(self):
+        """测试：片段不超过token上限，相邻片段以完整句子重叠。"""
+        text = " ".join(f"Sentence number {i} is here." for i in range(40))
+        chunks = self.chunker.chunk_text(text, max_tokens=30, overlap_tokens=8)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(_estimate_tokens(chunk), 30)
+        last_sentence = chunks[0].split(". ")[-1]
+        self.assertTrue(chunks[1].startswith(last_sentence.rstrip(".")))
+
+    def test_long_word_is_hard_split(self):
+        """测试：没有任何边界的超长文本按token硬切分。"""
+        chunks = self.chunker.chunk_text("a" * 600, max_tokens=40, overlap_tokens=0)
+        self.assertEqual([len(c) for c in chunks], [240, 240, 120])
+
+    def test_stream_matches_string_input(self):
+        """测试：按行流式输入与整段字符串输入得到相同的结果。"""
+        text = "# 标题\n第一段。第二句。\n\n```\ncode block\n```\n\n最后一段。\n"
+        self.assertEqual(list(self.chunker.iter_chunks(io.StringIO(text), max_tokens=8)),
+                         self.chunker.chunk_text(text, max_tokens=8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from .embedding import EmbeddingMismatchError, OnnxEmbeddingFunction, check_embedding_compatibility
+
+
+class TestEmbeddingCompatibility(unittest.TestCase):
+
+    def test_new_collection_records_model(self):
+        self.assertEqual(
+            check_embedding_compatibility(None, has_vectors=False, model_name="m", variant="int8"),
+            {"embedding_model": "m", "embedding_variant": "int8"})
+
+    def test_legacy_collection_assumes_default_model(self):
+        """测试：未记录嵌入信息的旧集合按 all-MiniLM-L6-v2 处理，换用其他模型时报错。"""
+        self.assertEqual(
+            check_embedding_compatibility({}, has_vectors=True, model_name="all-MiniLM-L6-v2", variant="fp32"),
+            {"embedding_model": "all-MiniLM-L6-v2", "embedding_variant": "fp32"})
+        with self.assertRaises(EmbeddingMismatchError):
+            check_embedding_compatibility({}, has_vectors=True, model_name="bge-small-zh", variant="fp32")
+
+    def test_same_model_other_backend_is_allowed(self):
+        """测试：同一模型换用不同后端（如 int8 量化）只给出警告，不阻止使用。"""
+        metadata = {"embedding_model": "m", "embedding_variant": "fp32"}
+        self.assertIsNone(check_embedding_compatibility(metadata, True, model_name="m", variant="int8"))
+        with self.assertRaises(EmbeddingMismatchError):
+            check_embedding_compatibility(metadata, True, model_name="other", variant="fp32")
+
+
+@unittest.skipUnless(importlib.util.find_spec("onnx"), "exporting ONNX models requires the onnx package")
+class TestOnnxEmbeddingFunction(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import torch
+        from transformers import BertConfig, BertModel, BertTokenizerFast
+
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        model_path = Path(cls.tmp_dir.name) / "tiny-bert"
+        model_path.mkdir()
+        vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list("abcdefghijklmnopqrstuvwxyz")
+        (model_path / "vocab.txt").write_text("\n".join(vocab))
+        BertTokenizerFast(vocab_file=str(model_path / "vocab.txt")).save_pretrained(str(model_path))
+        torch.manual_seed(0)
+        BertModel(BertConfig(vocab_size=len(vocab), hidden_size=16, num_hidden_layers=1,
+                             num_attention_heads=2, intermediate_size=32)).save_pretrained(str(model_path))
+        cls.model_path = model_path
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_matches_pytorch_mean_pooling(self):
+        """测试：导出的 ONNX 模型输出与 PyTorch 的均值池化+归一化结果一致，且按输入顺序返回。"""
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        texts = ["a b c d e f g", "x", "h i j"]
+        ef = OnnxEmbeddingFunction(str(self.model_path), batch_size=2,
+                                   model_dir=str(Path(self.tmp_dir.name) / "onnx"))
+        vectors = ef(texts)
+
+        tokenizer = AutoTokenizer.from_pretrained(str(self.model_path))
+        model = AutoModel.from_pretrained(str(self.model_path)).eval()
+        for text, vector in zip(texts, vectors):
+            with torch.no_grad():
+                hidden = model(**tokenizer([text], return_tensors="pt")).last_hidden_state
+            expected = torch.nn.functional.normalize(hidden.mean(1), dim=1)[0].numpy()
+            np.testing.assert_allclose(vector, expected, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
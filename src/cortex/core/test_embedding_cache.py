@@ -0,0 +1,50 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from .embedding_cache import EmbeddingCache, CachedEmbeddingFunction
+
+
+def _fake_model(texts):
+    return [np.array([len(t), 1.0, 0.5], dtype=np.float32) for t in texts]
+
+
+class TestCachedEmbeddingFunction(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.tmp_dir.name)
+        self.model = MagicMock(side_effect=_fake_model)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_only_uncached_texts_hit_the_model(self):
+        """测试：相同文本只计算一次嵌入，缓存跨实例持久化。"""
+        ef = CachedEmbeddingFunction(self.model, EmbeddingCache(self.cache_dir, "m/1", 10))
+        first = ef(["a", "bb", "a"])
+        self.assertEqual(self.model.call_args.args[0], ["a", "bb"])
+        np.testing.assert_allclose(first[0], [1.0, 1.0, 0.5])
+
+        reopened = CachedEmbeddingFunction(self.model, EmbeddingCache(self.cache_dir, "m/1", 10))
+        second = reopened(["bb", "ccc"])
+        self.assertEqual(self.model.call_args.args[0], ["ccc"])
+        np.testing.assert_allclose(second[0], [2.0, 1.0, 0.5])
+        self.assertEqual((reopened.hits, reopened.misses), (1, 1))
+
+    def test_lru_eviction_respects_capacity(self):
+        """测试：超过容量时淘汰最久未使用的向量。"""
+        cache = EmbeddingCache(self.cache_dir, "m", 2)
+        cache.put_many({"a": np.ones(3), "b": np.ones(3)})
+        cache.get_many(["a"])
+        cache.put_many({"c": np.zeros(3)})
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(set(cache.get_many(["a", "b", "c"])), {"a", "c"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import hashlib
+import tempfile
+import unittest
+from pathlib import Path
+
+from .hash_index import FileHashIndex, BloomFilter
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class TestFileHashIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / "index.bin"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_reference_counting(self):
+        """测试：哈希在最后一个引用它的片段被删除后才从索引中移除。"""
+        index = FileHashIndex(self.path)
+        index.add([_hash("a"), _hash("a"), _hash("b")])
+        index.remove([_hash("a")])
+        self.assertTrue(index.lookup(_hash("a")))
+        index.remove([_hash("a")])
+        self.assertFalse(index.lookup(_hash("a")))
+        self.assertEqual(len(index), 1)
+
+    def test_sidecar_roundtrip_and_staleness(self):
+        """测试：旁路文件可以重新加载；修改后未保存或片段总数不一致时视为过期。"""
+        index = FileHashIndex(self.path)
+        index.add([_hash("a"), _hash("b")])
+        index.save(total_chunks=2)
+
+        reloaded = FileHashIndex(self.path)
+        self.assertTrue(reloaded.load(expected_chunks=2))
+        self.assertTrue(reloaded.lookup(_hash("b")))
+        self.assertFalse(FileHashIndex(self.path).load(expected_chunks=3))
+
+        reloaded.add([_hash("c")])
+        self.assertFalse(FileHashIndex(self.path).load(expected_chunks=2))
+
+    def test_roundtrip_with_non_sha256_keys(self):
+        """测试：非 SHA-256 十六进制的哈希（非十六进制、过短、大写）不会中断保存，且重新加载后仍然存在。"""
+        index = FileHashIndex(self.path)
+        odd_hashes = ["not-a-hash", "abc", _hash("b").upper()]
+        index.add([_hash("a"), *odd_hashes, "abc"])
+        index.save(total_chunks=5)
+
+        reloaded = FileHashIndex(self.path)
+        self.assertTrue(reloaded.load(expected_chunks=5))
+        self.assertEqual(len(reloaded), 4)
+        self.assertTrue(all(reloaded.lookup(h) for h in [_hash("a"), *odd_hashes]))
+        self.assertFalse(reloaded.lookup(_hash("b")))
+        reloaded.remove(["abc"])
+        self.assertTrue(reloaded.lookup("abc"))
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        """测试：已加入的哈希总是返回“可能存在”，大部分未加入的哈希确定不存在。"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bloom = BloomFilter(Path(tmp_dir) / "bloom.bin", capacity=1000)
+            added = [_hash(str(i)) for i in range(1000)]
+            bloom.add(added)
+            self.assertTrue(all(bloom.lookup(h) is None for h in added))
+            misses = sum(bloom.lookup(_hash(f"x{i}")) is False for i in range(1000))
+            self.assertGreater(misses, 950)
+
+            bloom.save(total_chunks=1000)
+            reloaded = BloomFilter(Path(tmp_dir) / "bloom.bin", capacity=1000)
+            self.assertTrue(reloaded.load(expected_chunks=1000))
+            self.assertIsNone(reloaded.lookup(added[0]))
+
+            reloaded.add(["not-a-hash", "abc"])
+            self.assertIsNone(reloaded.lookup("not-a-hash"))
+            self.assertIsNone(reloaded.lookup("abc"))
+
+
+if __name__ == '__main__':
+    unittest.main()
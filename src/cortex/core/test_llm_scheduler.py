@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import unittest
+
+from .llm_scheduler import COALESCED_REQUESTS, Priority, ProviderScheduler, SingleFlight, _Ticket
+
+
+class TestProviderScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.granted = []
+
+    def _submit(self, scheduler, name, priority, flow="default"):
+        ticket = _Ticket(scheduler, priority, flow, lambda: self.granted.append(name))
+        scheduler.submit(ticket)
+        return ticket
+
+    def test_interactive_before_background(self):
+        """测试：槽位释放时，后提交的交互式请求先于排队的后台请求获得槽位。"""
+        scheduler = ProviderScheduler("test", max_concurrency=1, reserved_interactive=0)
+        running = self._submit(scheduler, "b1", Priority.BACKGROUND)
+        self._submit(scheduler, "b2", Priority.BACKGROUND)
+        self._submit(scheduler, "i1", Priority.INTERACTIVE)
+        scheduler.release(running)
+        self.assertEqual(self.granted, ["b1", "i1"])
+
+    def test_reserved_slots_for_interactive(self):
+        """测试：后台请求不会占满槽位，交互式请求可以立即执行。"""
+        scheduler = ProviderScheduler("test", max_concurrency=2, reserved_interactive=1)
+        self._submit(scheduler, "b1", Priority.BACKGROUND)
+        self._submit(scheduler, "b2", Priority.BACKGROUND)
+        self._submit(scheduler, "i1", Priority.INTERACTIVE)
+        self.assertEqual(self.granted, ["b1", "i1"])
+        self.assertEqual(scheduler.stats()["background"], (1, 1))
+
+    def test_round_robin_between_flows(self):
+        """测试：同一优先级内各流轮流获得槽位。"""
+        scheduler = ProviderScheduler("test", max_concurrency=1, reserved_interactive=0)
+        running = self._submit(scheduler, "hold", Priority.BACKGROUND, flow="hold")
+        tickets = {name: self._submit(scheduler, name, Priority.BACKGROUND, flow=name[0])
+                   for name in ["x1", "x2", "x3", "y1"]}
+        scheduler.release(running)
+        while len(self.granted) < 5:
+            scheduler.release(tickets[self.granted[-1]])
+        self.assertEqual(self.granted, ["hold", "x1", "y1", "x2", "x3"])
+
+    def test_cancelled_async_waiter_leaves_queue(self):
+        """测试：排队中的异步请求被取消后从队列中撤回，不占用之后释放的槽位。"""
+        scheduler = ProviderScheduler("test", max_concurrency=1, reserved_interactive=0)
+
+        async def scenario():
+            running = await scheduler.aacquire(Priority.INTERACTIVE, "a")
+            waiter = asyncio.create_task(scheduler.aacquire(Priority.INTERACTIVE, "b"))
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.stats()["interactive"], (1, 1))
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            scheduler.release(running)
+            return scheduler.stats()["interactive"]
+
+        self.assertEqual(asyncio.run(scenario()), (0, 0))
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_identical_calls_share_result(self):
+        """测试：相同键的并发调用只执行一次，结果共享。"""
+        flights = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def call(flight):
+            calls.append(flight)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        before = COALESCED_REQUESTS.get(provider="local")
+        results = []
+        leader = threading.Thread(target=lambda: results.append(
+            flights.do(("local", "m", "p"), Priority.BACKGROUND, "a", call)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(
+            flights.do(("local", "m", "p"), Priority.INTERACTIVE, "b", call)))
+        follower.start()
+        while COALESCED_REQUESTS.get(provider="local") == before:
+            threading.Event().wait(0.01)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(results, ["result", "result"])
+        self.assertEqual(len(calls), 1)
+        # 交互式调用方加入后，共享的请求提升为交互式优先级
+        self.assertEqual(calls[0].priority, Priority.INTERACTIVE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import patch
+
+from .metrics import MetricsRegistry, timed, timed_iter, trace_stages
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_render_prometheus_text(self):
+        """测试：直方图按累计分桶导出，计数器的标签值会被转义。"""
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage="embed")
+        histogram.observe(0.5, stage="embed")
+        histogram.observe(5, stage="embed")
+        registry.counter("requests_total", "Requests.", ("path",)).inc(path='a"b')
+        registry.register_callback("queue_depth", "Depth.", "gauge", (), lambda: {(): 3})
+
+        text = registry.render()
+        self.assertIn("# TYPE latency_seconds histogram", text)
+        self.assertIn('latency_seconds_bucket{stage="embed",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{stage="embed",le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{stage="embed",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_sum{stage="embed"} 5.55', text)
+        self.assertIn('requests_total{path="a\\"b"} 1', text)
+        self.assertIn("queue_depth 3", text)
+
+    @patch("cortex.core.metrics.log")
+    def test_failing_callback_is_logged_and_skipped(self, mock_log):
+        """测试：回调指标采集失败时记录错误，其他指标照常导出。"""
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests.").inc()
+
+        def broken():
+            raise RuntimeError("db closed")
+        registry.register_callback("queue_depth", "Depth.", "gauge", (), broken)
+
+        text = registry.render()
+        self.assertIn("requests_total 1", text)
+        self.assertNotIn("queue_depth", text)
+        mock_log.error.assert_called_once()
+        self.assertIn("db closed", mock_log.error.call_args.args[0])
+
+    def test_labels_must_match(self):
+        counter = MetricsRegistry().counter("requests_total", "Requests.", ("path",))
+        with self.assertRaises(ValueError):
+            counter.inc(route="/")
+
+
+class TestStageTrace(unittest.TestCase):
+
+    def test_trace_collects_stages(self):
+        """测试：trace_stages 收集代码块内记录的阶段耗时，惰性迭代器在迭代结束时记录一次。"""
+        with trace_stages() as trace:
+            with timed("query", "embed"):
+                pass
+            self.assertEqual(list(timed_iter(iter([1, 2]), "ingest", "chunk")), [1, 2])
+        with timed("query", "outside"):
+            pass
+
+        self.assertEqual([(p, s) for p, s, _ in trace], [("query", "embed"), ("ingest", "chunk")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ollama
+
+from . import model_chat
+from .model_chat import (
+    LLMUnavailableError,
+    generate_chat_completion,
+    generate_chat_completion_stream,
+    agenerate_chat_completion,
+)
+
+
+@patch('cortex.core.model_chat.LLM_RETRY_BACKOFF', 0)
+@patch('cortex.core.model_chat.SYNTHESIS_MODEL_PROVIDER', 'local')
+class TestGenerateChatCompletion(unittest.TestCase):
+
+    @patch('cortex.core.model_chat._call_local_ollama')
+    def test_retry_on_transient_error(self, mock_call):
+        """测试：连接失败时重试，成功后返回结果。"""
+        mock_call.side_effect = [ConnectionError("refused"), "ok"]
+        self.assertEqual(generate_chat_completion("prompt"), "ok")
+        self.assertEqual(mock_call.call_count, 2)
+
+    @patch('cortex.core.model_chat._call_local_ollama')
+    def test_no_retry_on_client_error(self, mock_call):
+        """测试：非暂时性错误（如模型不存在）不重试，返回标准错误信息。"""
+        mock_call.side_effect = ollama.ResponseError("model not found", 404)
+        self.assertEqual(generate_chat_completion("prompt"), model_chat.LLM_ERROR_MESSAGE)
+        mock_call.assert_called_once()
+
+    @patch('cortex.core.model_chat._call_local_ollama')
+    def test_raise_on_error_after_retries(self, mock_call):
+        """测试：重试耗尽后，raise_on_error 模式抛出 LLMUnavailableError。"""
+        mock_call.side_effect = ollama.ResponseError("overloaded", 503)
+        with self.assertRaises(LLMUnavailableError):
+            generate_chat_completion("prompt", raise_on_error=True)
+        self.assertEqual(mock_call.call_count, model_chat.LLM_MAX_RETRIES + 1)
+
+    @patch('cortex.core.model_chat._acall_local_ollama')
+    def test_async_completion(self, mock_call):
+        """测试：异步版本同样具备重试能力。"""
+        async def fake_call(clients, prompt):
+            if mock_call.call_count == 1:
+                raise TimeoutError()
+            return "async ok"
+        mock_call.side_effect = fake_call
+        self.assertEqual(asyncio.run(agenerate_chat_completion("prompt")), "async ok")
+        self.assertEqual(mock_call.call_count, 2)
+
+    @patch('cortex.core.model_chat._stream_local_ollama')
+    def test_stream_does_not_retry_after_output(self, mock_stream):
+        """测试：流式输出开始后出错不再重试，避免重复文本。"""
+        def broken_stream(prompt):
+            yield "Hello"
+            raise ConnectionError("reset")
+        mock_stream.side_effect = broken_stream
+        self.assertEqual(list(generate_chat_completion_stream("prompt")), ["Hello"])
+        mock_stream.assert_called_once()
+
+
+class TestQwenParsing(unittest.TestCase):
+
+    def test_parse_sse_line(self):
+        line = 'data:{"output":{"choices":[{"message":{"content":"你好"}}]}}'
+        self.assertEqual(model_chat._parse_qwen_sse_line(line), "你好")
+        self.assertIsNone(model_chat._parse_qwen_sse_line("event:result"))
+        self.assertIsNone(model_chat._parse_qwen_sse_line(""))
+
+    def test_transient_http_status(self):
+        response = MagicMock(status_code=429)
+        self.assertTrue(model_chat._is_transient_error(
+            model_chat.requests.HTTPError(response=response)))
+        response.status_code = 401
+        self.assertFalse(model_chat._is_transient_error(
+            model_chat.requests.HTTPError(response=response)))
+
+
+
+class TestAsyncClients(unittest.TestCase):
+
+    def test_aclose_closes_clients_of_current_loop(self):
+        """测试：aclose_llm_clients 通过公开的 close 接口关闭当前事件循环的客户端，之后会重新创建。"""
+        async def run():
+            clients = model_chat._get_async_clients()
+            with patch.object(clients.ollama, "close", wraps=clients.ollama.close) as ollama_close:
+                await model_chat.aclose_llm_clients()
+            ollama_close.assert_awaited_once()
+            self.assertTrue(clients.http.is_closed)
+            self.assertIsNot(model_chat._get_async_clients(), clients)
+            await model_chat.aclose_llm_clients()
+
+        asyncio.run(run())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,24 @@
 from enum import Enum
+import atexit
+import os
+import queue
 import threading
 from pathlib import Path
 from datetime import datetime
+from typing import IO, List, Optional, Tuple, Union
 import sys
 
-LOG_DIR = "./logs"
+# 日志模块被 core.config 导入，配置项直接从环境变量读取，避免循环依赖
+# 日志目录默认位于项目根目录下（与 core.config.CORTEX_HOME 一致），不随启动时的工作目录变化
+LOG_DIR = os.getenv("LOG_DIR", str(Path(__file__).resolve().parent.parent.parent.parent / "logs"))
+# 低于该级别的日志直接丢弃：DEBUG / INFO / WARN / ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# 单个日志文件的大小上限（字节），超出后在同一小时内切换到新文件；0 表示不限制
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 100 * 1024 * 1024))
+# 后台写线程等待新日志的最长时间（秒），也是日志落盘的最大延迟
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 0.5))
+# 后台写线程每次最多合并写入的日志条数
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 512))
 
 
 class LogLevel(Enum):
@@ -15,35 +29,191 @@ class LogLevel(Enum):
     ERROR = 'ERROR'
 
 
+_LEVEL_ORDER = {LogLevel.DEBUG: 10, LogLevel.INFO: 20, LogLevel.WARN: 30, LogLevel.ERROR: 40}
+# 其他日志库常用的级别名称
+_LEVEL_ALIASES = {"WARNING": LogLevel.WARN}
+
+# (时间, 级别, 线程名, 业务类型, 消息)；格式化在后台写线程中完成
+_Record = Tuple[datetime, LogLevel, str, str, str]
+
+
+def _format(record: _Record) -> str:
+    now, level, thread_name, biz_type, message = record
+    ms = now.microsecond // 1000
+    return (f"{now.strftime('%Y-%m-%d %H:%M:%S')}.{ms:03d} | {level.name:>4} | "
+            f"{thread_name:<12} | {biz_type} {message}\n")
+
+
+class LogWriter:
+    """
+    日志的后台写入器。
+
+    调用方只把日志记录放入队列，由后台线程批量格式化后写入控制台和持久打开的日志文件。
+    日志文件按小时命名（%Y%m%d_%H.log），跨小时或超过大小上限时切换文件；
+    同一小时内因大小切换的文件依次命名为 %Y%m%d_%H.1.log、%Y%m%d_%H.2.log ...
+    进程退出时写完队列中剩余的日志。
+    """
+
+    def __init__(self, log_dir: Path = Path(LOG_DIR), max_bytes: int = LOG_MAX_BYTES,
+                 flush_interval: float = LOG_FLUSH_INTERVAL, batch_size: int = LOG_BATCH_SIZE,
+                 console: bool = True):
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.console = console
+        self.file_path: Optional[Path] = None
+        self._queue: "queue.Queue[Union[_Record, threading.Event, None]]" = queue.Queue()
+        self._file: Optional[IO[str]] = None
+        self._file_hour: Optional[str] = None
+        self._file_size = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def put(self, record: _Record):
+        if self._closed:
+            # 进程退出阶段后台线程已停止，直接同步写入
+            with self._write_lock:
+                self.write_batch([record])
+            return
+        if self._thread is None:
+            self._start()
+        self._queue.put(record)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.log_dir.mkdir(parents=True, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """阻塞直到此前放入队列的日志都已写入文件。"""
+        if self._thread is None or self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """写完剩余日志并关闭文件，之后的日志直接同步写入。"""
+        if self._thread is None or self._closed:
+            return
+        # 先切换为同步写入，之前入队的日志由后台线程在退出前写完
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch: List[_Record] = []
+            waiters: List[threading.Event] = []
+            stop = False
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                with self._write_lock:
+                    self.write_batch(batch)
+            except Exception as e:
+                sys.stderr.write(f"Failed to write log records: {e}\n")
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                with self._write_lock:
+                    self._close_file()
+                return
+
+    def write_batch(self, batch: List[_Record]):
+        """格式化并写入一批日志，每批只刷新一次控制台和文件缓冲区。"""
+        if not batch:
+            return
+        lines = [_format(record) for record in batch]
+        if self.console:
+            sys.stdout.write("".join(lines))
+            sys.stdout.flush()
+        for record, line in zip(batch, lines):
+            self._rotate_if_needed(record[0], len(line.encode('utf-8')))
+            self._file.write(line)
+            self._file_size += len(line.encode('utf-8'))
+        self._file.flush()
+
+    def _rotate_if_needed(self, now: datetime, incoming: int):
+        hour = now.strftime('%Y%m%d_%H')
+        if self._file is not None and hour == self._file_hour and \
+                (self.max_bytes <= 0 or self._file_size + incoming <= self.max_bytes or self._file_size == 0):
+            return
+        self._close_file()
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        path = self.log_dir / f"{hour}.log"
+        index = 0
+        # 同一小时内已存在且写满的文件（包括进程重启前写入的）跳过
+        while self.max_bytes > 0 and path.exists() and path.stat().st_size + incoming > self.max_bytes:
+            index += 1
+            path = self.log_dir / f"{hour}.{index}.log"
+        self._file = path.open('a', encoding='utf-8')
+        self._file_hour = hour
+        self._file_size = path.stat().st_size
+        self.file_path = path
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_writer = LogWriter()
+_unknown_levels: set = set()
+
+
+def _parse_level(name: str, writer: LogWriter) -> LogLevel:
+    """解析日志级别名称；无法识别时使用 INFO，并提示一次（而不是静默忽略配置）。"""
+    name = name.upper()
+    if name in LogLevel.__members__:
+        return LogLevel[name]
+    if name in _LEVEL_ALIASES:
+        return _LEVEL_ALIASES[name]
+    if name not in _unknown_levels:
+        _unknown_levels.add(name)
+        writer.put((datetime.now(), LogLevel.WARN, threading.current_thread().name, __name__,
+                    f"Unknown log level '{name}', expected one of {', '.join(LogLevel.__members__)}; using INFO."))
+    return LogLevel.INFO
+
+
 class SimpleLogger:
     """logger"""
-    _locks = {}
     _biz_type: str = "default"
 
-    def __init__(self, biz_type: str, log_dir: Path = Path(LOG_DIR)):
+    def __init__(self, biz_type: str, level: str = LOG_LEVEL, writer: LogWriter = _writer):
         self._biz_type = biz_type
-        log_dir.mkdir(exist_ok=True)
-        file_name = f"{datetime.now().strftime('%Y%m%d_%H')}.log"
-        self.file_path = log_dir / file_name
-        self.lock = self._locks.setdefault(biz_type, threading.Lock())
-        # with self.lock:
-        # with self.file_path.open('a', encoding='utf-8') as f:
-        # f.write(f"# {biz_type} write new log: {datetime.now()}\n")
+        self.level = _parse_level(level, writer)
+        self._writer = writer
 
-    def log(self, level: LogLevel, message: str):
-        now = datetime.now()
-        ms = now.microsecond // 1000
-        line = line = (f"{now.strftime('%Y-%m-%d %H:%M:%S')}.{ms:03d} | {level.name:>4} | "
-                       f"{threading.current_thread().name:<12} | {self._biz_type} {message}\n")
+    def is_enabled_for(self, level: LogLevel) -> bool:
+        return _LEVEL_ORDER[level] >= _LEVEL_ORDER[self.level]
 
-        # 控制台（无颜色）
-        sys.stdout.write(line)
-        sys.stdout.flush()
-
-        # append log to log file
-        with self.lock:
-            with self.file_path.open('a', encoding='utf-8') as f:
-                f.write(line)
+    def log(self, level: LogLevel, message: str):
+        if not self.is_enabled_for(level):
+            return
+        self._writer.put((datetime.now(), level, threading.current_thread().name, self._biz_type, message))
 
     def info(self, message: str):
         self.log(LogLevel.INFO, message)
@@ -51,6 +221,9 @@ class SimpleLogger:
     def warn(self, message: str):
         self.log(LogLevel.WARN, message)
 
+    # 与标准库 logging 的方法名保持一致
+    warning = warn
+
     def error(self, message: str):
         self.log(LogLevel.ERROR, message)
 
@@ -67,4 +240,14 @@ def get_logger(biz_type: str) -> SimpleLogger:
     return _loggers[biz_type]
 
 
+def flush_logs(timeout: Optional[float] = None) -> bool:
+    """等待队列中的日志写入完成，用于需要立即查看日志文件的场景。"""
+    return _writer.flush(timeout)
+
+
+def shutdown_logging():
+    """写完剩余日志并关闭日志文件，应在应用关闭时调用（进程退出时也会自动调用）。"""
+    _writer.close()
+
+
 # log = _get_logger("default")
@@ -0,0 +1,74 @@
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+from .logger import LogLevel, LogWriter, SimpleLogger, _format, _unknown_levels
+
+
+class TestLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_dir = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _record(self, hour: int, message: str = "message"):
+        return datetime(2024, 5, 1, hour, 30), LogLevel.INFO, "MainThread", "test", message
+
+    def test_rotates_by_hour(self):
+        """测试：日志按记录所在的小时写入不同文件，而不是固定为创建时的文件名。"""
+        writer = LogWriter(self.log_dir, max_bytes=0, console=False)
+        writer.write_batch([self._record(9), self._record(10)])
+        writer._close_file()
+
+        self.assertEqual(sorted(p.name for p in self.log_dir.iterdir()),
+                         ["20240501_09.log", "20240501_10.log"])
+
+    def test_rotates_by_size(self):
+        """测试：超过大小上限后同一小时内切换到编号递增的新文件。"""
+        line_size = len(_format(self._record(9, "x" * 10)))
+        writer = LogWriter(self.log_dir, max_bytes=line_size * 2, console=False)
+        writer.write_batch([self._record(9, "x" * 10) for _ in range(5)])
+        writer._close_file()
+
+        lines = {p.name: len(p.read_text().splitlines()) for p in self.log_dir.iterdir()}
+        self.assertEqual(lines, {"20240501_09.log": 2, "20240501_09.1.log": 2, "20240501_09.2.log": 1})
+
+    def test_background_writer_flush_and_level_filter(self):
+        """测试：日志由后台线程写入，flush 后可见；低于配置级别的日志被丢弃。"""
+        writer = LogWriter(self.log_dir, console=False)
+        logger = SimpleLogger("test", level="INFO", writer=writer)
+        logger.debug("hidden")
+        logger.info("visible")
+        self.assertTrue(writer.flush(timeout=5))
+        writer.close()
+
+        content = writer.file_path.read_text()
+        self.assertIn("| INFO | MainThread   | test visible", content)
+        self.assertNotIn("hidden", content)
+        # 关闭后的日志同步写入，不会丢失
+        logger.error("after close")
+        writer._close_file()
+        self.assertIn("after close", writer.file_path.read_text())
+
+    def test_level_names(self):
+        """测试：WARNING 视为 WARN，无法识别的级别回退到 INFO 并给出提示；warning() 与 warn() 等价。"""
+        writer = LogWriter(self.log_dir, console=False)
+        logger = SimpleLogger("test", level="WARNING", writer=writer)
+        self.assertEqual(logger.level, LogLevel.WARN)
+        logger.warning("careful")
+        self.addCleanup(_unknown_levels.discard, "VERBOSE")
+        self.assertEqual(SimpleLogger("test", level="verbose", writer=writer).level, LogLevel.INFO)
+        self.assertTrue(writer.flush(timeout=5))
+        writer.close()
+
+        content = writer.file_path.read_text()
+        self.assertIn("| WARN | MainThread   | test careful", content)
+        self.assertIn("Unknown log level 'VERBOSE'", content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,21 +1,87 @@
 # main.py
+import json
+import time
 import uvicorn
-from fastapi import FastAPI, HTTPException
-from cortex.core.models import IngestRequest, QueryRequest, ContextResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from cortex.core.models import (
+    IngestRequest, QueryRequest, ContextResponse, IngestJobResponse,
+    BatchIngestRequest, BatchIngestResponse, BatchQueryRequest, BatchQueryResponse
+)
 from cortex.services.ingestion import IngestionService
 from cortex.services.retrieval import RetrievalService
-from cortex.logger.logger import get_logger
+from cortex.services.storage import storage_service
+from cortex.services.jobs import IngestionJobQueue, QueueFullError
+from cortex.services.startup import StartupTask
+from cortex.core.config import STARTUP_BACKGROUND_INIT, STORAGE_MODE, API_WORKERS
+from cortex.core.llm_scheduler import llm_request_context
+from cortex.core.model_chat import aclose_llm_clients
+from cortex.core.metrics import metrics
+from cortex.logger.logger import get_logger, flush_logs
 
 log = get_logger(__name__)
 
+ingestion_service = IngestionService(storage_service=storage_service)
+retrieval_service = RetrievalService(storage_service=storage_service)
+ingestion_jobs = IngestionJobQueue(ingestion_service=ingestion_service)
+startup_task = StartupTask(storage_service=storage_service)
+
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "cortex_http_request_duration_seconds", "HTTP request latency in seconds.", ("method", "route", "status"))
+
+
+def _cache_stats():
+    return {**retrieval_service.cache_stats(), **storage_service.cache_stats(), **ingestion_service.cache_stats()}
+
+
+metrics.register_callback(
+    "cortex_cache_hits_total", "Cache hits by cache.", "counter", ("cache",),
+    lambda: {(name,): stats["hits"] for name, stats in _cache_stats().items()})
+metrics.register_callback(
+    "cortex_cache_misses_total", "Cache misses by cache.", "counter", ("cache",),
+    lambda: {(name,): stats["misses"] for name, stats in _cache_stats().items()})
+metrics.register_callback(
+    "cortex_ingest_jobs_pending", "Ingestion jobs queued or running.", "gauge", (),
+    lambda: {(): ingestion_jobs.pending_count()})
+metrics.register_callback(
+    "cortex_ready", "Whether the vector store and embedding model are loaded.", "gauge", (),
+    lambda: {(): int(storage_service.is_ready)})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if STARTUP_BACKGROUND_INIT:
+        # 在后台加载向量数据库和嵌入模型，不阻塞端口监听
+        startup_task.start()
+    ingestion_jobs.start()
+    yield
+    ingestion_jobs.stop()
+    storage_service.save_hash_index()
+    await aclose_llm_clients()
+    flush_logs(timeout=5)
+
+
 app = FastAPI(
     title="个人记忆层助手 (Personal Memory Assistant)",
     description="一个本地优先的、为用户提供智能上下文的AI助手核心引擎。",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
-ingestion_service = IngestionService()
-retrieval_service = RetrievalService()
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started_at = time.perf_counter()
+    # 按客户端划分LLM调度的流，单个客户端的大量请求不会让其他客户端一直等待
+    client = request.client.host if request.client else "unknown"
+    with llm_request_context(flow=f"http:{client}"):
+        response = await call_next(request)
+    # 使用路由模板而不是实际路径作为标签，避免 /ingest/{job_id} 等路径产生大量时间序列
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started_at, method=request.method,
+                                 route=route, status=response.status_code)
+    return response
 
 
 @app.get("/", tags=["Health Check"])
@@ -24,19 +90,70 @@ def read_root():
     return {"status": "ok", "message": "Memory Assistant is running."}
 
 
+@app.get("/health/live", tags=["Health Check"])
+def liveness():
+    """存活检查：进程能响应请求即返回200，不触发任何组件的初始化。"""
+    return {"status": "ok"}
+
+
+@app.get("/health/ready", tags=["Health Check"])
+def readiness():
+    """就绪检查：向量数据库和嵌入模型初始化完成后返回200，之前返回503，并附带各组件的状态。"""
+    status = startup_task.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.post("/warmup", tags=["Health Check"])
+def warmup():
+    """显式预热：完成初始化，计算一条嵌入并向LLM发送一次最小请求，返回各组件的状态和耗时。"""
+    status = startup_task.warmup()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/metrics", tags=["Health Check"])
+def export_metrics():
+    """以 Prometheus 文本格式导出各阶段耗时、LLM调用与token数、缓存命中、任务队列长度等指标。"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.post("/ingest", tags=["Memory Ingestion"], status_code=202)
 def ingest_memory(request: IngestRequest):
     """
     摄入一份新的记忆。
-    这是一个异步的过程，客户端可以立即得到响应。
+    任务进入后台队列后立即返回任务ID，可通过 GET /ingest/{job_id} 查询进度。
+    """
+    try:
+        job_id = ingestion_jobs.submit(
+            request.content, request.source, request.description, request.metadata)
+        return {"message": "Ingestion task accepted.", "job_id": job_id}
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/ingest/batch", response_model=BatchIngestResponse, tags=["Memory Ingestion"])
+def ingest_memory_batch(request: BatchIngestRequest) -> BatchIngestResponse:
+    """
+    批量摄入多份记忆。
+    跨文档合并记忆片段并按批计算嵌入，返回每个文档的摄入结果。
     """
     try:
-        ingestion_service.process(request.content, request.source)
-        return {"message": "Ingestion task accepted."}
+        results = ingestion_service.process_batch(request.documents)
+        return BatchIngestResponse(results=results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/ingest/{job_id}", response_model=IngestJobResponse, tags=["Memory Ingestion"])
+def get_ingest_job(job_id: str) -> IngestJobResponse:
+    """查询摄入任务的状态、当前阶段和错误信息。"""
+    job = ingestion_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return IngestJobResponse(**job)
+
+
 @app.post("/query", response_model=ContextResponse, tags=["Memory Retrieval"])
 def query_memory(request: QueryRequest) -> ContextResponse:
     """
@@ -49,6 +166,57 @@ def query_memory(request: QueryRequest) -> ContextResponse:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/query/batch", response_model=BatchQueryResponse, tags=["Memory Retrieval"])
+def query_memory_batch(request: BatchQueryRequest) -> BatchQueryResponse:
+    """
+    批量查询多个主题。
+    过滤条件相同的查询合并为一次嵌入计算和检索，摘要合成并发进行。
+    """
+    try:
+        results = retrieval_service.query_and_synthesize_batch(
+            request.queries, synthesize=request.synthesize)
+        return BatchQueryResponse(results=results)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _sse_event(data, event: str = "message") -> str:
+    """将数据编码为一条 Server-Sent Event。"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/query/stream", tags=["Memory Retrieval"])
+def query_memory_stream(request: QueryRequest) -> StreamingResponse:
+    """
+    根据查询主题检索记忆，并以 Server-Sent Events 流式返回上下文摘要。
+    事件顺序: sources（记忆来源列表）-> message（摘要文本片段，可多次）-> done；出错时发送 error。
+    """
+    def event_stream():
+        try:
+            retrieval_result = retrieval_service.retrieve_and_prepare_context(
+                request.query)
+            if not retrieval_result:
+                yield _sse_event([], event="sources")
+                yield _sse_event("未找到与您查询相关的记忆。")
+            else:
+                context_for_synthesis, sources, chunk_ids = retrieval_result
+                yield _sse_event(sources, event="sources")
+                for token in retrieval_service.synthesize_context_stream(context_for_synthesis, chunk_ids):
+                    yield _sse_event(token)
+            yield _sse_event("", event="done")
+        except Exception as e:
+            log.error(f"Error while streaming query response: {e}")
+            yield _sse_event(str(e), event="error")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 if __name__ == "__main__":
-    log.info("Starting Memory Assistant server...")
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    workers = API_WORKERS
+    if workers > 1 and STORAGE_MODE != "client":
+        # 每个进程各自打开数据库、加载嵌入模型，并发写入会相互冲突
+        log.warn(f"API_WORKERS={workers} requires STORAGE_MODE=client, starting a single worker.")
+        workers = 1
+    log.info(f"Starting Memory Assistant server with {workers} worker(s)...")
+    uvicorn.run("cortex.main:app" if workers > 1 else app, host="127.0.0.1", port=8000, workers=workers)
@@ -0,0 +1,202 @@
+from cortex.core.config import (
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_MMR_LAMBDA,
+    CONTEXT_DUPLICATE_THRESHOLD,
+    CONTEXT_MIN_FRAGMENT_TOKENS
+)
+from cortex.core.chunk import _estimate_tokens
+from cortex.logger.logger import get_logger
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+import re
+
+log = get_logger(__name__)
+
+_CONTEXT_HEADER = "相关历史记忆片段:\n\n"
+# 近似重复检测使用的词单元：连续的字母数字或单个CJK字符
+_WORD_RE = re.compile(r'[A-Za-z0-9_]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]')
+_TRUNCATION_MARK = "……"
+
+
+def _shingles(text: str) -> FrozenSet[Tuple[str, str]]:
+    """文本的词二元组集合，用于估算两个片段的内容重合度。"""
+    words = _WORD_RE.findall(text.lower())
+    return frozenset(zip(words, words[1:]))
+
+
+def _jaccard(a: FrozenSet, b: FrozenSet) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def strip_overlap(previous: str, following: str) -> str:
+    """
+    去掉 following 开头与 previous 末尾重复的部分并返回剩余文本。
+
+    分块器在相邻片段之间保留完整句子的重叠，重叠部分以空白与后续内容分隔，
+    因此只在 following 的空白处（或末尾）寻找与 previous 结尾相同的最长前缀。
+    """
+    limit = min(len(previous), len(following))
+    for k in range(limit, 0, -1):
+        if k < len(following) and not following[k].isspace():
+            continue
+        if previous.endswith(following[:k]):
+            return following[k:].lstrip()
+    return following
+
+
+class _Fragment:
+    """上下文中的一个片段：同一文档中连续的一个或多个记忆片段合并而成。"""
+
+    def __init__(self, memory: Dict[str, Any]):
+        self.source = memory['metadata'].get('source', '未知来源')
+        self.text = memory['text']
+        # (记忆片段ID, 在合并文本中的起始位置)
+        self.chunks: List[Tuple[str, int]] = [(memory['id'], 0)]
+
+    def append(self, memory: Dict[str, Any]):
+        remainder = strip_overlap(self.text, memory['text'])
+        if not remainder:
+            # 完全包含在前一个片段中
+            self.chunks.append((memory['id'], len(self.text)))
+            return
+        self.text += "\n" + remainder
+        self.chunks.append((memory['id'], len(self.text) - len(remainder)))
+
+    def chunk_ids(self, length: Optional[int] = None) -> List[str]:
+        """文本截断到 length 个字符后仍有内容保留的记忆片段ID。"""
+        return [chunk_id for chunk_id, start in self.chunks if length is None or start < length]
+
+
+class ContextPacker:
+    """
+    将检索到的记忆片段打包为合成模型的上下文。
+
+    - 以 MMR（最大边际相关性）确定片段顺序，与已选片段内容高度重合的近似重复片段直接丢弃
+    - 同一文档（file_hash 相同）中 chunk_index 连续的片段合并为一段，并去掉分块时保留的重叠文本
+    - 按顺序放入片段直到达到token预算，放不下的片段在剩余预算足够时截断后放入
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+                 duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD,
+                 min_fragment_tokens: int = CONTEXT_MIN_FRAGMENT_TOKENS,
+                 token_counter: Callable[[str], int] = _estimate_tokens):
+        """
+        Args:
+            token_budget: 上下文的token上限（按 token_counter 计算），0 表示不限制。
+            mmr_lambda: MMR 中相关性的权重，1 表示只按检索距离排序。
+            duplicate_threshold: 与已选片段的词二元组 Jaccard 相似度达到该值时视为近似重复。
+            min_fragment_tokens: 剩余预算低于该值时不再截断放入片段。
+            token_counter: token计数函数，默认使用近似估算，避免检索路径加载分词器。
+        """
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.min_fragment_tokens = min_fragment_tokens
+        self.count_tokens = token_counter
+
+    def pack(self, memories: List[Dict[str, Any]]) -> Optional[Tuple[str, List[str], List[str]]]:
+        """
+        Returns:
+            (待合成的上下文, 记忆来源列表, 按上下文顺序排列的记忆片段ID)；没有记忆时返回 None。
+        """
+        if not memories:
+            return None
+        selected = self._select(memories)
+        fragments = self._merge_adjacent(selected)
+        context, sources, chunk_ids, used_tokens = self._fit_budget(fragments)
+        log.info(f"Packed {len(chunk_ids)}/{len(memories)} memory chunks into {len(fragments)} fragments "
+                 f"(~{used_tokens} tokens, {len(memories) - len(selected)} near-duplicates dropped).")
+        return context, sources, chunk_ids
+
+    def _select(self, memories: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """按 MMR 排序记忆片段并丢弃近似重复的片段。"""
+        distances = [m.get('distance') or 0.0 for m in memories]
+        low, high = min(distances), max(distances)
+        span = (high - low) or 1.0
+        relevance = [1.0 - (d - low) / span for d in distances]
+        shingles = [_shingles(m['text']) for m in memories]
+
+        remaining = list(range(len(memories)))
+        max_similarity = [0.0] * len(memories)
+        selected: List[int] = []
+        while remaining:
+            best = max(remaining, key=lambda i: (
+                self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * max_similarity[i], -i))
+            remaining.remove(best)
+            selected.append(best)
+            still_remaining = []
+            for i in remaining:
+                max_similarity[i] = max(max_similarity[i], _jaccard(shingles[best], shingles[i]))
+                if max_similarity[i] < self.duplicate_threshold:
+                    still_remaining.append(i)
+            remaining = still_remaining
+        return [memories[i] for i in selected]
+
+    @staticmethod
+    def _merge_adjacent(memories: List[Dict[str, Any]]) -> List[_Fragment]:
+        """将同一文档中 chunk_index 连续的片段合并，合并后的片段位于其中排序最靠前的片段的位置。"""
+        rank = {id(m): i for i, m in enumerate(memories)}
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for memory in memories:
+            metadata = memory['metadata']
+            if metadata.get('file_hash') is None or not isinstance(metadata.get('chunk_index'), int):
+                groups[f"id:{memory['id']}"] = [memory]
+            else:
+                groups.setdefault(f"file:{metadata['file_hash']}", []).append(memory)
+
+        runs: List[Tuple[int, _Fragment]] = []
+        for group in groups.values():
+            group.sort(key=lambda m: m['metadata'].get('chunk_index', 0))
+            fragment, first_rank, previous_index = None, 0, None
+            for memory in group:
+                index = memory['metadata'].get('chunk_index')
+                if fragment is not None and index == previous_index + 1:
+                    fragment.append(memory)
+                    first_rank = min(first_rank, rank[id(memory)])
+                else:
+                    if fragment is not None:
+                        runs.append((first_rank, fragment))
+                    fragment, first_rank = _Fragment(memory), rank[id(memory)]
+                previous_index = index
+            runs.append((first_rank, fragment))
+        runs.sort(key=lambda run: run[0])
+        return [fragment for _, fragment in runs]
+
+    def _fit_budget(self, fragments: List[_Fragment]) -> Tuple[str, List[str], List[str], int]:
+        parts = [_CONTEXT_HEADER]
+        used = self.count_tokens(_CONTEXT_HEADER)
+        sources: List[str] = []
+        chunk_ids: List[str] = []
+        for fragment in fragments:
+            heading = f"--- 记忆片段 {len(parts)} (来源: {fragment.source}) ---\n"
+            cost = self.count_tokens(heading) + self.count_tokens(fragment.text)
+            text, length = fragment.text, None
+            if self.token_budget > 0 and used + cost > self.token_budget:
+                available = self.token_budget - used - self.count_tokens(heading)
+                # 第一个片段总是放入（截断），保证上下文不为空
+                if available < self.min_fragment_tokens and chunk_ids:
+                    continue
+                length = self._truncate_length(fragment.text, max(available, 1))
+                text = fragment.text[:length].rstrip() + _TRUNCATION_MARK
+                cost = self.count_tokens(heading) + self.count_tokens(text)
+            parts.append(heading + text + "\n\n")
+            used += cost
+            chunk_ids.extend(fragment.chunk_ids(length))
+            if fragment.source not in sources:
+                sources.append(fragment.source)
+        return "".join(parts), sources, chunk_ids, used
+
+    def _truncate_length(self, text: str, max_tokens: int) -> int:
+        """不超过 max_tokens 的最长前缀长度，尽量在空白或句末标点处截断。"""
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:middle]) + self.count_tokens(_TRUNCATION_MARK) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        boundary = max(text.rfind(mark, 0, low + 1) for mark in (" ", "\n", "。", "！", "？", ". "))
+        if boundary > low // 2:
+            return boundary + 1
+        return max(low, 1)
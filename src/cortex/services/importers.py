@@ -0,0 +1,262 @@
+from cortex.core.config import IMPORT_BATCH_DOCUMENTS, IMPORT_READ_SIZE
+from cortex.core.models import IngestRequest
+from cortex.logger.logger import get_logger
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+import hashlib
+import html
+import json
+import re
+import threading
+
+log = get_logger(__name__)
+
+_WS_RE = re.compile(r'\s*')
+_TAG_RE = re.compile(r'<[^>]+>')
+_BLOCK_TAG_RE = re.compile(r'<\s*(br|/p|/div|/li|/h[1-6]|/pre)\s*/?>', re.IGNORECASE)
+_ROLE_LABELS = {"user": "User", "assistant": "Assistant"}
+
+
+def iter_json_array(f: TextIO, read_size: int = IMPORT_READ_SIZE) -> Iterator[Any]:
+    """
+    增量解析顶层为数组的JSON文本流，逐个产出数组元素。
+
+    每次只读取 read_size 个字符，内存中只保留当前正在解析的元素，适用于数百MB的导出文件。
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        data = f.read(read_size)
+        if not data:
+            eof = True
+            return False
+        # 丢弃已解析的部分
+        buffer = buffer[pos:] + data
+        pos = 0
+        return True
+
+    def peek() -> str:
+        """跳过空白，返回下一个字符；到达文件末尾时返回空字符串。"""
+        nonlocal pos
+        while True:
+            pos = _WS_RE.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                return ""
+
+    if peek() != "[":
+        raise ValueError("Expected a JSON array at the top level of the export file.")
+    pos += 1
+    if peek() == "]":
+        return
+    while True:
+        # 当前元素可能跨越多次读取：解析失败或恰好解析到缓冲区末尾时，继续读取后重试
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                error = None
+            except json.JSONDecodeError as e:
+                error = e
+            if error is None and (end < len(buffer) or eof):
+                break
+            if eof:
+                raise error
+            fill()
+        pos = end
+        yield item
+        separator = peek()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Malformed JSON array: unexpected {separator or 'end of file'!r}.")
+        pos += 1
+        peek()
+
+
+def _html_to_text(fragment: str) -> str:
+    text = _BLOCK_TAG_RE.sub("\n", fragment)
+    return html.unescape(_TAG_RE.sub("", text)).strip()
+
+
+def _render_conversation(title: Optional[str], messages: List[Tuple[str, str]]) -> str:
+    """将对话渲染为 Markdown 文本：标题作为一级标题，每条消息一个段落。"""
+    parts = [f"# {title}"] if title else []
+    parts.extend(f"{_ROLE_LABELS[role]}: {text}" for role, text in messages)
+    return "\n\n".join(parts)
+
+
+def _chatgpt_messages(conversation: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """
+    沿 current_node 向上回溯得到对话当前分支上的消息（被编辑或重新生成的分支不导入），
+    只保留用户和助手的可见文本消息。
+    """
+    mapping = conversation.get("mapping") or {}
+    path = []
+    node_id = conversation.get("current_node")
+    while node_id in mapping and len(path) < len(mapping):
+        path.append(mapping[node_id])
+        node_id = mapping[node_id].get("parent")
+    if not path:
+        path = list(reversed(mapping.values()))
+
+    messages = []
+    for node in reversed(path):
+        message = node.get("message") or {}
+        role = (message.get("author") or {}).get("role")
+        if role not in _ROLE_LABELS:
+            continue
+        if (message.get("metadata") or {}).get("is_visually_hidden_from_conversation"):
+            continue
+        content = message.get("content") or {}
+        text = "\n".join(part for part in content.get("parts") or [] if isinstance(part, str))
+        if not text and isinstance(content.get("text"), str):
+            text = content["text"]
+        if text.strip():
+            messages.append((role, text.strip()))
+    return messages
+
+
+def _source_key(key: Any, content: str) -> str:
+    """
+    来源名称中的文档标识：优先使用导出文件中的ID或时间；缺失时使用内容哈希，
+    避免多个文档共用同一个来源（如 "chatgpt/None"）而在增量更新时互相覆盖。
+    """
+    if key:
+        return str(key)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+
+def chatgpt_document(conversation: Dict[str, Any]) -> Optional[IngestRequest]:
+    """将 ChatGPT conversations.json 中的一个对话转换为摄入请求，没有可见消息时返回 None。"""
+    messages = _chatgpt_messages(conversation)
+    if not messages:
+        return None
+    conversation_id = conversation.get("conversation_id") or conversation.get("id")
+    title = conversation.get("title") or None
+    content = _render_conversation(title, messages)
+    return IngestRequest(
+        content=content,
+        # 以对话ID作为来源，再次导入时已有对话走增量更新
+        source=f"chatgpt/{_source_key(conversation_id, content)}",
+        metadata={
+            "source": "chatgpt",
+            "source_type": "llm_chat",
+            "tags": [],
+            "creation_ts": conversation.get("create_time"),
+            "title": title,
+        })
+
+
+def gemini_document(activity: Dict[str, Any]) -> Optional[IngestRequest]:
+    """
+    将 Google Takeout 中 Gemini 的一条活动记录（一次提问及其回答）转换为摄入请求。
+
+    Takeout 导出不包含对话ID，因此每条提问记录作为一份独立的记忆；非提问类的活动返回 None。
+    """
+    title = activity.get("title") or ""
+    if not title.startswith("Prompted "):
+        return None
+    prompt = title[len("Prompted "):].strip()
+    responses = [_html_to_text(item.get("html", "")) for item in activity.get("safeHtmlItem") or []]
+    messages = [("user", prompt)] + [("assistant", text) for text in responses if text]
+    timestamp = activity.get("time")
+    creation_ts = None
+    if timestamp:
+        creation_ts = datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+    content = _render_conversation(None, messages)
+    return IngestRequest(
+        content=content,
+        source=f"gemini/{_source_key(timestamp, content)}",
+        metadata={
+            "source": "gemini",
+            "source_type": "llm_chat",
+            "tags": [],
+            "creation_ts": creation_ts,
+            "title": prompt[:100],
+        })
+
+
+# 导出格式 -> (判断数组元素是否属于该格式, 转换函数)
+EXPORT_FORMATS: Dict[str, Tuple[Callable[[Dict[str, Any]], bool],
+                                Callable[[Dict[str, Any]], Optional[IngestRequest]]]] = {
+    "chatgpt": (lambda item: "mapping" in item, chatgpt_document),
+    "gemini": (lambda item: "header" in item and "time" in item, gemini_document),
+}
+
+
+class ChatExportImporter:
+    """
+    流式导入 LLM 对话导出文件：逐个解析对话，每个对话生成一份记忆文档，
+    元数据直接取自导出文件（不调用LLM），按批交给 IngestionService.process_batch 摄入。
+    """
+
+    def __init__(self, ingestion_service, batch_documents: int = IMPORT_BATCH_DOCUMENTS):
+        self.ingestion_service = ingestion_service
+        self.batch_documents = max(1, batch_documents)
+
+    def detect_format(self, path: str) -> Optional[str]:
+        """根据第一个数组元素判断导出格式；不是受支持的导出文件时返回 None。"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                first = next(iter_json_array(f), None)
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if not isinstance(first, dict):
+            return None
+        for name, (matches, _) in EXPORT_FORMATS.items():
+            if matches(first):
+                return name
+        return None
+
+    def iter_documents(self, path: str, export_format: str) -> Iterator[IngestRequest]:
+        _, convert = EXPORT_FORMATS[export_format]
+        with open(path, 'r', encoding='utf-8') as f:
+            for item in iter_json_array(f):
+                try:
+                    document = convert(item) if isinstance(item, dict) else None
+                except Exception as e:
+                    log.warn(f"Skipping malformed {export_format} export entry: {e}")
+                    continue
+                if document is not None:
+                    yield document
+
+    def import_file(self, path: str, export_format: Optional[str] = None,
+                    on_progress: Optional[Callable[[Dict[str, int]], None]] = None,
+                    cancel_event: Optional[threading.Event] = None) -> Dict[str, int]:
+        """
+        导入一个导出文件。
+
+        Args:
+            path: 导出文件路径（如 ChatGPT 的 conversations.json、Takeout 中 Gemini 的 MyActivity.json）。
+            export_format: 'chatgpt' 或 'gemini'；为空时自动识别。
+            on_progress: 可选的回调，每处理完一批以当前的各状态计数调用。
+            cancel_event: 可选的取消信号，在每批开始前检查；被设置后停止导入，已摄入的对话保留
+                （重新导入时按内容哈希去重）。
+
+        Returns:
+            各摄入状态的文档数量，例如 {"ingested": 120, "duplicate": 3}；被取消时为已处理部分的计数。
+        """
+        export_format = export_format or self.detect_format(path)
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported or unrecognized export format for file: {path}")
+        log.info(f"Importing {export_format} export from {path}")
+
+        counts: Counter = Counter()
+        documents = self.iter_documents(path, export_format)
+        while batch := list(islice(documents, self.batch_documents)):
+            if cancel_event is not None and cancel_event.is_set():
+                log.info(f"Import of {path} cancelled: {dict(counts)}")
+                return dict(counts)
+            for result in self.ingestion_service.process_batch(batch):
+                counts[result.status] += 1
+            if on_progress:
+                on_progress(dict(counts))
+        log.info(f"Finished importing {path}: {dict(counts)}")
+        return dict(counts)
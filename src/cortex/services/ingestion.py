@@ -1,15 +1,58 @@
+from cortex.core.cache import TTLCache
 from cortex.core.chunk import chunk
-from cortex.core.model_chat import generate_chat_completion
-from cortex.core.prompt import get_formatted_prompt
+from cortex.core.llm_scheduler import Priority
+from cortex.core.model_chat import generate_chat_completion, agenerate_chat_completion, LLMUnavailableError
+from cortex.core.models import IngestResult, IngestRequest
+from cortex.core.prompt import get_formatted_prompt, template_exists
+from cortex.core.config import (
+    INGEST_EMBED_BATCH_SIZE,
+    INGEST_UPLOAD_CONCURRENCY,
+    METADATA_BATCH_TEMPLATE_NAME,
+    METADATA_BATCH_SIZE,
+    METADATA_CACHE_SIZE,
+    METADATA_CACHE_TTL
+)
+from cortex.core.metrics import timed, timed_iter
 from cortex.logger.logger import get_logger
-import uuid
+import asyncio
+import contextlib
 import hashlib
+from collections import Counter
+import threading
 import time
 import json
-from typing import Optional, Dict, Any
+import re
+from typing import Optional, Dict, Any, Awaitable, Callable, List, Iterable, Iterator, Set, Tuple, Union
 
 log = get_logger(__name__)
 
+# 文件名中随导出批次变化的部分：含数字的十六进制哈希/UUID，以及日期、时间、序号等数字
+_FILENAME_VARIABLE_RE = re.compile(r'(?=[0-9a-f-]*\d)[0-9a-f]{8,}(?:-[0-9a-f]{4,})*|\d+', re.I)
+# 可能取自文件名中可变部分的元数据字段，不随缓存结果共享给同一模式的其他文件
+_FILENAME_SPECIFIC_FIELDS = ("creation_ts", "title")
+
+# PROMPT_DIR 中没有批量元数据模板时使用的提示词，{documents} 替换为带 index 的文档列表
+_DEFAULT_METADATA_BATCH_PROMPT = """You extract metadata for documents that are being added to a personal knowledge base.
+
+For every document below, infer:
+- "source": where the document comes from, in lowercase (e.g. "chatgpt", "gemini", "claude", "notes")
+- "source_type": "llm_chat" for a conversation with an AI assistant, otherwise "document"
+- "tags": a short list of lowercase topic keywords
+
+Documents (a JSON array; each item has an "index", a "filename" and a "description"):
+{documents}
+
+Reply with a single JSON array holding exactly one object per document. Each object MUST carry the "index" of the
+document it describes. Wrap the array in the delimiters below and output nothing else:
+[JSON_START]
+[{"index": 0, "source": "...", "source_type": "...", "tags": ["..."]}]
+[JSON_END]
+"""
+
+
+class IngestionCancelledError(Exception):
+    """摄入被取消（如用户断开连接），已写入的片段已回滚。"""
+
 
 class IngestionService:
     """
@@ -21,82 +64,881 @@ class IngestionService:
         通过依赖注入接收一个存储服务实例。
         """
         self.storage_service = storage_service
+        self.metadata_cache = TTLCache(METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """元数据缓存的命中统计。"""
+        return {"metadata_extraction": self.metadata_cache.stats()}
 
     def _calculate_hash(self, content: str) -> str:
         """计算给定字符串内容的SHA-256哈希值。"""
         return hashlib.sha256(content.encode('utf-8')).hexdigest()
 
-    def _extract_metadata_with_llm(self, filename: str, description: Optional[str]) -> Dict[str, Any]:
-        if not description:
-            description = "No description provided."
+    def _fallback_metadata(self, filename: str) -> Dict[str, Any]:
+        """LLM不可用时，基于文件名生成基础元数据。"""
+        source = filename.split('_')[0].lower()
+        return {"source": source, "source_type": "document", "tags": []}
+
+    @staticmethod
+    def _metadata_cache_key(filename: str, description: Optional[str]) -> Tuple[str, str]:
+        """元数据缓存键：日期、序号、哈希替换为占位符后的文件名模式，以及描述。"""
+        return _FILENAME_VARIABLE_RE.sub("#", filename.lower()), (description or "").strip()
+
+    def _cache_metadata(self, filename: str, description: Optional[str], metadata: Dict[str, Any]):
+        shared = {k: v for k, v in metadata.items() if k not in _FILENAME_SPECIFIC_FIELDS}
+        self.metadata_cache.set(self._metadata_cache_key(filename, description), shared)
+
+    def _cached_metadata(self, filename: str, description: Optional[str]) -> Optional[Dict[str, Any]]:
+        cached = self.metadata_cache.get(self._metadata_cache_key(filename, description))
+        if cached is not None:
+            log.info(f"Metadata cache hit for '{filename}'.")
+            return dict(cached)
+        return None
+
+    def _extract_metadata_with_llm(self, filename: str, description: Optional[str],
+                                   raise_on_llm_error: bool = False) -> Dict[str, Any]:
+        """
+        使用LLM提取元数据。
+
+        raise_on_llm_error 为True时，LLM调用失败会抛出 LLMUnavailableError 以便调用方重试，
+        否则回退到基于文件名的基础元数据。
+        """
+        cached = self._cached_metadata(filename, description)
+        if cached is not None:
+            return cached
         try:
-            prompt = get_formatted_prompt(
-                template_name="cortex_sys_metadata_v1.md",
-                substitutions={"filename": filename,
-                               "description": description}
-            )
+            prompt = self._metadata_prompt(filename, description)
             log.info(f"Extracting metadata for '{filename}' with LLM...")
-            response_str = generate_chat_completion(prompt)
-            start_tag = "[JSON_START]"
-            end_tag = "[JSON_END]"
-            start_index = response_str.find(start_tag)
-            end_index = response_str.find(end_tag)
-            if start_index != -1 and end_index != -1:
-                json_str = response_str[start_index +
-                                        len(start_tag):end_index].strip()
-                return json.loads(json_str)
-            else:
-                log.warning(
-                    "JSON delimiters not found, attempting direct parse.")
-                return json.loads(response_str)
+            # 元数据提取是后台工作，让路给交互式查询
+            response_str = generate_chat_completion(
+                prompt, raise_on_error=raise_on_llm_error, priority=Priority.BACKGROUND)
+            metadata = self._parse_metadata_response(response_str)
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             log.error(
                 f"Failed to extract metadata with LLM: {e}. Falling back to basic metadata.")
-            source = filename.split('_')[0].lower()
-            return {"source": source, "source_type": "document", "tags": []}
+            return self._fallback_metadata(filename)
+        self._cache_metadata(filename, description, metadata)
+        return metadata
 
-    def process(self, content: str, source_filename: str, description: Optional[str] = None):
-        log.info(f"Starting ingestion process for source: {source_filename}")
-        file_hash = self._calculate_hash(content)
+    async def _aextract_metadata_with_llm(self, filename: str, description: Optional[str]) -> Dict[str, Any]:
+        """_extract_metadata_with_llm 的异步版本，LLM调用不占用线程。"""
+        cached = self._cached_metadata(filename, description)
+        if cached is not None:
+            return cached
+        try:
+            prompt = self._metadata_prompt(filename, description)
+            log.info(f"Extracting metadata for '{filename}' with LLM...")
+            response_str = await agenerate_chat_completion(prompt, priority=Priority.BACKGROUND)
+            metadata = self._parse_metadata_response(response_str)
+        except Exception as e:
+            log.error(
+                f"Failed to extract metadata with LLM: {e}. Falling back to basic metadata.")
+            return self._fallback_metadata(filename)
+        self._cache_metadata(filename, description, metadata)
+        return metadata
 
-        # 现在通过注入的实例调用
-        if self.storage_service.check_if_hash_exists(file_hash):
+    def _extract_metadata_batch(self, items: List[Tuple[str, Optional[str]]]) -> List[Dict[str, Any]]:
+        """
+        批量提取多个 (文件名, 描述) 的元数据，结果与 items 顺序一致。
+
+        先查元数据缓存，未命中的（去重后）每 METADATA_BATCH_SIZE 个合并为一次LLM调用，
+        响应中缺失或无效的条目单独回退到基于文件名的基础元数据。
+        只剩一个未命中时直接调用 _extract_metadata_with_llm；PROMPT_DIR 中没有批量模板时使用内置的批量提示词。
+        """
+        results, batches = self._plan_metadata_batches(items)
+        for batch in batches:
+            if len(batch) == 1:
+                for filename, description in batch:
+                    metadata = self._extract_metadata_with_llm(filename, description)
+                    results[self._metadata_cache_key(filename, description)] = metadata
+                continue
+            log.info(f"Extracting metadata for {len(batch)} documents in one LLM call...")
+            try:
+                response_str = generate_chat_completion(
+                    self._metadata_batch_prompt(batch), priority=Priority.BACKGROUND)
+            except Exception as e:
+                log.error(f"Failed to extract batch metadata with LLM: {e}. Falling back to basic metadata.")
+                response_str = ""
+            results.update(self._parse_metadata_batch_response(response_str, batch))
+        return [results[self._metadata_cache_key(filename, description)] for filename, description in items]
+
+    async def _aextract_metadata_batch(self, items: List[Tuple[str, Optional[str]]]) -> List[Dict[str, Any]]:
+        """_extract_metadata_batch 的异步版本，各批次的LLM调用并发进行。"""
+        results, batches = self._plan_metadata_batches(items)
+
+        async def extract(batch: List[Tuple[str, Optional[str]]]):
+            if len(batch) == 1:
+                metadatas = await asyncio.gather(
+                    *(self._aextract_metadata_with_llm(filename, description) for filename, description in batch))
+                for (filename, description), metadata in zip(batch, metadatas):
+                    results[self._metadata_cache_key(filename, description)] = metadata
+                return
+            log.info(f"Extracting metadata for {len(batch)} documents in one LLM call...")
+            try:
+                response_str = await agenerate_chat_completion(
+                    self._metadata_batch_prompt(batch), priority=Priority.BACKGROUND)
+            except Exception as e:
+                log.error(f"Failed to extract batch metadata with LLM: {e}. Falling back to basic metadata.")
+                response_str = ""
+            results.update(self._parse_metadata_batch_response(response_str, batch))
+
+        await asyncio.gather(*(extract(batch) for batch in batches))
+        return [results[self._metadata_cache_key(filename, description)] for filename, description in items]
+
+    def _plan_metadata_batches(self, items: List[Tuple[str, Optional[str]]]) \
+            -> Tuple[Dict[Tuple[str, str], Dict[str, Any]], List[List[Tuple[str, Optional[str]]]]]:
+        """
+        Returns:
+            (缓存命中的结果，以缓存键索引, 需要调用LLM的 (文件名, 描述) 批次)；缓存键相同的条目只提取一次。
+        """
+        results: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        misses: Dict[Tuple[str, str], Tuple[str, Optional[str]]] = {}
+        for filename, description in items:
+            key = self._metadata_cache_key(filename, description)
+            if key in results or key in misses:
+                continue
+            cached = self._cached_metadata(filename, description)
+            if cached is not None:
+                results[key] = cached
+            else:
+                misses[key] = (filename, description)
+        pending = list(misses.values())
+        size = max(1, METADATA_BATCH_SIZE)
+        return results, [pending[i:i + size] for i in range(0, len(pending), size)]
+
+    @staticmethod
+    def _metadata_batch_prompt(batch: List[Tuple[str, Optional[str]]]) -> str:
+        documents = [{"index": i, "filename": filename, "description": description or "No description provided."}
+                     for i, (filename, description) in enumerate(batch)]
+        documents_json = json.dumps(documents, ensure_ascii=False, indent=2)
+        if not template_exists(METADATA_BATCH_TEMPLATE_NAME):
+            return _DEFAULT_METADATA_BATCH_PROMPT.replace("{documents}", documents_json)
+        return get_formatted_prompt(
+            template_name=METADATA_BATCH_TEMPLATE_NAME,
+            substitutions={"documents": documents_json}
+        )
+
+    def _parse_metadata_batch_response(self, response_str: str, batch: List[Tuple[str, Optional[str]]]) \
+            -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """
+        解析批量提取的响应：一个JSON数组，每项是带 index 字段的元数据对象（缺少 index 时按位置对应）。
+        有效的条目写入缓存，其余条目回退到基于文件名的基础元数据。
+        """
+        try:
+            entries = self._parse_metadata_response(response_str)
+            if not isinstance(entries, list):
+                raise ValueError(f"expected a JSON array, got {type(entries).__name__}")
+        except Exception as e:
+            log.error(f"Failed to parse batch metadata response: {e}. Falling back to basic metadata.")
+            entries = []
+        by_index: Dict[int, Dict[str, Any]] = {}
+        for position, entry in enumerate(entries):
+            if not isinstance(entry, dict):
+                continue
+            index = entry.pop("index", position)
+            if isinstance(index, int) and 0 <= index < len(batch) and isinstance(entry.get("source"), str):
+                by_index.setdefault(index, entry)
+
+        results = {}
+        for index, (filename, description) in enumerate(batch):
+            metadata = by_index.get(index)
+            if metadata is None:
+                log.warn(f"No valid metadata for '{filename}' in batch response, using basic metadata.")
+                metadata = self._fallback_metadata(filename)
+            else:
+                self._cache_metadata(filename, description, metadata)
+            results[self._metadata_cache_key(filename, description)] = metadata
+        return results
+
+    @staticmethod
+    def _metadata_prompt(filename: str, description: Optional[str]) -> str:
+        if not description:
+            description = "No description provided."
+        return get_formatted_prompt(
+            template_name="cortex_sys_metadata_v1.md",
+            substitutions={"filename": filename,
+                           "description": description}
+        )
+
+    @staticmethod
+    def _parse_metadata_response(response_str: str) -> Dict[str, Any]:
+        start_tag = "[JSON_START]"
+        end_tag = "[JSON_END]"
+        start_index = response_str.find(start_tag)
+        end_index = response_str.find(end_tag)
+        if start_index != -1 and end_index != -1:
+            json_str = response_str[start_index +
+                                    len(start_tag):end_index].strip()
+            return json.loads(json_str)
+        else:
+            log.warn("JSON delimiters not found, attempting direct parse.")
+            return json.loads(response_str)
+
+    def _calculate_file_hash(self, path: str) -> str:
+        """流式计算文本文件内容的SHA-256哈希值，与 _calculate_hash(文件内容) 结果一致。"""
+        hasher = hashlib.sha256()
+        with open(path, 'r', encoding='utf-8') as f:
+            for block in iter(lambda: f.read(1024 * 1024), ""):
+                hasher.update(block.encode('utf-8'))
+        return hasher.hexdigest()
+
+    def _build_chunk_metadatas(self, extracted_metadata: Dict[str, Any], chunk_count: int,
+                               file_hash: str, source_filename: str, timestamp: int,
+                               start_index: int = 0) -> List[Dict[str, Any]]:
+        """为文档的每个记忆片段生成写入数据库的元数据。"""
+        tags_list = extracted_metadata.get("tags", [])
+        tags_str = ",".join(tags_list) if isinstance(tags_list, list) else ""
+        base = {
+            "source": extracted_metadata.get("source", source_filename),
+            "source_type": extracted_metadata.get("source_type", "document"),
+            "tags": tags_str,
+            # 导入的对话记录自带创建时间，优先使用
+            "creation_ts": int(extracted_metadata.get("creation_ts") or timestamp),
+            "file_hash": file_hash,
+            "original_filename": source_filename
+        }
+        if extracted_metadata.get("title"):
+            base["title"] = extracted_metadata["title"]
+        return [{**base, "chunk_index": start_index + i} for i in range(chunk_count)]
+
+    def _chunk_ids(self, chunks: List[str], source_filename: str,
+                   occurrences: Optional[Dict[str, int]] = None) -> List[str]:
+        """
+        为记忆片段生成内容寻址的确定性ID：同一来源中内容相同的片段总是得到相同的ID。
+        同一文档内重复出现的片段以出现次序区分；分批调用时传入同一个 occurrences 以跨批次计数。
+        """
+        if occurrences is None:
+            occurrences = {}
+        ids = []
+        for text in chunks:
+            n = occurrences.get(text, 0)
+            occurrences[text] = n + 1
+            key = f"{source_filename}\0{n}\0{text}"
+            ids.append(hashlib.sha256(key.encode('utf-8')).hexdigest()[:32])
+        return ids
+
+    def _metadata_from_manifest(self, manifest: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """从已入库版本的记忆片段中恢复文档级元数据，重新摄入时无需再次调用LLM。"""
+        meta = next(iter(manifest.values()))
+        tags = meta.get("tags", "")
+        return {
+            "source": meta.get("source"),
+            "source_type": meta.get("source_type", "document"),
+            "tags": [tag for tag in tags.split(",") if tag] if isinstance(tags, str) else []
+        }
+
+    def _plan_write(self, plan: "_WritePlan", chunks: List[str], metadatas: List[Dict[str, Any]],
+                    ids: List[str], manifest: Dict[str, Dict[str, Any]]):
+        """
+        将新版本文档的记忆片段与库中已有版本对比，记入写入计划：
+        新增的片段需要计算嵌入，未变化的片段只更新元数据。
+        """
+        for chunk_id, text, meta in zip(ids, chunks, metadatas):
+            existing = manifest.get(chunk_id)
+            if existing is None:
+                plan.add_ids.append(chunk_id)
+                plan.add_chunks.append(text)
+                plan.add_metadatas.append(meta)
+            else:
+                # 保留首次入库的时间，其余元数据（位置、所属版本哈希）跟随新版本
+                plan.update_ids.append(chunk_id)
+                plan.update_metadatas.append(
+                    {**meta, "creation_ts": existing.get("creation_ts", meta["creation_ts"])})
+
+    def process(self, content: str, source_filename: str, description: Optional[str] = None,
+                on_progress: Optional[Callable[[str], None]] = None,
+                raise_on_llm_error: bool = False, metadata: Optional[Dict[str, Any]] = None) -> IngestResult:
+        """
+        摄入单个文档：哈希去重 -> LLM元数据提取 -> 分块 -> 嵌入并写入数据库。
+
+        同一来源文件再次摄入（内容已修改）时进行增量更新：只为新增的片段计算嵌入，
+        删除已不存在的片段，未变化的片段保持不动。
+
+        Args:
+            content: 文档的原始文本内容。
+            source_filename: 来源文件名。
+            description: 可选的文档描述，用于元数据提取。
+            on_progress: 可选的回调，在进入每个处理阶段时以阶段名调用。
+            raise_on_llm_error: 为True时，LLM调用失败会抛出 LLMUnavailableError，供后台任务重试。
+            metadata: 可选的已知元数据（与 IngestRequest.metadata 相同），提供时不再调用LLM提取。
+        """
+        if on_progress:
+            on_progress("hashing")
+        with timed("ingest", "total"):
+            return self._ingest(self._calculate_hash(content), chunk.iter_chunks(content),
+                                source_filename, description, on_progress, raise_on_llm_error,
+                                metadata=metadata)
+
+    def process_file(self, path: str, source_filename: str, description: Optional[str] = None,
+                     on_progress: Optional[Callable[[str], None]] = None,
+                     raise_on_llm_error: bool = False) -> IngestResult:
+        """
+        与 process 相同，但从文本文件流式读取：哈希和分块都逐段进行，
+        记忆片段按批写入，内存占用与文件大小无关。
+        """
+        if on_progress:
+            on_progress("hashing")
+        with timed("ingest", "total"):
+            file_hash = self._calculate_file_hash(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                return self._ingest(file_hash, chunk.iter_chunks(f), source_filename,
+                                    description, on_progress, raise_on_llm_error)
+
+    async def aprocess(self, content: str, source_filename: str, description: Optional[str] = None,
+                       cancel_event: Optional[threading.Event] = None) -> IngestResult:
+        """
+        process 的异步版本：LLM元数据提取使用异步客户端，哈希、嵌入和数据库写入在线程中执行，不阻塞事件循环。
+
+        任务被取消时设置 cancel_event（未提供时自动创建），写入线程在下一批之前停止并回滚已写入的片段。
+        """
+        with timed("ingest", "total"):
+            file_hash = await asyncio.to_thread(self._calculate_hash, content)
+            return await self._aingest(file_hash, lambda: chunk.iter_chunks(content), source_filename,
+                                       description, cancel_event or threading.Event())
+
+    async def aprocess_file(self, path: str, source_filename: str, description: Optional[str] = None,
+                            cancel_event: Optional[threading.Event] = None) -> IngestResult:
+        """process_file 的异步版本，取消语义与 aprocess 相同。"""
+        with timed("ingest", "total"):
+            file_hash = await asyncio.to_thread(self._calculate_file_hash, path)
+
+            def iter_file_chunks() -> Iterator[str]:
+                with open(path, 'r', encoding='utf-8') as f:
+                    yield from chunk.iter_chunks(f)
+
+            return await self._aingest(file_hash, iter_file_chunks, source_filename,
+                                       description, cancel_event or threading.Event())
+
+    async def _aingest(self, file_hash: str, iter_chunks: Callable[[], Iterable[str]], source_filename: str,
+                       description: Optional[str], cancel_event: threading.Event) -> IngestResult:
+        try:
+            log.info(f"Starting ingestion process for source: {source_filename}")
+            existing = await asyncio.to_thread(self._check_existing, file_hash, source_filename)
+            if isinstance(existing, IngestResult):
+                return existing
+            extracted_metadata = await self._aresolve_metadata(source_filename, description, existing)
+            return await asyncio.to_thread(
+                self._write_chunks, file_hash, iter_chunks(), source_filename, existing, extracted_metadata,
+                None, INGEST_EMBED_BATCH_SIZE, cancel_event)
+        except asyncio.CancelledError:
+            # 线程中的写入无法被直接中断，通知其在下一批之前停止并回滚
+            cancel_event.set()
+            log.info(f"Ingestion of {source_filename} cancelled.")
+            raise
+
+    async def _aresolve_metadata(self, source_filename: str, description: Optional[str],
+                                 manifest: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        if manifest and not description:
+            return self._metadata_from_manifest(manifest)
+        with timed("ingest", "llm_metadata"):
+            return await self._aextract_metadata_with_llm(source_filename, description)
+
+    async def aprocess_files(self, files: List[Tuple[str, str, Optional[str]]],
+                             on_progress: Optional[Callable[[int, str, Optional[IngestResult]], Awaitable[None]]] = None,
+                             concurrency: int = INGEST_UPLOAD_CONCURRENCY,
+                             batch_size: int = INGEST_EMBED_BATCH_SIZE) -> List[IngestResult]:
+        """
+        以流水线方式摄入多个文本文件（如一次上传的多个文件）。
+
+        - 所有文件的哈希并发计算，去重检查合并为一次数据库查询
+        - 需要LLM提取元数据的文件合并为批量调用，与各文件的分块同时进行；最多 concurrency 个文件同时分块
+        - 各文件逐批惰性分块，需要新增的片段汇入同一个有界写入队列，跨文件合并为不超过 batch_size 的批次
+          计算嵌入并写入；不会一次性持有整个文件的片段
+        - 文件的所有片段写入后再更新未变化片段的元数据、删除已移除的片段；写入失败的文件回滚已写入的片段
+        - 每个文件进入新阶段时调用 on_progress(文件序号, 阶段, None)，完成时阶段为 "done" 并附带结果
+
+        任务被取消时删除尚未完成的文件已写入的片段。内容相同的多个文件只摄入第一个，
+        来源文件名相同的多个文件只摄入最后一个。
+
+        Args:
+            files: (文件路径, 来源文件名, 可选的描述) 列表。
+
+        Returns:
+            与 files 顺序一致的摄入结果列表。
+        """
+        log.info(f"Starting pipelined ingestion for {len(files)} files.")
+        results = await _UploadPipeline(self, files, on_progress, concurrency, batch_size).run()
+        ingested = sum(1 for r in results if r.status in ("ingested", "updated"))
+        log.info(f"Pipelined ingestion finished: {ingested}/{len(files)} files.")
+        return results
+
+    def _iter_file_chunk_batches(self, path: str, batch_size: int) -> Iterator[List[str]]:
+        """惰性读取并分块文件，每次产出最多 batch_size 个片段，内存中只保留当前一批。"""
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from _batched(timed_iter(chunk.iter_chunks(f), "ingest", "chunk"), batch_size)
+
+    def _check_existing(self, file_hash: str, source_filename: str) -> Union[IngestResult, Dict[str, Dict[str, Any]]]:
+        """内容已存在时返回 duplicate 结果，否则返回同一来源文件已入库版本的片段清单（首次摄入时为空）。"""
+        with timed("ingest", "hash_check"):
+            is_duplicate = self.storage_service.check_if_hash_exists(file_hash)
+        if is_duplicate:
             log.info(
                 f"Content from source '{source_filename}' already exists. Skipping.")
-            return
+            return IngestResult(source=source_filename, status="duplicate", file_hash=file_hash)
+        return self.storage_service.get_source_manifests(
+            [source_filename]).get(source_filename, {})
+
+    def _ingest(self, file_hash: str, chunks: Iterable[str], source_filename: str,
+                description: Optional[str], on_progress: Optional[Callable[[str], None]],
+                raise_on_llm_error: bool, batch_size: int = INGEST_EMBED_BATCH_SIZE,
+                metadata: Optional[Dict[str, Any]] = None) -> IngestResult:
+        log.info(f"Starting ingestion process for source: {source_filename}")
+
+        # 现在通过注入的实例调用
+        manifest = self._check_existing(file_hash, source_filename)
+        if isinstance(manifest, IngestResult):
+            return manifest
+        if on_progress:
+            on_progress("extracting_metadata")
+        if metadata:
+            extracted_metadata = metadata
+        elif manifest and not description:
+            extracted_metadata = self._metadata_from_manifest(manifest)
+        else:
+            with timed("ingest", "llm_metadata"):
+                extracted_metadata = self._extract_metadata_with_llm(
+                    source_filename, description, raise_on_llm_error=raise_on_llm_error)
+        return self._write_chunks(file_hash, chunks, source_filename, manifest, extracted_metadata,
+                                  on_progress, batch_size)
 
-        extracted_metadata = self._extract_metadata_with_llm(
-            source_filename, description)
-        chunks = chunk.chunk_text(content)
-        if not chunks:
-            log.warning(
+    def _write_chunks(self, file_hash: str, chunks: Iterable[str], source_filename: str,
+                      manifest: Dict[str, Dict[str, Any]], extracted_metadata: Dict[str, Any],
+                      on_progress: Optional[Callable[[str], None]], batch_size: int,
+                      cancel_event: Optional[threading.Event] = None) -> IngestResult:
+        def report(stage: str):
+            if on_progress:
+                on_progress(stage)
+
+        # 分块结果按批惰性消费：每凑满一批就计算ID、对比已有版本并写入新增片段
+        plan = _WritePlan()
+        occurrences: Dict[str, int] = {}
+        timestamp = int(time.time())
+        chunk_count = 0
+        written_ids: List[str] = []
+        report("chunking")
+        for batch in _batched(timed_iter(chunks, "ingest", "chunk"), batch_size):
+            if cancel_event is not None and cancel_event.is_set():
+                # 删除本次已新增的片段；旧版本的片段在全部写完后才更新或删除，回滚后保持原样
+                self.storage_service.delete_memory_chunks(written_ids)
+                raise IngestionCancelledError(
+                    f"Ingestion of {source_filename} cancelled, {len(written_ids)} written chunks rolled back.")
+            ids = self._chunk_ids(batch, source_filename, occurrences)
+            metadatas = self._build_chunk_metadatas(
+                extracted_metadata, len(batch), file_hash, source_filename, timestamp, start_index=chunk_count)
+            chunk_count += len(batch)
+            self._plan_write(plan, batch, metadatas, ids, manifest)
+            report("embedding")
+            add_chunks, add_metadatas, add_ids = plan.take_additions()
+            self.storage_service.add_memory_chunks(
+                chunks=add_chunks,
+                metadatas=add_metadatas,
+                ids=add_ids
+            )
+            written_ids.extend(add_ids)
+        if not chunk_count:
+            log.warn(
                 f"No chunks generated for {source_filename}. Skipping.")
-            return
+            return IngestResult(source=source_filename, status="empty", file_hash=file_hash)
+
+        plan.finish(manifest)
+        self.storage_service.update_memory_metadatas(
+            plan.update_ids, plan.update_metadatas)
+        self.storage_service.delete_memory_chunks(plan.delete_ids)
+        log.info(
+            f"Successfully ingested {source_filename}: {plan.added} new, "
+            f"{len(plan.update_ids)} unchanged, {len(plan.delete_ids)} removed chunks")
+        return plan.result(source_filename, file_hash, is_update=bool(manifest))
+
+    def process_batch(self, documents: List[IngestRequest],
+                      batch_size: int = INGEST_EMBED_BATCH_SIZE) -> List[IngestResult]:
+        """
+        批量摄入多个文档。
+
+        所有文档的哈希去重和已有版本清单各在一次数据库查询中完成，需要LLM提取的元数据合并为少量批量调用，
+        分块后需要新增的记忆片段跨文档合并，按 batch_size 分批计算嵌入并写入，避免逐文档写入带来的小批量开销。
+        同一批次中来源文件名相同的多个文档，只摄入最后一个。
+
+        Returns:
+            与 documents 顺序一致的摄入结果列表。
+        """
+        log.info(f"Starting batch ingestion for {len(documents)} documents.")
+        results: List[Optional[IngestResult]] = [None] * len(documents)
+        hashes = [self._calculate_hash(doc.content) for doc in documents]
+        with timed("ingest", "hash_check"):
+            existing_hashes = self.storage_service.get_existing_hashes(hashes)
+        last_index_by_source = {doc.source: i for i, doc in enumerate(documents)}
+        manifests = self.storage_service.get_source_manifests(
+            doc.source for i, doc in enumerate(documents) if hashes[i] not in existing_hashes)
+
+        all_chunks: List[str] = []
+        all_metadatas: List[Dict[str, Any]] = []
+        all_ids: List[str] = []
+        chunk_owner: List[int] = []
+        plans: Dict[int, _WritePlan] = {}
+        seen_hashes = set(existing_hashes)
+        candidates: List[int] = []
+        for i, doc in enumerate(documents):
+            file_hash = hashes[i]
+            if file_hash in seen_hashes:
+                results[i] = IngestResult(
+                    source=doc.source, status="duplicate", file_hash=file_hash)
+            elif last_index_by_source[doc.source] != i:
+                results[i] = IngestResult(
+                    source=doc.source, status="duplicate", file_hash=file_hash,
+                    error="Superseded by a later document with the same source in this batch.")
+            else:
+                seen_hashes.add(file_hash)
+                candidates.append(i)
+
+        # 没有自带元数据、也不能沿用已有版本元数据的文档，合并为少量LLM调用提取元数据
+        extracted: Dict[int, Dict[str, Any]] = {}
+        needs_llm = [i for i in candidates if not documents[i].metadata
+                     and not (manifests.get(documents[i].source) and not documents[i].description)]
+        if needs_llm:
+            with timed("ingest", "llm_metadata"):
+                extracted = dict(zip(needs_llm, self._extract_metadata_batch(
+                    [(documents[i].source, documents[i].description) for i in needs_llm])))
 
         current_timestamp = int(time.time())
-        final_metadatas = []
-        for i, _ in enumerate(chunks):
-            tags_list = extracted_metadata.get("tags", [])
-            tags_str = ",".join(tags_list) if isinstance(
-                tags_list, list) else ""
-            meta = {
-                "source": extracted_metadata.get("source", source_filename),
-                "source_type": extracted_metadata.get("source_type", "document"),
-                "tags": tags_str,
-                "creation_ts": current_timestamp,
-                "file_hash": file_hash,
-                "chunk_index": i,
-                "original_filename": source_filename
-            }
-            final_metadatas.append(meta)
-
-        ids = [str(uuid.uuid4()) for _ in chunks]
+        for i in candidates:
+            doc, file_hash = documents[i], hashes[i]
+            try:
+                manifest = manifests.get(doc.source, {})
+                if doc.metadata:
+                    extracted_metadata = doc.metadata
+                elif i in extracted:
+                    extracted_metadata = extracted[i]
+                else:
+                    extracted_metadata = self._metadata_from_manifest(manifest)
+                with timed("ingest", "chunk"):
+                    chunks = chunk.chunk_text(doc.content)
+                if not chunks:
+                    results[i] = IngestResult(
+                        source=doc.source, status="empty", file_hash=file_hash)
+                    continue
+                metadatas = self._build_chunk_metadatas(
+                    extracted_metadata, len(chunks), file_hash, doc.source, current_timestamp)
+                plan = _WritePlan()
+                self._plan_write(plan, chunks, metadatas,
+                                 self._chunk_ids(chunks, doc.source), manifest)
+                plan.finish(manifest)
+                plans[i] = plan
+                add_chunks, add_metadatas, add_ids = plan.take_additions()
+                all_chunks.extend(add_chunks)
+                all_metadatas.extend(add_metadatas)
+                all_ids.extend(add_ids)
+                chunk_owner.extend([i] * len(add_ids))
+                results[i] = plan.result(doc.source, file_hash, is_update=bool(manifest))
+            except Exception as e:
+                log.error(f"Failed to prepare document {doc.source}: {e}")
+                results[i] = IngestResult(
+                    source=doc.source, status="failed", file_hash=file_hash, error=str(e))
 
-        # 现在通过注入的实例调用
-        self.storage_service.add_memory_chunks(
-            chunks=chunks,
-            metadatas=final_metadatas,
-            ids=ids
-        )
+        def mark_failed(owners, error: Exception):
+            for owner in owners:
+                results[owner] = results[owner].model_copy(
+                    update={"status": "failed", "error": str(error)})
+
+        for start in range(0, len(all_chunks), batch_size):
+            end = start + batch_size
+            try:
+                self.storage_service.add_memory_chunks(
+                    chunks=all_chunks[start:end],
+                    metadatas=all_metadatas[start:end],
+                    ids=all_ids[start:end],
+                    batch_size=batch_size
+                )
+            except Exception as e:
+                log.error(f"Failed to write chunk batch [{start}, {end}): {e}")
+                mark_failed(set(chunk_owner[start:end]), e)
+
+        # 未变化片段的元数据更新和已移除片段的删除不涉及嵌入计算，合并为一次调用
+        changed = [i for i, plan in plans.items() if plan.update_ids or plan.delete_ids]
+        if changed:
+            try:
+                self.storage_service.update_memory_metadatas(
+                    [cid for i in changed for cid in plans[i].update_ids],
+                    [meta for i in changed for meta in plans[i].update_metadatas])
+                self.storage_service.delete_memory_chunks(
+                    [cid for i in changed for cid in plans[i].delete_ids])
+            except Exception as e:
+                log.error(f"Failed to update existing chunks: {e}")
+                mark_failed(changed, e)
+
+        ingested = sum(1 for r in results if r.status in ("ingested", "updated"))
         log.info(
-            f"Successfully ingested {len(chunks)} chunks from {source_filename}")
+            f"Batch ingestion finished: {ingested}/{len(documents)} documents, {len(all_chunks)} new chunks.")
+        return results
+
+
+def _batched(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _WritePlan:
+    """一个文档版本需要执行的写入操作。"""
+
+    def __init__(self):
+        self.add_ids: List[str] = []
+        self.add_chunks: List[str] = []
+        self.add_metadatas: List[Dict[str, Any]] = []
+        self.update_ids: List[str] = []
+        self.update_metadatas: List[Dict[str, Any]] = []
+        self.delete_ids: List[str] = []
+        self.added = 0
+
+    def take_additions(self) -> Tuple[List[str], List[Dict[str, Any]], List[str]]:
+        """取出待新增的片段（文本、元数据、ID）并清空，以便分批写入时不在内存中累积。"""
+        additions = (self.add_chunks, self.add_metadatas, self.add_ids)
+        self.added += len(self.add_ids)
+        self.add_chunks, self.add_metadatas, self.add_ids = [], [], []
+        return additions
+
+    def finish(self, manifest: Dict[str, Dict[str, Any]]):
+        """所有片段规划完成后，库中已有但新版本不再包含的片段需要删除。"""
+        kept = set(self.update_ids)
+        self.delete_ids = [chunk_id for chunk_id in manifest if chunk_id not in kept]
+
+    def result(self, source: str, file_hash: str, is_update: bool) -> IngestResult:
+        return IngestResult(source=source, status="updated" if is_update else "ingested",
+                            chunks=self.added, reused_chunks=len(self.update_ids),
+                            deleted_chunks=len(self.delete_ids), file_hash=file_hash)
+
+
+class _UploadPipeline:
+    """aprocess_files 的执行状态：并发的逐文件准备阶段与跨文件合并批次的写入阶段。"""
+
+    def __init__(self, service: IngestionService, files: List[Tuple[str, str, Optional[str]]],
+                 on_progress: Optional[Callable[[int, str, Optional[IngestResult]], Awaitable[None]]],
+                 concurrency: int, batch_size: int):
+        self.service = service
+        self.storage_service = service.storage_service
+        self.files = files
+        self.on_progress = on_progress
+        self.batch_size = max(1, batch_size)
+        self.results: List[Optional[IngestResult]] = [None] * len(files)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        # (文件序号, 片段文本, 元数据, ID)；None 表示所有文件都已准备完毕。
+        # 队列有界：分块快于嵌入写入时各文件的分块暂停，不会把整个文件的片段都积压在内存中
+        self._queue: "asyncio.Queue[Optional[Tuple[int, str, Dict[str, Any], str]]]" = asyncio.Queue(
+            maxsize=self.batch_size * 2)
+        self._plans: Dict[int, _WritePlan] = {}
+        # 各文件已入队但尚未写入的片段数；仍在分块的文件即使暂时为0也不能结束
+        self._pending: Dict[int, int] = {}
+        self._producing: Set[int] = set()
+        self._failed: Dict[int, Exception] = {}
+        # 以下状态只在持有 _write_lock 的写入线程中修改，取消时在途的写入完成后才回滚
+        self._write_lock = threading.Lock()
+        self._written: Dict[int, List[str]] = {}
+        self._finished: Set[int] = set()
+        # 需要LLM提取元数据的文件在去重后合并为批量调用，与各文件的分块并行进行
+        self._metadata_task: Optional["asyncio.Future[List[Dict[str, Any]]]"] = None
+        self._metadata_position: Dict[int, int] = {}
+
+    async def run(self) -> List[IngestResult]:
+        writer = asyncio.ensure_future(self._write())
+        try:
+            pending = await self._check_duplicates()
+            self._start_metadata_extraction(pending)
+            await asyncio.gather(*(self._prepare(i, file_hash, manifest) for i, file_hash, manifest in pending))
+            await self._queue.put(None)
+            await writer
+        except asyncio.CancelledError:
+            writer.cancel()
+            if self._metadata_task is not None:
+                self._metadata_task.cancel()
+            unfinished = [i for i in range(len(self.files)) if i not in self._finished]
+            await asyncio.to_thread(self._rollback, unfinished)
+            raise
+        except Exception:
+            writer.cancel()
+            raise
+        return self.results
+
+    async def _report(self, index: int, stage: str, result: Optional[IngestResult] = None):
+        if result is not None:
+            self.results[index] = result
+        if self.on_progress:
+            await self.on_progress(index, stage, result)
+
+    async def _check_duplicates(self) -> List[Tuple[int, str, Dict[str, Dict[str, Any]]]]:
+        """
+        并发计算所有文件的哈希，并各用一次数据库查询完成去重检查和已有版本清单的读取。
+        内容相同的多个文件只摄入第一个，来源文件名相同的只摄入最后一个。
+
+        Returns:
+            需要继续摄入的 (文件序号, 文件哈希, 已有版本的片段清单) 列表。
+        """
+        for index in range(len(self.files)):
+            await self._report(index, "hashing")
+        with timed("ingest", "hash_check"):
+            hashes = await asyncio.gather(
+                *(asyncio.to_thread(self.service._calculate_file_hash, path) for path, _, _ in self.files),
+                return_exceptions=True)
+            valid_hashes = [h for h in hashes if isinstance(h, str)]
+            existing_hashes = await asyncio.to_thread(self.storage_service.get_existing_hashes, valid_hashes)
+        last_index_by_source = {source: i for i, (_, source, _) in enumerate(self.files)}
+        candidates = []
+        seen_hashes = set(existing_hashes)
+        for index, ((_, source, _), file_hash) in enumerate(zip(self.files, hashes)):
+            if isinstance(file_hash, Exception):
+                log.error(f"Failed to read file {source}: {file_hash}")
+                await self._report(index, "done", IngestResult(source=source, status="failed", error=str(file_hash)))
+            elif file_hash in seen_hashes:
+                await self._report(index, "done", IngestResult(source=source, status="duplicate", file_hash=file_hash))
+            elif last_index_by_source[source] != index:
+                await self._report(index, "done", IngestResult(
+                    source=source, status="duplicate", file_hash=file_hash,
+                    error="Superseded by a later file with the same source in this upload."))
+            else:
+                seen_hashes.add(file_hash)
+                candidates.append((index, file_hash))
+        manifests = await asyncio.to_thread(
+            self.storage_service.get_source_manifests, [self.files[index][1] for index, _ in candidates])
+        return [(index, file_hash, manifests.get(self.files[index][1], {})) for index, file_hash in candidates]
+
+    def _start_metadata_extraction(self, pending: List[Tuple[int, str, Dict[str, Dict[str, Any]]]]):
+        items = []
+        for index, _, manifest in pending:
+            _, source, description = self.files[index]
+            if not manifest or description:
+                self._metadata_position[index] = len(items)
+                items.append((source, description))
+        if items:
+            self._metadata_task = asyncio.ensure_future(self._extract_metadata(items))
+
+    async def _extract_metadata(self, items: List[Tuple[str, Optional[str]]]) -> List[Dict[str, Any]]:
+        with timed("ingest", "llm_metadata"):
+            return await self.service._aextract_metadata_batch(items)
+
+    async def _resolve_metadata(self, index: int, manifest: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        if index not in self._metadata_position:
+            return self.service._metadata_from_manifest(manifest)
+        # 批量提取由所有文件共享，单个文件的准备被取消时不影响其他文件
+        metadatas = await asyncio.shield(self._metadata_task)
+        return metadatas[self._metadata_position[index]]
+
+    async def _prepare(self, index: int, file_hash: str, manifest: Dict[str, Dict[str, Any]]):
+        """元数据与第一批分块并行准备，之后逐批分块、对比已有版本，并把新增片段送入跨文件的写入队列。"""
+        path, source, _ = self.files[index]
+        async with self._semaphore:
+            batches = self.service._iter_file_chunk_batches(path, self.batch_size)
+            try:
+                await self._report(index, "extracting_metadata")
+                extracted_metadata, batch = await asyncio.gather(
+                    self._resolve_metadata(index, manifest),
+                    asyncio.to_thread(next, batches, None))
+                if batch is None:
+                    await self._report(index, "done", IngestResult(source=source, status="empty", file_hash=file_hash))
+                    return
+                await self._report(index, "embedding")
+                plan = self._plans[index] = _WritePlan()
+                self._pending[index] = 0
+                self._producing.add(index)
+                occurrences: Dict[str, int] = {}
+                timestamp = int(time.time())
+                chunk_count = 0
+                while batch is not None and index not in self._failed:
+                    metadatas = self.service._build_chunk_metadatas(
+                        extracted_metadata, len(batch), file_hash, source, timestamp, start_index=chunk_count)
+                    chunk_count += len(batch)
+                    self.service._plan_write(
+                        plan, batch, metadatas, self.service._chunk_ids(batch, source, occurrences), manifest)
+                    add_chunks, add_metadatas, add_ids = plan.take_additions()
+                    self._pending[index] += len(add_ids)
+                    for item in zip(add_chunks, add_metadatas, add_ids):
+                        await self._queue.put((index, *item))
+                    batch = await asyncio.to_thread(next, batches, None)
+                plan.finish(manifest)
+                self.results[index] = plan.result(source, file_hash, is_update=bool(manifest))
+            except Exception as e:
+                log.error(f"Failed to prepare file {source}: {e}")
+                if index not in self._producing:
+                    await self._report(index, "done", IngestResult(
+                        source=source, status="failed", file_hash=file_hash, error=str(e)))
+                    return
+                # 已有片段进入写入队列：由 _finish 在这些片段写完后回滚并标记失败
+                self._failed.setdefault(index, e)
+                self.results[index] = IngestResult(source=source, status="failed", file_hash=file_hash, error=str(e))
+            finally:
+                # 取消时分块线程可能仍在执行，由它结束后自行释放文件
+                with contextlib.suppress(ValueError):
+                    batches.close()
+        self._producing.discard(index)
+        if self._pending[index] == 0:
+            await self._finish(index)
+
+    async def _write(self):
+        stop = False
+        while not stop:
+            batch = []
+            # 元数据批量提取完成后各文件几乎同时就绪，凑满 batch_size（或所有文件都已准备完毕）再写入
+            while len(batch) < self.batch_size:
+                item = await self._queue.get()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if not batch:
+                continue
+            owners = Counter(owner for owner, _, _, _ in batch)
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                log.error(f"Failed to write chunk batch of {len(batch)} chunks: {e}")
+                for owner in owners:
+                    self._failed.setdefault(owner, e)
+            for owner, count in owners.items():
+                self._pending[owner] -= count
+                if self._pending[owner] == 0 and owner not in self._producing:
+                    await self._finish(owner)
+
+    async def _finish(self, index: int):
+        """文件的新增片段全部写入后更新或删除旧版本的片段；有批次写入失败时回滚该文件。"""
+        error = self._failed.get(index)
+        if error is None:
+            try:
+                await asyncio.to_thread(self._finalize, index)
+            except Exception as e:
+                log.error(f"Failed to update existing chunks of {self.files[index][1]}: {e}")
+                error = e
+        if error is not None:
+            await asyncio.to_thread(self._rollback, [index])
+            self.results[index] = self.results[index].model_copy(update={"status": "failed", "error": str(error)})
+        await self._report(index, "done", self.results[index])
+
+    def _write_batch(self, batch: List[Tuple[int, str, Dict[str, Any], str]]):
+        with self._write_lock:
+            self.storage_service.add_memory_chunks(
+                chunks=[text for _, text, _, _ in batch],
+                metadatas=[meta for _, _, meta, _ in batch],
+                ids=[chunk_id for _, _, _, chunk_id in batch],
+                batch_size=self.batch_size
+            )
+            for owner, _, _, chunk_id in batch:
+                self._written.setdefault(owner, []).append(chunk_id)
+
+    def _finalize(self, index: int):
+        plan = self._plans[index]
+        with self._write_lock:
+            self.storage_service.update_memory_metadatas(plan.update_ids, plan.update_metadatas)
+            self.storage_service.delete_memory_chunks(plan.delete_ids)
+            self._finished.add(index)
+
+    def _rollback(self, indexes: List[int]):
+        """删除指定文件已写入的新增片段；旧版本的片段在文件完成前不会被修改，回滚后保持原样。"""
+        with self._write_lock:
+            ids = [chunk_id for index in indexes if index not in self._finished
+                   for chunk_id in self._written.pop(index, [])]
+            if ids:
+                self.storage_service.delete_memory_chunks(ids)
+                log.info(f"Rolled back {len(ids)} chunks of unfinished files.")
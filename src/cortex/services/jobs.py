@@ -0,0 +1,286 @@
+from cortex.core.config import (
+    INGEST_JOB_DB_PATH,
+    INGEST_QUEUE_MAX_SIZE,
+    INGEST_WORKERS,
+    INGEST_JOB_MAX_RETRIES,
+    INGEST_JOB_RETRY_BACKOFF,
+    INGEST_JOB_LEASE_SECONDS
+)
+from cortex.core.llm_scheduler import Priority, llm_request_context
+from cortex.core.model_chat import LLMUnavailableError
+from cortex.logger.logger import get_logger
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+log = get_logger(__name__)
+
+_PENDING_STATUSES = ("queued", "running")
+
+
+class QueueFullError(Exception):
+    """等待处理的摄入任务数量已达上限。"""
+
+
+class IngestionJobQueue:
+    """
+    有界、持久化的后台摄入任务队列。
+
+    任务写入本地 SQLite 文件后立即返回任务ID，由固定数量的工作线程调用
+    IngestionService.process 完成实际摄入。服务重启后，未完成的任务会重新入队。
+
+    多个进程可以共用同一个任务文件：任务被取走时记录执行者和租约到期时间，执行期间由心跳线程续约，
+    只有租约已过期（执行者已退出）的运行中任务才会被重新入队，不会打断其他进程正在执行的任务。
+    """
+
+    def __init__(self, ingestion_service,
+                 db_path: Path = INGEST_JOB_DB_PATH,
+                 max_size: int = INGEST_QUEUE_MAX_SIZE,
+                 workers: int = INGEST_WORKERS,
+                 max_retries: int = INGEST_JOB_MAX_RETRIES,
+                 retry_backoff: float = INGEST_JOB_RETRY_BACKOFF,
+                 lease_seconds: float = INGEST_JOB_LEASE_SECONDS):
+        """通过依赖注入接收摄入服务实例。"""
+        self.ingestion_service = ingestion_service
+        self.max_size = max_size
+        self.workers = max(1, workers)
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff
+        self.lease_seconds = lease_seconds
+        # 任务执行者标识：进程ID + 实例ID，同一进程内的多个队列实例互不混淆
+        self._owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingest_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    source TEXT NOT NULL,
+                    description TEXT,
+                    content TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    result TEXT,
+                    created_ts INTEGER NOT NULL,
+                    updated_ts INTEGER NOT NULL,
+                    owner TEXT,
+                    lease_expires_ts REAL,
+                    metadata TEXT
+                )
+            """)
+            # 旧版本创建的任务文件没有执行者、租约和元数据字段
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(ingest_jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("lease_expires_ts", "REAL"), ("metadata", "TEXT")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE ingest_jobs ADD COLUMN {column} {column_type}")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status)")
+
+    def start(self):
+        """恢复未完成的任务并启动工作线程。"""
+        if self._threads:
+            return
+        self._stop_event.clear()
+        self._recover_expired_jobs()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM ingest_jobs WHERE status = 'queued' ORDER BY created_ts").fetchall()
+        for row in rows:
+            self._queue.put(row["job_id"])
+        if rows:
+            log.info(f"Recovered {len(rows)} pending ingestion jobs.")
+
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker_loop, name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="ingest-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+        log.info(f"Started {self.workers} ingestion workers.")
+
+    def stop(self, timeout: float = 5.0):
+        """
+        停止工作线程。正在执行的任务会在当前阶段结束后退出；未完成的任务不再续约，
+        租约过期后由下次启动（或共用任务文件的其他进程）恢复。
+        """
+        self._stop_event.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join(timeout=timeout)
+            self._heartbeat_thread = None
+        self._threads = []
+        log.info("Ingestion workers stopped.")
+
+    def submit(self, content: str, source: str, description: Optional[str] = None,
+               metadata: Optional[Dict[str, Any]] = None) -> str:
+        """
+        提交一个摄入任务。metadata 为可选的已知元数据，提供时不再调用LLM提取。
+
+        Returns:
+            任务ID。
+
+        Raises:
+            QueueFullError: 等待处理的任务数量已达上限。
+        """
+        job_id = str(uuid.uuid4())
+        now = int(time.time())
+        with self._lock, self._conn:
+            pending = self._conn.execute(
+                "SELECT COUNT(*) FROM ingest_jobs WHERE status IN (?, ?)", _PENDING_STATUSES).fetchone()[0]
+            if pending >= self.max_size:
+                raise QueueFullError(
+                    f"Ingestion queue is full ({pending}/{self.max_size}).")
+            self._conn.execute(
+                "INSERT INTO ingest_jobs (job_id, status, source, description, content, metadata, "
+                "created_ts, updated_ts) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, source, description, content,
+                 json.dumps(metadata, ensure_ascii=False) if metadata else None, now, now))
+        self._queue.put(job_id)
+        log.info(f"Ingestion job {job_id} queued for source: {source}")
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态，任务不存在时返回 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, status, stage, source, attempts, error, result, created_ts, updated_ts "
+                "FROM ingest_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def pending_count(self) -> int:
+        """返回等待或正在处理的任务数量。"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM ingest_jobs WHERE status IN (?, ?)", _PENDING_STATUSES).fetchone()[0]
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_ts"] = int(time.time())
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE ingest_jobs SET {assignments} WHERE job_id = ?",
+                (*fields.values(), job_id))
+
+    def _claim(self, job_id: str, attempts: int) -> bool:
+        """将排队中的任务原子地标记为由本实例运行，并取得租约；任务已不在排队状态时返回 False。"""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE ingest_jobs SET status = 'running', attempts = ?, owner = ?, lease_expires_ts = ?, "
+                "updated_ts = ? WHERE job_id = ? AND status = 'queued'",
+                (attempts, self._owner, now + self.lease_seconds, int(now), job_id))
+        return cursor.rowcount == 1
+
+    def _renew_leases(self):
+        """为本实例正在运行的任务续约。"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE ingest_jobs SET lease_expires_ts = ? WHERE owner = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, self._owner))
+
+    def _recover_expired_jobs(self) -> List[str]:
+        """将租约已过期（执行者已退出）的运行中任务重新标记为排队，返回这些任务的ID。"""
+        now = time.time()
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT job_id FROM ingest_jobs WHERE status = 'running' "
+                "AND (lease_expires_ts IS NULL OR lease_expires_ts < ?)", (now,)).fetchall()
+            job_ids = [row["job_id"] for row in rows]
+            for job_id in job_ids:
+                self._conn.execute(
+                    "UPDATE ingest_jobs SET status = 'queued', owner = NULL, lease_expires_ts = NULL, "
+                    "updated_ts = ? WHERE job_id = ? AND status = 'running'", (int(now), job_id))
+        if job_ids:
+            log.warn(f"Re-queued {len(job_ids)} ingestion jobs whose lease expired.")
+        return job_ids
+
+    def _heartbeat_loop(self):
+        """定期为本实例的任务续约，并接管其他进程退出后遗留的任务。"""
+        interval = max(0.1, self.lease_seconds / 3)
+        while not self._stop_event.wait(interval):
+            try:
+                self._renew_leases()
+                for job_id in self._recover_expired_jobs():
+                    self._queue.put(job_id)
+            except Exception as e:
+                log.error(f"Error renewing ingestion job leases: {e}")
+
+    def _worker_loop(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None or self._stop_event.is_set():
+                return
+            try:
+                self._run_job(job_id)
+            except Exception as e:
+                log.error(f"Unexpected error in ingestion job {job_id}: {e}")
+                self._update(job_id, status="failed", error=str(e))
+
+    def _run_job(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, source, description, content, metadata, attempts FROM ingest_jobs WHERE job_id = ?",
+                (job_id,)).fetchone()
+        if row is None or row["status"] != "queued":
+            return
+
+        attempts = row["attempts"]
+        while True:
+            attempts += 1
+            # 最后一次尝试时不再抛出LLM错误，而是回退到基础元数据，保证任务最终能完成
+            is_last_attempt = attempts > self.max_retries
+            if not self._claim(job_id, attempts):
+                # 多个 API worker 共用任务文件时，任务可能已被其他进程取走
+                return
+            try:
+                # 每个任务是一个独立的流，多个任务的LLM请求轮流调度
+                with llm_request_context(Priority.BACKGROUND, flow=f"job:{job_id}"):
+                    result = self.ingestion_service.process(
+                        content=row["content"],
+                        source_filename=row["source"],
+                        description=row["description"],
+                        on_progress=lambda stage: self._update(job_id, stage=stage),
+                        raise_on_llm_error=not is_last_attempt,
+                        metadata=json.loads(row["metadata"]) if row["metadata"] else None
+                    )
+            except LLMUnavailableError as e:
+                delay = self.retry_backoff * (2 ** (attempts - 1))
+                log.warn(
+                    f"Ingestion job {job_id} attempt {attempts} hit LLM error: {e}. Retrying in {delay:.1f}s.")
+                self._update(job_id, status="queued", error=str(e))
+                if self._stop_event.wait(delay):
+                    return
+                continue
+            except Exception as e:
+                log.error(f"Ingestion job {job_id} failed: {e}")
+                self._update(job_id, status="failed", error=str(e))
+                return
+
+            # 任务完成后清除原始内容，避免任务文件无限增长
+            self._update(job_id, status="succeeded", stage="done", content=None, metadata=None,
+                         result=json.dumps(result.model_dump(), ensure_ascii=False))
+            log.info(f"Ingestion job {job_id} finished: {result.status}")
+            return
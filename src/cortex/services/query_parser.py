@@ -0,0 +1,162 @@
+from cortex.core.config import QUERY_KNOWN_SOURCES
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import re
+
+# 相对时间表达式 -> 计算 [开始, 结束) 时间范围的函数；结束为 None 表示直到现在
+_Range = Tuple[datetime, Optional[datetime]]
+
+
+def _day_start(now: datetime) -> datetime:
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _week_start(now: datetime) -> datetime:
+    return _day_start(now) - timedelta(days=now.weekday())
+
+
+def _month_start(now: datetime) -> datetime:
+    return _day_start(now).replace(day=1)
+
+
+def _previous_month_start(now: datetime) -> datetime:
+    return (_month_start(now) - timedelta(days=1)).replace(day=1)
+
+
+_CN_NUMBERS = {"一": 1, "两": 2, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+
+
+def _to_int(text: str) -> int:
+    return int(text) if text.isdigit() else _CN_NUMBERS[text]
+
+
+_N = r'(\d+|[一两二三四五六七八九十])'
+_TIME_PATTERNS: List[Tuple[re.Pattern, Callable[[datetime, re.Match], _Range]]] = [
+    (re.compile(r'今天|today', re.I),
+     lambda now, m: (_day_start(now), None)),
+    (re.compile(r'前天|day before yesterday', re.I),
+     lambda now, m: (_day_start(now) - timedelta(days=2), _day_start(now) - timedelta(days=1))),
+    (re.compile(r'昨天|yesterday', re.I),
+     lambda now, m: (_day_start(now) - timedelta(days=1), _day_start(now))),
+    (re.compile(r'(本|这)(周|个?星期)|this week', re.I),
+     lambda now, m: (_week_start(now), None)),
+    (re.compile(r'上(周|个?星期)|last week', re.I),
+     lambda now, m: (_week_start(now) - timedelta(weeks=1), _week_start(now))),
+    (re.compile(r'(本|这个)月|this month', re.I),
+     lambda now, m: (_month_start(now), None)),
+    (re.compile(r'上个?月|last month', re.I),
+     lambda now, m: (_previous_month_start(now), _month_start(now))),
+    (re.compile(r'今年|this year', re.I),
+     lambda now, m: (_day_start(now).replace(month=1, day=1), None)),
+    (re.compile(r'去年|last year', re.I),
+     lambda now, m: (_day_start(now).replace(year=now.year - 1, month=1, day=1),
+                     _day_start(now).replace(month=1, day=1))),
+    (re.compile(rf'(最近|过去|近){_N}\s*(天|日)', re.I),
+     lambda now, m: (_day_start(now) - timedelta(days=_to_int(m.group(2)) - 1), None)),
+    (re.compile(rf'(最近|过去|近){_N}\s*(周|个?星期)', re.I),
+     lambda now, m: (now - timedelta(weeks=_to_int(m.group(2))), None)),
+    (re.compile(r'(?:in the |over the )?(?:last|past) (\d+) days?', re.I),
+     lambda now, m: (_day_start(now) - timedelta(days=int(m.group(1)) - 1), None)),
+    (re.compile(r'(?:in the |over the )?(?:last|past) (\d+) weeks?', re.I),
+     lambda now, m: (now - timedelta(weeks=int(m.group(1))), None)),
+]
+
+# 规则未能覆盖的时间或条件表述：出现时说明规则解析可能不完整，交给LLM处理
+_UNHANDLED_CUES = re.compile(
+    r'\d{4}\s*年|\d{1,2}\s*月|\d{1,2}\s*[日号]|以前|之前|之后|以后|以来|期间|前[几\d]|最近|近期|'
+    r'来自|除了|不包括|\b(ago|before|after|since|between|until|recently|except|excluding|'
+    r'january|february|march|april|june|july|august|september|october|november|december)\b',
+    re.I)
+_TAG_RE = re.compile(r'#([\w\-+.]+)')
+# 来源名称后表示对话记录的词，如 "in my chatgpt chats"
+_EN_CHAT_WORDS = r'(?:chats?|conversations?|history|logs?|sessions?|threads?)\b'
+# 表明来源名称指的是记忆来源的上下文（来自、在…里、和…聊、in my … chats 等），{source} 替换为来源名称；
+# 没有这些上下文时，来源名称可能只是查询的主题（如 "how do I fine-tune qwen"），不能作为过滤条件
+_SOURCE_CUE_PATTERNS = [
+    rf'\bfrom\s+(?:my\s+)?{{source}}(?:\s+{_EN_CHAT_WORDS})?',
+    rf'\b(?:in|on|with)\s+(?:my\s+)?{{source}}(?:\s+{_EN_CHAT_WORDS}|\s*(?=$|[,，.。?？!！;；]))',
+    rf'(?:\b(?:in|from)\s+)?(?:\bmy\s+)?{{source}}\s+{_EN_CHAT_WORDS}',
+    r'在\s*{source}\s*(?:里面|里|中|当中)',
+    r'(?:从|来自)\s*{source}(?:\s*(?:里面|里|中))?',
+    r'(?:和|跟|与)\s*{source}\s*(?:的\s*)?(?:聊天|聊[了过]?|对话|会话)',
+    r'{source}\s*(?:的\s*)?(?:聊天记录|聊天|对话|会话)(?:\s*(?:里面|里|中))?',
+]
+# 去掉时间、来源后残留的连接词
+_FILLER_RE = re.compile(
+    r'^(\s*(的|在|里|中|关于))+|((的|里|中|里面|当中)\s*)+$|\b(in|on|from|with|my|about)\s*$', re.I)
+
+
+class QueryParser:
+    """
+    基于规则的本地查询解析器，输出与LLM查询拆解相同的结构：
+    {"core_query": ..., "filters": [{"field": ..., "operator": ..., "value": ...}]}。
+
+    能识别相对时间（“上周”“last week”“最近3天”等）、已知的记忆来源名称和 #标签；
+    来源名称只有出现在“来自”“在…里”“和…聊”“in my … chats”等上下文中时才解析为过滤条件。
+    遇到规则无法完全理解的表述时降低置信度，由调用方回退到LLM。
+    """
+
+    def __init__(self, known_sources: Optional[List[str]] = None):
+        sources = known_sources if known_sources is not None else QUERY_KNOWN_SOURCES
+        self.known_sources = [s.lower() for s in sources if s]
+        self._source_re = None
+        self._source_cue_res: List[re.Pattern] = []
+        if self.known_sources:
+            names = "|".join(re.escape(s) for s in sorted(self.known_sources, key=len, reverse=True))
+            self._source_re = re.compile(rf'(?<![A-Za-z0-9])({names})(?![A-Za-z0-9])', re.I)
+            source = rf'(?<![A-Za-z0-9])(?P<source>{names})(?![A-Za-z0-9])'
+            self._source_cue_res = [re.compile(pattern.replace("{source}", source), re.I)
+                                    for pattern in _SOURCE_CUE_PATTERNS]
+
+    def parse(self, query: str, current_timestamp: int) -> Tuple[Dict[str, Any], float]:
+        """
+        Returns:
+            (结构化查询, 置信度)。置信度为 1.0 表示查询被完整理解。
+        """
+        now = datetime.fromtimestamp(current_timestamp)
+        text = query
+        filters: List[Dict[str, Any]] = []
+
+        time_matches = []
+        for pattern, to_range in _TIME_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                time_matches.append((match, to_range))
+                text = text[:match.start()] + " " + text[match.end():]
+        if len(time_matches) > 1:
+            # 多个时间表达式的组合（如“去年和今年”）交给LLM
+            return {"core_query": query, "filters": []}, 0.3
+        if time_matches:
+            match, to_range = time_matches[0]
+            start, end = to_range(now, match)
+            filters.append({"field": "creation_ts", "operator": "gte", "value": int(start.timestamp())})
+            if end is not None:
+                filters.append({"field": "creation_ts", "operator": "lt", "value": int(end.timestamp())})
+
+        # 提到了已知来源但没有表明是记忆来源的上下文，保留在检索词中，由LLM判断是否过滤
+        uncued_source = False
+        if self._source_re:
+            sources = {m.group(1).lower() for m in self._source_re.finditer(text)}
+            if len(sources) > 1:
+                return {"core_query": query, "filters": []}, 0.3
+            if sources:
+                if any(cue_re.search(text) for cue_re in self._source_cue_res):
+                    filters.append({"field": "source", "operator": "eq", "value": sources.pop()})
+                    for cue_re in self._source_cue_res:
+                        text = cue_re.sub(" ", text)
+                else:
+                    uncued_source = True
+
+        # 标签在元数据中以逗号拼接的字符串存储，无法精确过滤，保留为检索词
+        text = _TAG_RE.sub(r'\1', text)
+
+        confidence = 1.0
+        if _UNHANDLED_CUES.search(text):
+            confidence = 0.3
+        elif uncued_source:
+            confidence = 0.5
+        core_query = re.sub(r'\s+', ' ', text).strip(" \t?？!！.。,，;；:：~")
+        core_query = _FILLER_RE.sub("", core_query).strip(" ,，")
+        if not core_query:
+            return {"core_query": query, "filters": filters}, 0.0
+        return {"core_query": core_query, "filters": filters}, confidence
@@ -1,14 +1,59 @@
-from cortex.core.config import RETRIEVAL_TOP_K
+from cortex.core.config import (
+    RETRIEVAL_TOP_K,
+    QUERY_BATCH_CONCURRENCY,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
+    SYNTHESIS_CACHE_SIZE,
+    SYNTHESIS_CACHE_PATH,
+    PROMPT_TEMPLATE_NAME,
+    QUERY_RULE_PARSER_ENABLED,
+    QUERY_PARSER_MIN_CONFIDENCE,
+    SPECULATIVE_RETRIEVAL_ENABLED,
+    SPECULATIVE_RETRIEVAL_OVERFETCH
+)
+from cortex.core.cache import TTLCache, SQLiteCache
+from cortex.core.metrics import timed
 from cortex.core.models import ContextResponse
-from cortex.core.prompt import get_synthesis_prompt, get_formatted_prompt
-from cortex.core.model_chat import generate_chat_completion
+from cortex.core.prompt import get_synthesis_prompt, get_formatted_prompt, get_template_version
+from cortex.core.model_chat import (
+    generate_chat_completion,
+    generate_chat_completion_stream,
+    agenerate_chat_completion,
+    agenerate_chat_completion_stream,
+    LLMUnavailableError,
+    LLM_ERROR_MESSAGE
+)
+from cortex.services.context_packer import ContextPacker
+from cortex.services.query_parser import QueryParser
 from cortex.logger.logger import get_logger
-from typing import Optional, Tuple, List, Dict, Any
+from typing import Optional, Tuple, List, Dict, Any, AsyncIterator, Iterator, Sequence
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import hashlib
+import copy
 import json
+import re
 import time
 
 log = get_logger(__name__)
 
+# 取值为Unix时间戳的元数据字段，缓存命中时需要按当前时间重新锚定
+_TIME_FILTER_FIELDS = ("creation_ts",)
+
+# 与 Chroma 元数据过滤运算符语义一致的内存求值函数
+_FILTER_OPERATORS = {
+    "eq": lambda actual, expected: actual == expected,
+    "ne": lambda actual, expected: actual != expected,
+    "gt": lambda actual, expected: actual is not None and actual > expected,
+    "gte": lambda actual, expected: actual is not None and actual >= expected,
+    "lt": lambda actual, expected: actual is not None and actual < expected,
+    "lte": lambda actual, expected: actual is not None and actual <= expected,
+    "in": lambda actual, expected: actual in expected,
+    "nin": lambda actual, expected: actual not in expected,
+}
+
 
 class RetrievalService:
     """
@@ -18,73 +63,434 @@ class RetrievalService:
     def __init__(self, storage_service):
         """通过依赖注入接收存储服务实例。"""
         self.storage_service = storage_service
+        self.query_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+        self.query_parser = QueryParser() if QUERY_RULE_PARSER_ENABLED else None
+        self.context_packer = ContextPacker()
+        # 推测性检索与LLM查询拆解并行执行
+        self._executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="speculative-retrieval")
+        # 批量查询的查询拆解和上下文合成使用独立的线程池，不占用单次查询推测性检索的线程
+        self._batch_executor = ThreadPoolExecutor(
+            max_workers=max(1, QUERY_BATCH_CONCURRENCY), thread_name_prefix="batch-query")
+        if SYNTHESIS_CACHE_PATH:
+            self.synthesis_cache = SQLiteCache(
+                Path(SYNTHESIS_CACHE_PATH), SYNTHESIS_CACHE_SIZE)
+        else:
+            self.synthesis_cache = TTLCache(SYNTHESIS_CACHE_SIZE)
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """归一化查询文本：忽略大小写、多余空白和末尾标点。"""
+        query = re.sub(r'\s+', ' ', query).strip().lower()
+        return query.rstrip("?？!！.。,，;；~ ")
+
+    @staticmethod
+    def _reanchor_time_filters(structured_query: Dict[str, Any], offset: int) -> Dict[str, Any]:
+        """
+        将缓存结果中的时间过滤条件平移 offset 秒。
+        LLM基于请求时的 current_timestamp 计算“上周”“最近三天”等相对时间，
+        缓存命中时按当前时间重新锚定，保证相对时间范围依然正确。
+        """
+        structured_query = copy.deepcopy(structured_query)
+        if offset:
+            for f in structured_query.get("filters") or []:
+                if f.get("field") in _TIME_FILTER_FIELDS and isinstance(f.get("value"), (int, float)):
+                    f["value"] = int(f["value"] + offset)
+        return structured_query
+
+    def _parse_query_with_rules(self, query: str) -> Optional[Dict[str, Any]]:
+        """使用本地规则解析查询，置信度不足时返回 None，由调用方改用LLM拆解。"""
+        with timed("query", "rule_parse"):
+            structured_query, confidence = self.query_parser.parse(query, int(time.time()))
+        if confidence < QUERY_PARSER_MIN_CONFIDENCE:
+            return None
+        log.info(f"Parsed query with rules: {structured_query}")
+        return structured_query
 
     def _understand_query_with_llm(self, query: str) -> Dict[str, Any]:
+        current_timestamp = int(time.time())
+        cached = self._cached_decomposition(query, current_timestamp)
+        if cached is not None:
+            return cached
         try:
-            prompt = get_formatted_prompt(
-                template_name="cortex_sys_v1.md",
-                substitutions={"user_query": query,
-                               "current_timestamp": int(time.time())}
-            )
+            prompt = self._decomposition_prompt(query, current_timestamp)
             log.info("Decomposing user query with LLM...")
-            response_str = generate_chat_completion(prompt)
-            if response_str.startswith("```json"):
-                response_str = response_str[7:-4].strip()
-            structured_query = json.loads(response_str)
-            log.info(f"Decomposed query: {structured_query}")
-            return structured_query
+            with timed("query", "llm_decompose"):
+                response_str = generate_chat_completion(prompt)
+            return self._parse_decomposition(query, response_str, current_timestamp)
         except Exception as e:
             log.error(
                 f"Failed to understand query with LLM: {e}. Falling back to simple semantic search.")
             return {"core_query": query, "filters": []}
 
-    def retrieve_and_prepare_context(self, query: str) -> Optional[Tuple[str, List[str]]]:
-        structured_query = self._understand_query_with_llm(query)
-        core_query = structured_query.get("core_query", query)
-        where_clause = {}
-        if "filters" in structured_query and structured_query["filters"]:
-            filters_list = []
-            for f in structured_query["filters"]:
-                field, op, value = f['field'], f['operator'], f['value']
-                if op == 'eq':
-                    filters_list.append({field: value})
-                else:
-                    filters_list.append({field: {f"${op}": value}})
-            if filters_list:
-                where_clause["$and"] = filters_list
+    async def _aunderstand_query_with_llm(self, query: str) -> Dict[str, Any]:
+        """_understand_query_with_llm 的异步版本，LLM调用不占用线程。"""
+        current_timestamp = int(time.time())
+        cached = self._cached_decomposition(query, current_timestamp)
+        if cached is not None:
+            return cached
+        try:
+            prompt = self._decomposition_prompt(query, current_timestamp)
+            log.info("Decomposing user query with LLM...")
+            with timed("query", "llm_decompose"):
+                response_str = await agenerate_chat_completion(prompt)
+            return self._parse_decomposition(query, response_str, current_timestamp)
+        except Exception as e:
+            log.error(
+                f"Failed to understand query with LLM: {e}. Falling back to simple semantic search.")
+            return {"core_query": query, "filters": []}
+
+    def _cached_decomposition(self, query: str, current_timestamp: int) -> Optional[Dict[str, Any]]:
+        cached = self.query_cache.get(self._normalize_query(query))
+        if cached is None:
+            return None
+        anchor_timestamp, cached_query = cached
+        structured_query = self._reanchor_time_filters(
+            cached_query, current_timestamp - anchor_timestamp)
+        log.info(f"Query decomposition cache hit: {structured_query}")
+        return structured_query
+
+    @staticmethod
+    def _decomposition_prompt(query: str, current_timestamp: int) -> str:
+        return get_formatted_prompt(
+            template_name="cortex_sys_v1.md",
+            substitutions={"user_query": query,
+                           "current_timestamp": current_timestamp}
+        )
+
+    def _parse_decomposition(self, query: str, response_str: str, current_timestamp: int) -> Dict[str, Any]:
+        if response_str.startswith("```json"):
+            response_str = response_str[7:-4].strip()
+        structured_query = json.loads(response_str)
+        log.info(f"Decomposed query: {structured_query}")
+        # 只缓存成功解析的结果，回退结果不缓存
+        self.query_cache.set(
+            self._normalize_query(query), (current_timestamp, copy.deepcopy(structured_query)))
+        return structured_query
+
+    @staticmethod
+    def _build_where_clause(filters: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        filters_list = []
+        for f in filters or []:
+            field, op, value = f['field'], f['operator'], f['value']
+            if op == 'eq':
+                filters_list.append({field: value})
+            else:
+                filters_list.append({field: {f"${op}": value}})
+        if not filters_list:
+            return None
+        # Chroma 要求 $and 中至少有两个条件
+        if len(filters_list) == 1:
+            return filters_list[0]
+        return {"$and": filters_list}
+
+    @staticmethod
+    def _matches_filters(metadata: Dict[str, Any], filters: List[Dict[str, Any]]) -> bool:
+        """在内存中对记忆片段的元数据求值过滤条件（各条件之间为“与”关系）。"""
+        for f in filters:
+            try:
+                if not _FILTER_OPERATORS[f['operator']](metadata.get(f['field']), f['value']):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def _search(self, core_query: str, filters: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        where_clause = self._build_where_clause(filters)
         log.info(
             f"Executing hybrid search with core_query='{core_query}' and where_clause={where_clause}")
-
         # 通过注入的实例调用
-        retrieved_memories = self.storage_service.query_memories(
+        return self.storage_service.query_memories(
             query_text=core_query,
-            top_k=RETRIEVAL_TOP_K,
-            where_filter=where_clause if where_clause else None
+            top_k=top_k,
+            where_filter=where_clause
+        )
+
+    def _retrieve_speculatively(self, query: str) -> List[Dict[str, Any]]:
+        """
+        在LLM拆解查询的同时，用原始查询执行一次不带过滤条件的检索（多取若干结果）。
+
+        拆解后的检索词与原始查询相同时：没有过滤条件则直接复用；有过滤条件时先在内存中筛选，
+        数量不足 top_k 时再执行一次带过滤条件的检索补足。检索词被改写时，推测结果的距离
+        与改写后查询的距离不可比较，丢弃推测结果，按拆解结果重新检索。
+        """
+        # 在当前上下文中执行，使检索阶段的耗时计入当前请求的阶段记录
+        speculative = self._executor.submit(
+            contextvars.copy_context().run,
+            self.storage_service.query_memories,
+            query_text=query,
+            top_k=RETRIEVAL_TOP_K * SPECULATIVE_RETRIEVAL_OVERFETCH,
+            where_filter=None
         )
+        structured_query = self._understand_query_with_llm(query)
+        try:
+            candidates = speculative.result()
+        except Exception as e:
+            log.error(f"Speculative retrieval failed: {e}")
+            candidates = None
+        return self._refine_speculative_results(query, structured_query, candidates)
+
+    async def _aretrieve_speculatively(self, query: str) -> List[Dict[str, Any]]:
+        """_retrieve_speculatively 的异步版本：检索在线程中执行，同时通过异步客户端拆解查询。"""
+        speculative = asyncio.ensure_future(asyncio.to_thread(
+            self.storage_service.query_memories,
+            query_text=query,
+            top_k=RETRIEVAL_TOP_K * SPECULATIVE_RETRIEVAL_OVERFETCH,
+            where_filter=None
+        ))
+        try:
+            structured_query = await self._aunderstand_query_with_llm(query)
+            try:
+                candidates = await speculative
+            except Exception as e:
+                log.error(f"Speculative retrieval failed: {e}")
+                candidates = None
+        finally:
+            speculative.cancel()
+        return await asyncio.to_thread(self._refine_speculative_results, query, structured_query, candidates)
+
+    def _refine_speculative_results(self, query: str, structured_query: Dict[str, Any],
+                                    candidates: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """按拆解结果复用、筛选或补足推测性检索的结果；candidates 为 None 表示推测性检索失败。"""
+        filters = structured_query.get("filters") or []
+        core_query = structured_query.get("core_query", query)
+        if candidates is None:
+            return self._search(core_query, filters, RETRIEVAL_TOP_K)
+        if self._normalize_query(core_query) != self._normalize_query(query):
+            log.info("Query was rewritten, discarding speculative retrieval results.")
+            return self._search(core_query, filters, RETRIEVAL_TOP_K)
+        if not filters:
+            log.info("Reusing speculative retrieval results.")
+            return candidates[:RETRIEVAL_TOP_K]
+
+        matches = []
+        if all(f.get('operator') in _FILTER_OPERATORS for f in filters):
+            matches = [m for m in candidates if self._matches_filters(m['metadata'], filters)]
+            if len(matches) >= RETRIEVAL_TOP_K:
+                log.info("Refined speculative retrieval results with filters in memory.")
+                return matches[:RETRIEVAL_TOP_K]
+        # 用与推测性检索相同的查询文本补足，两次检索的距离才能放在一起排序
+        topped_up = self._search(query, filters, RETRIEVAL_TOP_K)
+        merged = {m['id']: m for m in matches}
+        merged.update((m['id'], m) for m in topped_up)
+        return sorted(merged.values(), key=lambda m: m['distance'])[:RETRIEVAL_TOP_K]
+
+    def retrieve_and_prepare_context(self, query: str) -> Optional[Tuple[str, List[str], List[str]]]:
+        """
+        检索与查询相关的记忆并拼装成待合成的上下文。
+
+        Returns:
+            (待合成的上下文, 记忆来源列表, 按顺序排列的记忆片段ID)；未找到相关记忆时返回 None。
+        """
+        structured_query = None
+        if self.query_parser is not None:
+            structured_query = self._parse_query_with_rules(query)
+        if structured_query is not None:
+            retrieved_memories = self._search(
+                structured_query.get("core_query", query), structured_query.get("filters"), RETRIEVAL_TOP_K)
+        elif SPECULATIVE_RETRIEVAL_ENABLED:
+            retrieved_memories = self._retrieve_speculatively(query)
+        else:
+            structured_query = self._understand_query_with_llm(query)
+            retrieved_memories = self._search(
+                structured_query.get("core_query", query), structured_query.get("filters"), RETRIEVAL_TOP_K)
+        return self._prepare_context(retrieved_memories)
+
+    async def aretrieve_and_prepare_context(self, query: str) -> Optional[Tuple[str, List[str], List[str]]]:
+        """
+        retrieve_and_prepare_context 的异步版本。
+
+        查询拆解使用异步LLM客户端，嵌入计算和向量检索在线程中执行，不阻塞事件循环；
+        任务被取消时立即返回，已提交到线程中的检索在完成后被丢弃。
+        """
+        structured_query = None
+        if self.query_parser is not None:
+            structured_query = self._parse_query_with_rules(query)
+        if structured_query is not None:
+            retrieved_memories = await asyncio.to_thread(
+                self._search, structured_query.get("core_query", query), structured_query.get("filters"),
+                RETRIEVAL_TOP_K)
+        elif SPECULATIVE_RETRIEVAL_ENABLED:
+            retrieved_memories = await self._aretrieve_speculatively(query)
+        else:
+            structured_query = await self._aunderstand_query_with_llm(query)
+            retrieved_memories = await asyncio.to_thread(
+                self._search, structured_query.get("core_query", query), structured_query.get("filters"),
+                RETRIEVAL_TOP_K)
+        return self._prepare_context(retrieved_memories)
+
+    def retrieve_and_prepare_context_batch(self, queries: List[str]) -> List[Optional[Tuple[str, List[str], List[str]]]]:
+        """
+        批量版本的 retrieve_and_prepare_context。
+
+        需要LLM拆解的查询并发拆解，之后所有查询通过 query_memories_batch 合并检索，
+        过滤条件相同的查询共享一次嵌入计算和检索调用。
+        """
+        structured_queries: List[Optional[Dict[str, Any]]] = [
+            self._parse_query_with_rules(query) if self.query_parser is not None else None
+            for query in queries]
+        pending = [i for i, structured in enumerate(structured_queries) if structured is None]
+        for i, structured in zip(pending, self._map_in_context(
+                self._understand_query_with_llm, [queries[i] for i in pending])):
+            structured_queries[i] = structured
+
+        core_queries = [structured.get("core_query", query)
+                        for query, structured in zip(queries, structured_queries)]
+        where_filters = [self._build_where_clause(structured.get("filters"))
+                         for structured in structured_queries]
+        retrieved = self.storage_service.query_memories_batch(
+            core_queries, RETRIEVAL_TOP_K, where_filters)
+        return [self._prepare_context(memories) for memories in retrieved]
+
+    def _prepare_context(self, retrieved_memories: List[Dict[str, Any]]) -> Optional[Tuple[str, List[str], List[str]]]:
         if not retrieved_memories:
             log.info("No relevant memories found after hybrid search.")
             return None
         log.info(f"Retrieved {len(retrieved_memories)} memory chunks.")
-        context_for_synthesis = "相关历史记忆片段:\n\n"
-        sources = set()
-        for i, memory in enumerate(retrieved_memories):
-            source_name = memory['metadata'].get('source', '未知来源')
-            context_for_synthesis += f"--- 记忆片段 {i+1} (来源: {source_name}) ---\n"
-            context_for_synthesis += memory['text'] + "\n\n"
-            sources.add(source_name)
-        return context_for_synthesis, list(sources)
-
-    def synthesize_context(self, context: str) -> str:
+        with timed("query", "context_pack"):
+            return self.context_packer.pack(retrieved_memories)
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """查询拆解缓存和合成缓存的命中统计。"""
+        return {"query_decomposition": self.query_cache.stats(), "synthesis": self.synthesis_cache.stats()}
+
+    def _synthesis_cache_key(self, context: str, chunk_ids: Optional[Sequence[str]]) -> str:
+        """合成缓存键：Prompt模板名称与版本 + 有序的记忆片段ID（未提供时使用上下文哈希）。"""
+        if chunk_ids:
+            content_key = ",".join(chunk_ids)
+        else:
+            content_key = hashlib.sha256(context.encode('utf-8')).hexdigest()
+        template_version = get_template_version(PROMPT_TEMPLATE_NAME)
+        return f"{PROMPT_TEMPLATE_NAME}@{template_version}:{content_key}"
+
+    def synthesize_context(self, context: str, chunk_ids: Optional[Sequence[str]] = None) -> str:
+        cache_key = self._synthesis_cache_key(context, chunk_ids)
+        cached = self.synthesis_cache.get(cache_key)
+        if cached is not None:
+            log.info("Synthesis cache hit.")
+            return cached
+        log.info("Step 2: Synthesizing context with configured LLM...")
+        meta_prompt = get_synthesis_prompt(context)
+        try:
+            with timed("query", "synthesis"):
+                synthesized_context = generate_chat_completion(
+                    meta_prompt, raise_on_error=True)
+        except LLMUnavailableError:
+            return LLM_ERROR_MESSAGE
+        self.synthesis_cache.set(cache_key, synthesized_context)
+        log.info("Synthesis complete.")
+        return synthesized_context
+
+    def synthesize_context_stream(self, context: str, chunk_ids: Optional[Sequence[str]] = None) -> Iterator[str]:
+        """synthesize_context 的流式版本，逐段产出合成结果。"""
+        cache_key = self._synthesis_cache_key(context, chunk_ids)
+        cached = self.synthesis_cache.get(cache_key)
+        if cached is not None:
+            log.info("Synthesis cache hit.")
+            yield cached
+            return
+        log.info("Step 2: Streaming context synthesis with configured LLM...")
+        meta_prompt = get_synthesis_prompt(context)
+        parts = []
+        for token in generate_chat_completion_stream(meta_prompt):
+            parts.append(token)
+            yield token
+        synthesized_context = "".join(parts)
+        if synthesized_context and synthesized_context != LLM_ERROR_MESSAGE:
+            self.synthesis_cache.set(cache_key, synthesized_context)
+        log.info("Synthesis stream complete.")
+
+    async def asynthesize_context(self, context: str, chunk_ids: Optional[Sequence[str]] = None) -> str:
+        """synthesize_context 的异步版本。"""
+        cache_key = self._synthesis_cache_key(context, chunk_ids)
+        cached = self.synthesis_cache.get(cache_key)
+        if cached is not None:
+            log.info("Synthesis cache hit.")
+            return cached
         log.info("Step 2: Synthesizing context with configured LLM...")
         meta_prompt = get_synthesis_prompt(context)
-        synthesized_context = generate_chat_completion(meta_prompt)
+        try:
+            with timed("query", "synthesis"):
+                synthesized_context = await agenerate_chat_completion(
+                    meta_prompt, raise_on_error=True)
+        except LLMUnavailableError:
+            return LLM_ERROR_MESSAGE
+        self.synthesis_cache.set(cache_key, synthesized_context)
         log.info("Synthesis complete.")
         return synthesized_context
 
+    async def asynthesize_context_stream(self, context: str,
+                                         chunk_ids: Optional[Sequence[str]] = None) -> AsyncIterator[str]:
+        """
+        synthesize_context_stream 的异步版本。
+
+        调用方停止迭代或任务被取消时，与模型的流式连接随之关闭，未完成的结果不写入缓存。
+        """
+        cache_key = self._synthesis_cache_key(context, chunk_ids)
+        cached = self.synthesis_cache.get(cache_key)
+        if cached is not None:
+            log.info("Synthesis cache hit.")
+            yield cached
+            return
+        log.info("Step 2: Streaming context synthesis with configured LLM...")
+        meta_prompt = get_synthesis_prompt(context)
+        parts = []
+        stream = agenerate_chat_completion_stream(meta_prompt)
+        try:
+            async for token in stream:
+                parts.append(token)
+                yield token
+        finally:
+            await stream.aclose()
+        synthesized_context = "".join(parts)
+        if synthesized_context and synthesized_context != LLM_ERROR_MESSAGE:
+            self.synthesis_cache.set(cache_key, synthesized_context)
+        log.info("Synthesis stream complete.")
+
     def query_and_synthesize(self, query: str) -> ContextResponse:
-        retrieval_result = self.retrieve_and_prepare_context(query)
-        if not retrieval_result:
-            return ContextResponse(context="未找到与您查询相关的记忆。", retrieved_sources=[])
-        context_for_synthesis, sources = retrieval_result
-        synthesized_context = self.synthesize_context(context_for_synthesis)
-        return ContextResponse(context=synthesized_context, retrieved_sources=sources)
+        with timed("query", "total"):
+            with timed("query", "retrieval"):
+                retrieval_result = self.retrieve_and_prepare_context(query)
+            if not retrieval_result:
+                return ContextResponse(context="未找到与您查询相关的记忆。", retrieved_sources=[])
+            context_for_synthesis, sources, chunk_ids = retrieval_result
+            synthesized_context = self.synthesize_context(
+                context_for_synthesis, chunk_ids)
+            return ContextResponse(context=synthesized_context, retrieved_sources=sources)
+
+    async def aquery_and_synthesize(self, query: str) -> ContextResponse:
+        """query_and_synthesize 的异步版本。"""
+        with timed("query", "total"):
+            with timed("query", "retrieval"):
+                retrieval_result = await self.aretrieve_and_prepare_context(query)
+            if not retrieval_result:
+                return ContextResponse(context="未找到与您查询相关的记忆。", retrieved_sources=[])
+            context_for_synthesis, sources, chunk_ids = retrieval_result
+            synthesized_context = await self.asynthesize_context(
+                context_for_synthesis, chunk_ids)
+            return ContextResponse(context=synthesized_context, retrieved_sources=sources)
+
+    def query_and_synthesize_batch(self, queries: List[str], synthesize: bool = True) -> List[ContextResponse]:
+        """
+        批量查询。检索合并执行，合成在独立的线程池中对各查询并发进行（并发度为 QUERY_BATCH_CONCURRENCY）。
+
+        synthesize 为 False 时不调用LLM，直接返回拼装好的待合成上下文。
+        """
+        retrieval_results = self.retrieve_and_prepare_context_batch(queries)
+
+        def respond(retrieval_result) -> ContextResponse:
+            if not retrieval_result:
+                return ContextResponse(context="未找到与您查询相关的记忆。", retrieved_sources=[])
+            context_for_synthesis, sources, chunk_ids = retrieval_result
+            if not synthesize:
+                return ContextResponse(context=context_for_synthesis, retrieved_sources=sources)
+            return ContextResponse(
+                context=self.synthesize_context(context_for_synthesis, chunk_ids), retrieved_sources=sources)
+
+        return self._map_in_context(respond, retrieval_results)
+
+    def _map_in_context(self, function, items: Sequence[Any]) -> List[Any]:
+        """在批量查询线程池中并发执行，每个任务运行在调用方上下文的副本中（保留LLM优先级和阶段耗时记录）。"""
+        contexts = [contextvars.copy_context() for _ in items]
+        return list(self._batch_executor.map(
+            lambda context, item: context.run(function, item), contexts, items))
@@ -0,0 +1,78 @@
+from cortex.core.config import WARMUP_ON_STARTUP
+from cortex.core.model_chat import warmup_llm
+from cortex.logger.logger import get_logger
+from typing import Any, Callable, Dict, Optional
+import threading
+import time
+
+log = get_logger(__name__)
+
+
+class StartupTask:
+    """
+    在后台线程中初始化存储服务（向量数据库、嵌入模型、文件哈希索引），并可选地预热嵌入模型和LLM。
+
+    服务进程无需等待这些组件加载即可开始监听端口；就绪状态通过 status() 对外暴露，
+    存储服务初始化完成即视为就绪，LLM预热失败只记录在状态中，不影响检索功能。
+    """
+
+    def __init__(self, storage_service, warmup_on_start: bool = WARMUP_ON_STARTUP,
+                 llm_warmup: Callable[[], None] = warmup_llm):
+        """通过依赖注入接收存储服务实例和LLM预热函数。"""
+        self.storage_service = storage_service
+        self.warmup_on_start = warmup_on_start
+        self._llm_warmup = llm_warmup
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._components: Dict[str, Dict[str, Any]] = {"storage": {"status": "pending"}}
+
+    def start(self):
+        """启动后台初始化线程，重复调用无效果。"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self.run, name="cortex-startup", daemon=True)
+            self._thread.start()
+
+    def run(self):
+        """同步执行初始化，以及按配置执行预热。"""
+        if self._run_step("storage", self.storage_service.initialize) and self.warmup_on_start:
+            self.warmup()
+
+    def warmup(self) -> Dict[str, Any]:
+        """计算一条嵌入并向LLM发送一次最小请求，返回预热后的状态。"""
+        if self._run_step("storage", self.storage_service.initialize):
+            self._run_step("embedding_warmup", self.storage_service.warmup)
+            self._run_step("llm_warmup", self._llm_warmup)
+        return self.status()
+
+    def _run_step(self, name: str, step: Callable[[], None]) -> bool:
+        with self._lock:
+            if self._components.get(name, {}).get("status") == "ready":
+                return True
+            self._components[name] = {"status": "running"}
+        started_at = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            log.error(f"Startup step '{name}' failed: {e}")
+            with self._lock:
+                self._components[name] = {"status": "failed", "error": str(e)}
+            return False
+        with self._lock:
+            self._components[name] = {
+                "status": "ready", "seconds": round(time.perf_counter() - started_at, 3)}
+        return True
+
+    @property
+    def is_ready(self) -> bool:
+        return self.storage_service.is_ready
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            components = {name: dict(state) for name, state in self._components.items()}
+        if self.storage_service.is_ready and components["storage"]["status"] != "ready":
+            # 存储服务也可能在首次请求时被惰性初始化
+            components["storage"] = {"status": "ready"}
+        return {"ready": self.is_ready, "components": components}
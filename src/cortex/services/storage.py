@@ -1,8 +1,32 @@
 import chromadb
-from chromadb.utils import embedding_functions
-from cortex.core.config import DB_PATH, COLLECTION_NAME, EMBEDDING_MODEL
-from typing import List, Dict, Any, Optional
+from cortex.core.config import (
+    DB_PATH,
+    COLLECTION_NAME,
+    EMBEDDING_MODEL,
+    EMBEDDING_BACKEND,
+    INGEST_EMBED_BATCH_SIZE,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    HASH_INDEX_ENABLED,
+    HASH_INDEX_PATH,
+    HASH_INDEX_BLOOM,
+    HASH_INDEX_BLOOM_CAPACITY,
+    HASH_INDEX_SAVE_INTERVAL,
+    STORAGE_MODE
+)
+from cortex.core.embedding import create_embedding_function, check_embedding_compatibility, embedding_variant
+from cortex.core.embedding_cache import EmbeddingCache, CachedEmbeddingFunction
+from cortex.core.hash_index import FileHashIndex, BloomFilter
+from cortex.core.metrics import timed
+from chromadb.api.types import EmbeddingFunction
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Set, Iterable, Callable
 from cortex.logger.logger import get_logger
+import atexit
+import json
+import threading
+import time
 
 log = get_logger(__name__)
 
@@ -10,65 +34,361 @@ log = get_logger(__name__)
 class StorageService:
     """
     封装对本地向量数据库的所有操作。
+
+    不带参数构造时返回进程内共享的单例；传入数据库目录、嵌入函数等参数时创建独立的实例，
+    用于基准测试等需要使用临时数据库的场景。
     """
     _instance = None
 
     def __new__(cls, *args, **kwargs):
+        if args or kwargs:
+            return super(StorageService, cls).__new__(cls)
         if not cls._instance:
-            cls._instance = super(StorageService, cls).__new__(
-                cls, *args, **kwargs)
+            cls._instance = super(StorageService, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self):
-        if not hasattr(self, 'client'):
+    def __init__(self, db_path: Path = DB_PATH, embedding_function: Optional[EmbeddingFunction] = None,
+                 hash_index_path: Optional[Path] = HASH_INDEX_PATH):
+        """
+        Args:
+            db_path: Chroma 数据库目录。
+            embedding_function: 使用指定的嵌入函数（不加嵌入缓存），未提供时按配置创建。
+            hash_index_path: 文件哈希索引的旁路文件，为 None 时不使用哈希索引。
+        """
+        if not hasattr(self, '_init_lock'):
+            # 构造时不加载任何重量级组件，数据库客户端、嵌入模型和哈希索引在 initialize() 中加载，
+            # 由后台启动任务提前调用，或在首次访问时自动调用
+            self._db_path = db_path
+            self._custom_embedding_function = embedding_function
+            self._hash_index_path = hash_index_path if HASH_INDEX_ENABLED else None
+            self._init_lock = threading.Lock()
+            self._client = None
+            self._collection = None
+            self._embedding_function = None
+            self._hash_index = None
+            self._ready = False
+            self._write_listeners: List[Callable[[], None]] = []
+
+    def initialize(self):
+        """加载数据库客户端、嵌入函数、集合和文件哈希索引。可重复调用，只有第一次会真正执行。"""
+        if self._ready:
+            return
+        with self._init_lock:
+            if self._ready:
+                return
+            started_at = time.perf_counter()
             log.info("Initializing ChromaDB client...")
-            self.client = chromadb.PersistentClient(path=str(DB_PATH))
-            embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name=EMBEDDING_MODEL
-            )
-            self.collection = self.client.get_or_create_collection(
+            client = chromadb.PersistentClient(path=str(self._db_path))
+            embedding_function = self._custom_embedding_function
+            model_name = EMBEDDING_MODEL if embedding_function is None else embedding_function.name()
+            if embedding_function is None:
+                embedding_function = create_embedding_function(EMBEDDING_BACKEND)
+            if self._custom_embedding_function is None and EMBEDDING_CACHE_ENABLED:
+                # 量化后的向量与原始向量略有差异，分开缓存
+                cache_namespace = EMBEDDING_MODEL
+                if embedding_variant() != "fp32":
+                    cache_namespace = f"{EMBEDDING_MODEL}-{embedding_variant()}"
+                embedding_function = CachedEmbeddingFunction(
+                    embedding_function,
+                    EmbeddingCache(EMBEDDING_CACHE_DIR, cache_namespace,
+                                   EMBEDDING_CACHE_MAX_ENTRIES)
+                )
+            # 嵌入由本服务计算后显式传给 Chroma，更换嵌入后端时不受集合中持久化的嵌入函数配置约束，
+            # 兼容性由下面的检查保证
+            collection = client.get_or_create_collection(
                 name=COLLECTION_NAME,
-                embedding_function=embedding_function
+                embedding_function=None
             )
+            # 防止更换嵌入模型后，新旧模型的向量混在同一个集合中
+            embedding_info = check_embedding_compatibility(
+                collection.metadata, has_vectors=collection.count() > 0, model_name=model_name)
+            if embedding_info:
+                collection.modify(metadata={**(collection.metadata or {}), **embedding_info})
+            self._client = client
+            self._collection = collection
+            self._embedding_function = embedding_function
             log.info(
-                f"ChromaDB collection '{COLLECTION_NAME}' loaded/created with SentenceTransformerEmbeddingFunction.")
+                f"ChromaDB collection '{COLLECTION_NAME}' loaded/created with '{EMBEDDING_BACKEND}' embedding backend.")
+            if self._hash_index_path is not None:
+                self._load_hash_index()
+                atexit.register(self.save_hash_index)
+            self._ready = True
+            log.info(f"Storage service initialized in {time.perf_counter() - started_at:.2f}s.")
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready
+
+    @property
+    def client(self):
+        self.initialize()
+        return self._client
+
+    @property
+    def collection(self):
+        self.initialize()
+        return self._collection
+
+    @property
+    def embedding_function(self):
+        self.initialize()
+        return self._embedding_function
+
+    @property
+    def hash_index(self):
+        self.initialize()
+        return self._hash_index
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """嵌入缓存的命中统计；尚未初始化或未启用缓存时为空。"""
+        embedding_function = self._embedding_function
+        if not isinstance(embedding_function, CachedEmbeddingFunction):
+            return {}
+        return {"embedding": {"hits": embedding_function.hits, "misses": embedding_function.misses}}
+
+    def warmup(self):
+        """计算一条嵌入，使嵌入模型（以及 ONNX 会话、分词器）在首个真实请求之前完成加载。"""
+        started_at = time.perf_counter()
+        # 绕过嵌入缓存，确保真正调用模型
+        embedding_function = self.embedding_function
+        getattr(embedding_function, "_embedding_function", embedding_function)(["warmup"])
+        log.info(f"Embedding model warmed up in {time.perf_counter() - started_at:.2f}s.")
 
-    def add_memory_chunks(self, chunks: List[str], metadatas: List[Dict[str, Any]], ids: List[str]):
-        """向数据库中批量添加记忆片段。"""
+    def _load_hash_index(self):
+        """加载文件哈希索引的旁路文件；文件不存在或已过期时扫描一次集合元数据重建。"""
+        if HASH_INDEX_BLOOM:
+            self._hash_index = BloomFilter(self._hash_index_path, HASH_INDEX_BLOOM_CAPACITY)
+        else:
+            self._hash_index = FileHashIndex(self._hash_index_path)
+        self._hash_index_saved_at = time.monotonic()
+        total_chunks = self._collection.count()
+        if self._hash_index.load(total_chunks):
+            log.info(f"Loaded file hash index from {self._hash_index_path}.")
+            return
+        log.info(f"Rebuilding file hash index from {total_chunks} memory chunks...")
+        self._hash_index.rebuild(self._iter_file_hashes(total_chunks))
+        self.save_hash_index()
+
+    def _iter_file_hashes(self, total_chunks: int, page_size: int = 5000):
+        for offset in range(0, total_chunks, page_size):
+            results = self._collection.get(
+                include=["metadatas"], limit=page_size, offset=offset)
+            for meta in results['metadatas']:
+                if meta and "file_hash" in meta:
+                    yield meta["file_hash"]
+
+    def save_hash_index(self):
+        """将有变化的文件哈希索引写回磁盘。"""
+        # 尚未初始化时没有需要写回的内容，也不应为此触发初始化
+        if self._hash_index is None or not self._hash_index.dirty:
+            return
+        try:
+            self._hash_index.save(self._collection.count())
+            self._hash_index_saved_at = time.monotonic()
+        except Exception as e:
+            log.error(f"Failed to save file hash index: {e}")
+
+    def _maybe_save_hash_index(self):
+        if time.monotonic() - self._hash_index_saved_at >= HASH_INDEX_SAVE_INTERVAL:
+            self.save_hash_index()
+
+    def _chunk_file_hashes(self, ids: List[str]) -> List[str]:
+        """按ID查询记忆片段当前的文件哈希，用于更新或删除前同步索引。"""
+        results = self.collection.get(ids=ids, include=["metadatas"])
+        return [meta["file_hash"] for meta in results['metadatas'] if meta and "file_hash" in meta]
+
+    def add_write_listener(self, listener: Callable[[], None]):
+        """注册一个回调，在记忆库内容发生变化（写入记忆片段）后调用，用于使依赖检索结果的缓存失效。"""
+        self._write_listeners.append(listener)
+
+    def _notify_write(self):
+        for listener in self._write_listeners:
+            try:
+                listener()
+            except Exception as e:
+                log.error(f"Error in storage write listener: {e}")
+
+    def add_memory_chunks(self, chunks: List[str], metadatas: List[Dict[str, Any]], ids: List[str],
+                          batch_size: int = INGEST_EMBED_BATCH_SIZE):
+        """向数据库中批量添加记忆片段，按 batch_size 分批计算嵌入并写入。"""
         if not chunks:
             return
-        self.collection.add(
-            documents=chunks,
-            metadatas=metadatas,
-            ids=ids
-        )
+        batch_size = max(1, min(batch_size, self.client.get_max_batch_size()))
+        try:
+            for start in range(0, len(chunks), batch_size):
+                end = start + batch_size
+                with timed("ingest", "embed"):
+                    embeddings = self.embedding_function(chunks[start:end])
+                with timed("ingest", "db_write"):
+                    self.collection.add(
+                        documents=chunks[start:end],
+                        embeddings=embeddings,
+                        metadatas=metadatas[start:end],
+                        ids=ids[start:end]
+                    )
+                if self.hash_index is not None:
+                    self.hash_index.add(meta["file_hash"] for meta in metadatas[start:end]
+                                        if "file_hash" in meta)
+        finally:
+            # 即使中途失败，已写入的批次也可能改变检索结果
+            self._notify_write()
+            if self.hash_index is not None:
+                self._maybe_save_hash_index()
         log.info(f"Added {len(chunks)} memory chunks to the database.")
 
     def check_if_hash_exists(self, file_hash: str) -> bool:
-        """高效地检查具有特定文件哈希的文档是否已存在。"""
+        """高效地检查具有特定文件哈希的文档是否已存在，优先使用内存中的哈希索引。"""
+        if self.hash_index is not None:
+            found = self.hash_index.lookup(file_hash)
+            if found is not None:
+                return found
         results = self.collection.get(
             where={"file_hash": file_hash},
             limit=1
         )
         return bool(results['ids'])
 
+    def get_existing_hashes(self, file_hashes: Iterable[str]) -> Set[str]:
+        """一次查询返回给定文件哈希中已存在于数据库的部分。"""
+        unique_hashes = list(set(file_hashes))
+        existing: Set[str] = set()
+        if self.hash_index is not None:
+            unknown = []
+            for file_hash in unique_hashes:
+                found = self.hash_index.lookup(file_hash)
+                if found is None:
+                    unknown.append(file_hash)
+                elif found:
+                    existing.add(file_hash)
+            unique_hashes = unknown
+        if not unique_hashes:
+            return existing
+        results = self.collection.get(
+            where={"file_hash": {"$in": unique_hashes}},
+            include=["metadatas"]
+        )
+        return existing | {meta["file_hash"] for meta in results['metadatas'] if meta and "file_hash" in meta}
+
+    def get_source_manifests(self, source_filenames: Iterable[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        一次查询返回各来源文件当前在库中的记忆片段清单。
+
+        Returns:
+            {来源文件名: {记忆片段ID: 元数据}}，库中不存在的来源不出现在结果中。
+        """
+        unique_sources = list(set(source_filenames))
+        if not unique_sources:
+            return {}
+        results = self.collection.get(
+            where={"original_filename": {"$in": unique_sources}},
+            include=["metadatas"]
+        )
+        manifests: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for chunk_id, meta in zip(results['ids'], results['metadatas']):
+            manifests.setdefault(meta["original_filename"], {})[chunk_id] = meta
+        return manifests
+
+    def update_memory_metadatas(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        """只更新记忆片段的元数据，不重新计算嵌入。"""
+        if not ids:
+            return
+        old_hashes = self._chunk_file_hashes(ids) if self.hash_index is not None else []
+        self.collection.update(ids=ids, metadatas=metadatas)
+        if self.hash_index is not None:
+            # 保留的片段归属到新版本的文件哈希
+            self.hash_index.remove(old_hashes)
+            self.hash_index.add(meta["file_hash"] for meta in metadatas if "file_hash" in meta)
+            self._maybe_save_hash_index()
+        self._notify_write()
+        log.info(f"Updated metadata of {len(ids)} memory chunks.")
+
+    def delete_memory_chunks(self, ids: List[str]):
+        """按ID删除记忆片段。"""
+        if not ids:
+            return
+        old_hashes = self._chunk_file_hashes(ids) if self.hash_index is not None else []
+        self.collection.delete(ids=ids)
+        if self.hash_index is not None:
+            self.hash_index.remove(old_hashes)
+            self._maybe_save_hash_index()
+        self._notify_write()
+        log.info(f"Deleted {len(ids)} memory chunks from the database.")
+
     def query_memories(self, query_text: str, top_k: int, where_filter: Optional[Dict] = None) -> List[Dict[str, Any]]:
         """根据查询文本和可选的元数据过滤器，检索最相关的记忆片段。"""
-        results = self.collection.query(
-            query_texts=[query_text],
-            n_results=top_k,
-            where=where_filter  # 应用元数据过滤器
-        )
+        with timed("query", "embed"):
+            query_embeddings = self.embedding_function([query_text])
+        with timed("query", "vector_search"):
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=top_k,
+                where=where_filter  # 应用元数据过滤器
+            )
+        return self._unpack_query_results(results, 1)[0]
+
+    def query_memories_batch(self, query_texts: List[str], top_k: int,
+                             where_filters: Optional[List[Optional[Dict]]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        批量检索：所有查询的嵌入一次计算，过滤条件相同的查询合并为一次检索调用。
+
+        Args:
+            query_texts: 查询文本列表。
+            top_k: 每个查询返回的记忆片段数量。
+            where_filters: 与 query_texts 一一对应的过滤条件，未提供时均不过滤。
+
+        Returns:
+            与 query_texts 顺序一致的检索结果列表。
+        """
+        if where_filters is None:
+            where_filters = [None] * len(query_texts)
+        groups: Dict[str, List[int]] = {}
+        for i, where_filter in enumerate(where_filters):
+            groups.setdefault(json.dumps(where_filter, sort_keys=True), []).append(i)
 
-        retrieved = []
-        if results and results['documents']:
-            for i, doc in enumerate(results['documents'][0]):
-                retrieved.append({
-                    "text": doc,
-                    "metadata": results['metadatas'][0][i],
-                    "distance": results['distances'][0][i]
-                })
+        # 所有查询的嵌入在一次调用中计算
+        with timed("query", "embed"):
+            query_embeddings = self.embedding_function(list(query_texts)) if query_texts else []
+        retrieved: List[List[Dict[str, Any]]] = [[] for _ in query_texts]
+        for indices in groups.values():
+            with timed("query", "vector_search"):
+                results = self.collection.query(
+                    query_embeddings=[query_embeddings[i] for i in indices],
+                    n_results=top_k,
+                    where=where_filters[indices[0]]
+                )
+            for i, memories in zip(indices, self._unpack_query_results(results, len(indices))):
+                retrieved[i] = memories
+        log.info(f"Executed {len(query_texts)} queries in {len(groups)} batched searches.")
         return retrieved
 
+    @staticmethod
+    def _unpack_query_results(results, query_count: int) -> List[List[Dict[str, Any]]]:
+        unpacked = []
+        for q in range(query_count):
+            retrieved = []
+            if results and results['documents']:
+                for i, doc in enumerate(results['documents'][q]):
+                    retrieved.append({
+                        "id": results['ids'][q][i],
+                        "text": doc,
+                        "metadata": results['metadatas'][q][i],
+                        "distance": results['distances'][q][i]
+                    })
+            unpacked.append(retrieved)
+        return unpacked
+
+
+STORAGE_MODES = ("embedded", "client")
+
+
+def create_storage_service(mode: str = STORAGE_MODE):
+    """按配置创建存储服务：进程内的 StorageService，或连接独立存储服务进程的 StorageClient。"""
+    if mode == "client":
+        from cortex.services.storage_client import StorageClient
+        return StorageClient()
+    if mode == "embedded":
+        return StorageService()
+    raise ValueError(f"Unknown STORAGE_MODE '{mode}', expected one of {STORAGE_MODES}.")
+
 
-storage_service = StorageService()
+storage_service = create_storage_service()
@@ -0,0 +1,161 @@
+from cortex.core.config import STORAGE_SERVER_SOCKET, STORAGE_CLIENT_TIMEOUT, INGEST_EMBED_BATCH_SIZE
+from cortex.core.metrics import timed
+from cortex.logger.logger import get_logger
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Set, Iterable, Callable
+import httpx
+import threading
+import time
+
+log = get_logger(__name__)
+
+# 存储服务在每个响应中返回的写入代数，记忆库内容每次变化后改变
+WRITE_GENERATION_HEADER = "X-Cortex-Write-Generation"
+
+
+class StorageUnavailableError(RuntimeError):
+    """存储服务进程无法连接或尚未就绪。"""
+
+
+class StorageServerError(RuntimeError):
+    """存储服务执行调用时出错。"""
+
+
+class StorageClient:
+    """
+    独立存储服务进程（cortex.services.storage_server）的客户端，接口与 StorageService 一致。
+
+    数据库读写、嵌入计算和文件哈希索引都在存储服务进程中完成，本进程不打开数据库也不加载嵌入模型，
+    因此多个 API worker 和 Chainlit 进程可以共用同一份数据。任一进程写入记忆后服务端的写入代数随之变化，
+    各客户端在下一次调用时发现变化并通知本进程的写入监听器，使依赖检索结果的缓存失效。
+    """
+
+    def __init__(self, socket_path: Path = STORAGE_SERVER_SOCKET, timeout: float = STORAGE_CLIENT_TIMEOUT,
+                 http_client: Optional[httpx.Client] = None):
+        """
+        Args:
+            socket_path: 存储服务监听的 Unix socket。
+            timeout: 单次调用的超时时间（秒），也是 initialize() 等待服务就绪的最长时间。
+            http_client: 使用指定的 HTTP 客户端（如测试中直接调用服务端应用），未提供时连接 socket_path。
+        """
+        self._socket_path = socket_path
+        self._timeout = timeout
+        self._http = http_client or httpx.Client(
+            transport=httpx.HTTPTransport(uds=str(socket_path)),
+            base_url="http://cortex-storage",
+            timeout=httpx.Timeout(timeout, connect=5.0)
+        )
+        self._ready = False
+        self._write_listeners: List[Callable[[], None]] = []
+        self._generation: Optional[str] = None
+        self._generation_lock = threading.Lock()
+
+    def initialize(self):
+        """等待存储服务完成数据库和嵌入模型的加载。可重复调用，就绪后立即返回。"""
+        if self._ready:
+            return
+        deadline = time.monotonic() + self._timeout
+        while not self._check_ready():
+            if time.monotonic() >= deadline:
+                raise StorageUnavailableError(
+                    f"Storage server at {self._socket_path} is not ready after {self._timeout:.0f}s.")
+            time.sleep(0.5)
+        log.info(f"Connected to storage server at {self._socket_path}.")
+
+    def _check_ready(self) -> bool:
+        try:
+            response = self._http.get("/health/ready", timeout=5.0)
+        except httpx.TransportError:
+            return False
+        self._ready = response.status_code == 200
+        return self._ready
+
+    @property
+    def is_ready(self) -> bool:
+        # 存储服务可能晚于本进程启动或中途重启，未就绪时每次都重新检查
+        return self._ready or self._check_ready()
+
+    def warmup(self):
+        """预热存储服务进程中的嵌入模型。"""
+        self._call("warmup")
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """存储服务的嵌入缓存命中统计；服务不可用时为空。"""
+        try:
+            return self._call("cache_stats")
+        except Exception:
+            return {}
+
+    def save_hash_index(self):
+        """文件哈希索引由存储服务进程维护和写回，客户端无需操作。"""
+
+    def add_write_listener(self, listener: Callable[[], None]):
+        """注册一个回调，在记忆库内容发生变化（包括其他进程的写入）后调用。"""
+        self._write_listeners.append(listener)
+
+    def _observe_generation(self, generation: Optional[str]):
+        if generation is None:
+            return
+        with self._generation_lock:
+            changed = self._generation is not None and generation != self._generation
+            self._generation = generation
+        if changed:
+            for listener in self._write_listeners:
+                try:
+                    listener()
+                except Exception as e:
+                    log.error(f"Error in storage write listener: {e}")
+
+    def _call(self, method: str, **arguments) -> Any:
+        with timed("storage", method):
+            try:
+                response = self._http.post(f"/storage/{method}", json=arguments)
+            except httpx.TransportError as e:
+                self._ready = False
+                raise StorageUnavailableError(
+                    f"Storage server at {self._socket_path} is unavailable: {e}") from e
+        self._observe_generation(response.headers.get(WRITE_GENERATION_HEADER))
+        if response.status_code != 200:
+            try:
+                detail = response.json().get("detail")
+            except ValueError:
+                detail = response.text
+            raise StorageServerError(f"Storage call '{method}' failed: {detail}")
+        self._ready = True
+        return response.json()["result"]
+
+    def add_memory_chunks(self, chunks: List[str], metadatas: List[Dict[str, Any]], ids: List[str],
+                          batch_size: int = INGEST_EMBED_BATCH_SIZE):
+        if not chunks:
+            return
+        self._call("add_memory_chunks", chunks=chunks, metadatas=metadatas, ids=ids, batch_size=batch_size)
+
+    def check_if_hash_exists(self, file_hash: str) -> bool:
+        return self._call("check_if_hash_exists", file_hash=file_hash)
+
+    def get_existing_hashes(self, file_hashes: Iterable[str]) -> Set[str]:
+        return set(self._call("get_existing_hashes", file_hashes=list(file_hashes)))
+
+    def get_source_manifests(self, source_filenames: Iterable[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        return self._call("get_source_manifests", source_filenames=list(source_filenames))
+
+    def update_memory_metadatas(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        if not ids:
+            return
+        self._call("update_memory_metadatas", ids=ids, metadatas=metadatas)
+
+    def delete_memory_chunks(self, ids: List[str]):
+        if not ids:
+            return
+        self._call("delete_memory_chunks", ids=ids)
+
+    def query_memories(self, query_text: str, top_k: int, where_filter: Optional[Dict] = None) -> List[Dict[str, Any]]:
+        return self._call("query_memories", query_text=query_text, top_k=top_k, where_filter=where_filter)
+
+    def query_memories_batch(self, query_texts: List[str], top_k: int,
+                             where_filters: Optional[List[Optional[Dict]]] = None) -> List[List[Dict[str, Any]]]:
+        return self._call("query_memories_batch", query_texts=list(query_texts), top_k=top_k,
+                          where_filters=where_filters)
+
+    def close(self):
+        self._http.close()
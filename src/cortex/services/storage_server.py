@@ -0,0 +1,115 @@
+# storage_server.py
+import inspect
+import uvicorn
+import threading
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import Body, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from cortex.core.config import STORAGE_SERVER_SOCKET, STARTUP_BACKGROUND_INIT
+from cortex.core.metrics import metrics
+from cortex.services.storage import StorageService
+from cortex.services.storage_client import WRITE_GENERATION_HEADER
+from cortex.services.startup import StartupTask
+from cortex.logger.logger import get_logger, flush_logs
+from typing import Any, Dict
+
+log = get_logger(__name__)
+
+# 允许客户端远程调用的 StorageService 方法
+REMOTE_METHODS = frozenset({
+    "add_memory_chunks",
+    "check_if_hash_exists",
+    "get_existing_hashes",
+    "get_source_manifests",
+    "update_memory_metadatas",
+    "delete_memory_chunks",
+    "query_memories",
+    "query_memories_batch",
+    "cache_stats",
+    "warmup",
+})
+
+
+class _WriteGeneration:
+    """记忆库内容的写入代数：服务进程实例ID + 写入次数，服务重启后客户端同样视为发生了变化。"""
+
+    def __init__(self):
+        self._instance_id = uuid.uuid4().hex[:8]
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self._count += 1
+
+    def __str__(self) -> str:
+        return f"{self._instance_id}:{self._count}"
+
+
+def create_app(storage_service: StorageService, background_init: bool = STARTUP_BACKGROUND_INIT) -> FastAPI:
+    """
+    创建存储服务应用：进程内的 StorageService 独占数据库、嵌入模型和文件哈希索引，
+    通过 POST /storage/{方法名} 供 StorageClient 调用，请求体为方法的关键字参数。
+    """
+    # 存储服务进程不调用LLM，预热时只预热嵌入模型
+    startup_task = StartupTask(storage_service=storage_service, llm_warmup=lambda: None)
+    generation = _WriteGeneration()
+    storage_service.add_write_listener(generation.bump)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if background_init:
+            startup_task.start()
+        yield
+        storage_service.save_hash_index()
+        flush_logs(timeout=5)
+
+    app = FastAPI(title="Cortex storage server", lifespan=lifespan)
+
+    @app.middleware("http")
+    async def attach_write_generation(request: Request, call_next):
+        response = await call_next(request)
+        # 在调用完成后读取，调用方自己的写入也会体现在本次响应中
+        response.headers[WRITE_GENERATION_HEADER] = str(generation)
+        return response
+
+    @app.get("/health/ready")
+    def readiness():
+        status = startup_task.status()
+        return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+    @app.get("/metrics")
+    def export_metrics():
+        """存储服务进程中的嵌入计算、数据库读写耗时等指标。"""
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    @app.post("/storage/{method}")
+    def call_storage(method: str, arguments: Dict[str, Any] = Body(default_factory=dict)):
+        if method not in REMOTE_METHODS:
+            raise HTTPException(status_code=404, detail=f"Unknown storage method '{method}'.")
+        function = getattr(storage_service, method)
+        try:
+            inspect.signature(function).bind(**arguments)
+        except TypeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid arguments for '{method}': {e}")
+        try:
+            result = function(**arguments)
+        except Exception as e:
+            log.error(f"Storage call '{method}' failed: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        if isinstance(result, set):
+            result = sorted(result)
+        return {"result": result}
+
+    return app
+
+
+app = create_app(StorageService())
+
+
+if __name__ == "__main__":
+    STORAGE_SERVER_SOCKET.parent.mkdir(parents=True, exist_ok=True)
+    log.info(f"Starting storage server on {STORAGE_SERVER_SOCKET}...")
+    # 单进程：数据库只能有一个写入者，嵌入模型也只加载一份；并发调用由线程池处理
+    uvicorn.run(app, uds=str(STORAGE_SERVER_SOCKET), workers=1)
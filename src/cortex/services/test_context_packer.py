@@ -0,0 +1,75 @@
+import unittest
+
+from cortex.core.chunk import Chunk, _estimate_tokens
+
+from .context_packer import ContextPacker, strip_overlap
+
+
+def _memory(chunk_id, text, distance, file_hash=None, chunk_index=None, source="chatgpt"):
+    metadata = {"source": source}
+    if file_hash is not None:
+        metadata.update(file_hash=file_hash, chunk_index=chunk_index)
+    return {"id": chunk_id, "text": text, "metadata": metadata, "distance": distance}
+
+
+class TestContextPacker(unittest.TestCase):
+
+    def setUp(self):
+        self.packer = ContextPacker(token_budget=0)
+
+    def test_strip_overlap_of_chunker_output(self):
+        """测试：分块器产生的相邻片段合并后与原文一致，重叠部分只出现一次。"""
+        sentences = [f"第{i}句讨论向量检索的召回率问题。" for i in range(40)]
+        text = "".join(sentences)
+        chunks = Chunk(token_counter=_estimate_tokens).chunk_text(text, max_tokens=60, overlap_tokens=20)
+        self.assertGreater(len(chunks), 2)
+        merged = chunks[0]
+        for following in chunks[1:]:
+            merged += strip_overlap(merged, following)
+        self.assertEqual(merged.replace(" ", ""), text)
+        self.assertEqual(strip_overlap("alpha beta", "gamma delta"), "gamma delta")
+
+    def test_merge_adjacent_chunks_of_same_document(self):
+        """测试：同一文档中连续的片段合并为一段，位置取最相关的片段，不连续的片段保持独立。"""
+        memories = [
+            _memory("h-1", "second part. third part.", 0.1, "h", 1),
+            _memory("x-0", "unrelated memory about cooking", 0.2, "x", 0),
+            _memory("h-0", "first part. second part.", 0.3, "h", 0),
+            _memory("h-5", "far away part", 0.4, "h", 5),
+        ]
+        context, sources, chunk_ids = self.packer.pack(memories)
+        self.assertEqual(chunk_ids, ["h-0", "h-1", "x-0", "h-5"])
+        self.assertIn("first part. second part.\nthird part.", context)
+        self.assertEqual(context.count("--- 记忆片段"), 3)
+        self.assertEqual(sources, ["chatgpt"])
+
+    def test_drop_near_duplicates(self):
+        """测试：与更相关片段内容几乎相同的片段被丢弃。"""
+        text = "we discussed the chroma index rebuild and the embedding cache layout in detail"
+        memories = [
+            _memory("a", text, 0.1),
+            _memory("b", text + " again", 0.2),
+            _memory("c", "a completely different note about marathon pacing", 0.3),
+        ]
+        _, _, chunk_ids = self.packer.pack(memories)
+        self.assertEqual(chunk_ids, ["a", "c"])
+
+    def test_fit_token_budget(self):
+        """测试：超出token预算的片段被截断或丢弃，第一个片段总会放入。"""
+        long_text = " ".join(f"word{i}" for i in range(300))
+        memories = [_memory("a", long_text, 0.1), _memory("b", "short note on pacing", 0.2)]
+
+        packer = ContextPacker(token_budget=80, min_fragment_tokens=16)
+        context, _, chunk_ids = packer.pack(memories)
+        self.assertEqual(chunk_ids, ["a"])
+        self.assertLessEqual(_estimate_tokens(context), 80)
+        self.assertIn("……", context)
+
+        packer = ContextPacker(token_budget=10000)
+        _, _, chunk_ids = packer.pack(memories)
+        self.assertEqual(chunk_ids, ["a", "b"])
+        self.assertIsNone(packer.pack([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from cortex.core.models import IngestResult
+
+from .importers import ChatExportImporter, iter_json_array
+
+CHATGPT_CONVERSATION = {
+    "conversation_id": "c1",
+    "title": "工作流引擎",
+    "create_time": 1700000000.5,
+    "current_node": "n3",
+    "mapping": {
+        "n0": {"message": None, "parent": None},
+        "n1": {"message": {"author": {"role": "user"}, "content": {"parts": ["怎么实现？"]}}, "parent": "n0"},
+        "n2": {"message": {"author": {"role": "assistant"}, "content": {"parts": ["旧的回答"]}}, "parent": "n1"},
+        "n3": {"message": {"author": {"role": "assistant"}, "content": {"parts": ["用状态机。"]}}, "parent": "n1"},
+    },
+}
+
+
+class TestIterJsonArray(unittest.TestCase):
+
+    def test_elements_spanning_reads(self):
+        """测试：元素跨越多次读取时仍能完整解析。"""
+        items = [{"text": "x" * 50, "n": i} for i in range(5)] + [3, "s", None]
+        stream = io.StringIO(" [\n" + ",\n ".join(json.dumps(i) for i in items) + "\n] ")
+        self.assertEqual(list(iter_json_array(stream, read_size=7)), items)
+
+    def test_empty_and_invalid(self):
+        self.assertEqual(list(iter_json_array(io.StringIO("[ ]"))), [])
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('{"a": 1}')))
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('[{"a": 1}'), read_size=4))
+
+
+class TestChatExportImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_ingestion_service = MagicMock()
+        self.mock_ingestion_service.process_batch.side_effect = lambda docs: [
+            IngestResult(source=doc.source, status="ingested") for doc in docs]
+        self.importer = ChatExportImporter(self.mock_ingestion_service, batch_documents=2)
+
+    def _write_export(self, items) -> str:
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_chatgpt_export_in_batches(self):
+        """测试：每个对话生成一份文档（只取当前分支），元数据取自导出文件，并分批摄入。"""
+        conversations = [dict(CHATGPT_CONVERSATION, conversation_id=f"c{i}") for i in range(3)]
+        path = self._write_export(conversations)
+
+        self.assertEqual(self.importer.detect_format(path), "chatgpt")
+        counts = self.importer.import_file(path)
+
+        self.assertEqual(counts, {"ingested": 3})
+        batches = [c.args[0] for c in self.mock_ingestion_service.process_batch.call_args_list]
+        self.assertEqual([len(b) for b in batches], [2, 1])
+        doc = batches[0][0]
+        self.assertEqual(doc.source, "chatgpt/c0")
+        self.assertEqual(doc.content, "# 工作流引擎\n\nUser: 怎么实现？\n\nAssistant: 用状态机。")
+        self.assertEqual(doc.metadata["creation_ts"], 1700000000.5)
+        self.assertEqual(doc.metadata["source_type"], "llm_chat")
+
+    def test_entries_without_id_get_distinct_sources(self):
+        """测试：缺少对话ID或时间的条目按内容哈希生成来源，不会共用一个来源而在增量更新时互相覆盖。"""
+        first = {k: v for k, v in CHATGPT_CONVERSATION.items() if k not in ("conversation_id", "id")}
+        second = json.loads(json.dumps(first, ensure_ascii=False).replace("用状态机。", "用规则引擎。"))
+        path = self._write_export([first, second])
+
+        sources = [doc.source for doc in self.importer.iter_documents(path, "chatgpt")]
+
+        self.assertEqual(len(set(sources)), 2)
+        self.assertTrue(all(source.startswith("chatgpt/") and "None" not in source for source in sources))
+        self.assertEqual(sources, [doc.source for doc in self.importer.iter_documents(path, "chatgpt")])
+
+    def test_cancel_between_batches(self):
+        """测试：取消信号被设置后，在下一批开始前停止导入，并返回已处理部分的计数。"""
+        path = self._write_export([dict(CHATGPT_CONVERSATION, conversation_id=f"c{i}") for i in range(5)])
+        cancel_event = threading.Event()
+
+        counts = self.importer.import_file(path, on_progress=lambda counts: cancel_event.set(),
+                                           cancel_event=cancel_event)
+
+        self.assertEqual(counts, {"ingested": 2})
+        self.mock_ingestion_service.process_batch.assert_called_once()
+
+    def test_gemini_activity_export(self):
+        """测试：Gemini 活动记录中只有提问类条目被导入，回答中的HTML被转换为文本。"""
+        path = self._write_export([
+            {"header": "Gemini Apps", "title": "Prompted 什么是RAG",
+             "time": "2024-05-01T08:00:00.000Z", "safeHtmlItem": [{"html": "<p>检索增强&amp;生成</p>"}]},
+            {"header": "Gemini Apps", "title": "Used Gemini Apps", "time": "2024-05-01T09:00:00.000Z"},
+        ])
+
+        self.assertEqual(self.importer.detect_format(path), "gemini")
+        self.importer.import_file(path)
+
+        docs = self.mock_ingestion_service.process_batch.call_args.args[0]
+        self.assertEqual(len(docs), 1)
+        self.assertEqual(docs[0].content, "User: 什么是RAG\n\nAssistant: 检索增强&生成")
+        self.assertEqual(docs[0].metadata["creation_ts"], 1714550400)
+
+    def test_unrecognized_file(self):
+        path = self._write_export([{"foo": 1}])
+        self.assertIsNone(self.importer.detect_format(path))
+        with self.assertRaises(ValueError):
+            self.importer.import_file(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
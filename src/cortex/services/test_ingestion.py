@@ -1,7 +1,14 @@
+import json
+import os
+import tempfile
+import threading
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
-from .ingestion import IngestionService
+from cortex.core.chunk import Chunk, _estimate_tokens
+from cortex.core.models import IngestRequest
+
+from .ingestion import IngestionService, IngestionCancelledError
 
 # --- 模拟数据 ---
 SUCCESS_RESPONSE_FROM_LLM = "[JSON_START]\n{\n  \"source\": \"gemini\",\n  \"source_type\": \"llm_chat\",\n  \"tags\": [\"java\", \"workflow_engine\"]\n}\n[JSON_END]"
@@ -71,9 +78,328 @@ class TestIngestionServiceMetadataExtraction(unittest.TestCase):
         mock_generate_chat.return_value = NO_DELIMITER_RESPONSE_FROM_LLM
         result = self.ingestion_service._extract_metadata_with_llm(
             "qwen_log.txt", "A log.")
-        # expected = json.loads(NO_DELIMITER_RESPONSE_FROM_LLM)
-        self.assertDictEqual(
-            result, {"source": "qwen", "source_type": "document", "tags": []})
+        self.assertDictEqual(result, json.loads(NO_DELIMITER_RESPONSE_FROM_LLM))
+
+
+@patch('cortex.services.ingestion.chunk', Chunk(token_counter=_estimate_tokens))
+class TestIngestionServiceBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_storage_service = MagicMock()
+        self.mock_storage_service.get_source_manifests.return_value = {}
+        self.ingestion_service = IngestionService(
+            storage_service=self.mock_storage_service)
+
+    @patch.object(IngestionService, '_extract_metadata_batch')
+    def test_process_batch_dedups_and_batches_writes(self, mock_extract):
+        """测试：批量摄入在一次查询中去重，并跨文档分批写入。"""
+        mock_extract.side_effect = lambda items: [{"source": "gemini", "source_type": "llm_chat", "tags": []}] * len(items)
+        existing = self.ingestion_service._calculate_hash("already stored")
+        self.mock_storage_service.get_existing_hashes.return_value = {existing}
+        documents = [
+            IngestRequest(content="word " * 300, source="a.md"),
+            IngestRequest(content="already stored", source="b.md"),
+            IngestRequest(content="word " * 300, source="c.md"),
+            IngestRequest(content="short", source="d.md"),
+        ]
+
+        results = self.ingestion_service.process_batch(documents, batch_size=2)
+
+        self.assertEqual([r.status for r in results],
+                         ["ingested", "duplicate", "duplicate", "ingested"])
+        self.assertEqual(results[0].chunks, 2)
+        self.mock_storage_service.get_existing_hashes.assert_called_once()
+        self.assertEqual(len(mock_extract.call_args.args[0]), 2)
+        written = [len(c.kwargs["chunks"])
+                   for c in self.mock_storage_service.add_memory_chunks.call_args_list]
+        self.assertEqual(written, [2, 1])
+
+    @patch.object(IngestionService, '_extract_metadata_with_llm')
+    def test_process_batch_uses_provided_metadata(self, mock_extract):
+        """测试：请求自带元数据（如导入的对话记录）时不调用LLM，并使用其中的创建时间和标题。"""
+        self.mock_storage_service.get_existing_hashes.return_value = set()
+        metadata = {"source": "chatgpt", "source_type": "llm_chat", "tags": [],
+                    "creation_ts": 1700000000.5, "title": "工作流引擎"}
+
+        self.ingestion_service.process_batch(
+            [IngestRequest(content="hello", source="chatgpt/c1", metadata=metadata)])
+
+        mock_extract.assert_not_called()
+        written = self.mock_storage_service.add_memory_chunks.call_args.kwargs["metadatas"][0]
+        self.assertEqual((written["creation_ts"], written["title"]), (1700000000, "工作流引擎"))
+
+    @patch.object(IngestionService, '_extract_metadata_with_llm')
+    def test_process_uses_provided_metadata(self, mock_extract):
+        """测试：单文档摄入同样使用请求自带的元数据，不调用LLM。"""
+        self.mock_storage_service.check_if_hash_exists.return_value = False
+        metadata = {"source": "chatgpt", "source_type": "llm_chat", "tags": ["rust"], "title": "生命周期"}
+
+        self.ingestion_service.process("hello", "chatgpt/c1", metadata=metadata)
+
+        mock_extract.assert_not_called()
+        written = self.mock_storage_service.add_memory_chunks.call_args.kwargs["metadatas"][0]
+        self.assertEqual((written["source"], written["tags"], written["title"]), ("chatgpt", "rust", "生命周期"))
+
+    @patch.object(IngestionService, '_extract_metadata_with_llm')
+    def test_process_batch_reports_failed_writes(self, mock_extract):
+        """测试：写入失败时，对应文档标记为失败。"""
+        mock_extract.return_value = {}
+        self.mock_storage_service.get_existing_hashes.return_value = set()
+        self.mock_storage_service.add_memory_chunks.side_effect = Exception("db locked")
+
+        results = self.ingestion_service.process_batch(
+            [IngestRequest(content="hello", source="a.md")])
+
+        self.assertEqual(results[0].status, "failed")
+        self.assertEqual(results[0].error, "db locked")
+
+
+class TestBatchedMetadataExtraction(unittest.TestCase):
+
+    def setUp(self):
+        self.ingestion_service = IngestionService(storage_service=MagicMock())
+        for target, kwargs in [
+            ('get_formatted_prompt', {"side_effect": lambda template_name, substitutions: json.dumps(substitutions)}),
+            ('template_exists', {"return_value": True}),
+        ]:
+            patcher = patch(f'cortex.services.ingestion.{target}', **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch('cortex.services.ingestion.generate_chat_completion')
+    def test_one_call_per_batch_with_per_item_fallback(self, mock_generate_chat):
+        """测试：多个文档的元数据在一次LLM调用中提取，文件名模式相同的只提取一次，无效条目回退到文件名规则。"""
+        mock_generate_chat.return_value = (
+            '[JSON_START][{"index": 0, "source": "gemini", "source_type": "llm_chat", "tags": ["java"]},'
+            ' {"index": 1, "tags": []}][JSON_END]')
+        items = [("Gemini_2024-01-05.md", None), ("Notes_b.md", "my notes"), ("gemini_2024-02-11.md", None)]
+
+        results = self.ingestion_service._extract_metadata_batch(items)
+
+        mock_generate_chat.assert_called_once()
+        documents = json.loads(json.loads(mock_generate_chat.call_args.args[0])["documents"])
+        self.assertEqual([d["filename"] for d in documents], ["Gemini_2024-01-05.md", "Notes_b.md"])
+        self.assertEqual(results[0]["tags"], ["java"])
+        self.assertEqual(results[2], results[0])
+        self.assertEqual(results[1], {"source": "notes", "source_type": "document", "tags": []})
+
+    @patch('cortex.services.ingestion.generate_chat_completion')
+    def test_bare_array_response_without_delimiters(self, mock_generate_chat):
+        """测试：批量响应缺少分隔符时直接解析JSON数组，并按 index 对应到各文档。"""
+        mock_generate_chat.return_value = (
+            '[{"index": 1, "source": "claude", "tags": ["rust"]}, {"index": 0, "source": "gemini", "tags": []}]')
+
+        results = self.ingestion_service._extract_metadata_batch([("a.md", None), ("b.md", None)])
+
+        mock_generate_chat.assert_called_once()
+        self.assertEqual(results, [{"source": "gemini", "tags": []}, {"source": "claude", "tags": ["rust"]}])
+
+    @patch('cortex.services.ingestion.generate_chat_completion')
+    def test_cache_by_filename_pattern(self, mock_generate_chat):
+        """测试：相同命名模式和描述的文件命中缓存，不再调用LLM，且不共享取自文件名的标题。"""
+        mock_generate_chat.return_value = \
+            '[JSON_START]{"source": "chatgpt", "tags": [], "title": "export 3"}[JSON_END]'
+        self.ingestion_service._extract_metadata_with_llm("chatgpt_export_3.json", "weekly export")
+
+        results = self.ingestion_service._extract_metadata_batch(
+            [("chatgpt_export_4.json", "weekly export"), ("chatgpt_export_5.json", "weekly export")])
+
+        mock_generate_chat.assert_called_once()
+        self.assertEqual(results, [{"source": "chatgpt", "tags": []}] * 2)
+        self.assertEqual(self.ingestion_service.cache_stats()["metadata_extraction"]["hits"], 1)
+
+    @patch('cortex.services.ingestion.chunk', Chunk(token_counter=_estimate_tokens))
+    @patch('cortex.services.ingestion.generate_chat_completion')
+    def test_default_prompt_without_batch_template(self, mock_generate_chat):
+        """测试：批量模板不存在时使用内置提示词，批量摄入的元数据仍在一次LLM调用中提取。"""
+        def reply(prompt, **kwargs):
+            documents, _ = json.JSONDecoder().raw_decode(prompt[prompt.index("[\n"):])
+            entries = [{"index": d["index"], "source": d["filename"].split(".")[0], "tags": []} for d in documents]
+            return f"[JSON_START]{json.dumps(entries)}[JSON_END]"
+        mock_generate_chat.side_effect = reply
+        storage_service = self.ingestion_service.storage_service
+        storage_service.get_source_manifests.return_value = {}
+        storage_service.get_existing_hashes.return_value = set()
+
+        with patch('cortex.services.ingestion.template_exists', return_value=False), \
+                patch('cortex.services.ingestion.get_formatted_prompt') as mock_get_formatted_prompt:
+            self.ingestion_service.process_batch(
+                [IngestRequest(content="hello", source="alpha.md"), IngestRequest(content="world", source="beta.md")])
+
+        mock_get_formatted_prompt.assert_not_called()
+        mock_generate_chat.assert_called_once()
+        self.assertIn('"index"', mock_generate_chat.call_args.args[0])
+        written = storage_service.add_memory_chunks.call_args.kwargs["metadatas"]
+        self.assertEqual([m["source"] for m in written], ["alpha", "beta"])
+
+
+class TestIncrementalReingestion(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_storage_service = MagicMock()
+        self.mock_storage_service.check_if_hash_exists.return_value = False
+        self.ingestion_service = IngestionService(
+            storage_service=self.mock_storage_service)
+
+    def test_chunk_ids_are_deterministic(self):
+        """测试：相同来源、相同内容的片段得到相同ID，重复片段按出现次序区分。"""
+        ids = self.ingestion_service._chunk_ids(["x", "y", "x"], "notes.md")
+        self.assertEqual(ids, self.ingestion_service._chunk_ids(["x", "y", "x"], "notes.md"))
+        self.assertEqual(len(set(ids)), 3)
+        self.assertNotEqual(ids, self.ingestion_service._chunk_ids(["x", "y", "x"], "other.md"))
+
+    @patch('cortex.services.ingestion.chunk')
+    @patch.object(IngestionService, '_extract_metadata_with_llm')
+    def test_reingest_only_embeds_changed_chunks(self, mock_extract, mock_chunk):
+        """测试：修改后的文档重新摄入时，只新增变化的片段、删除移除的片段，且复用已有元数据。"""
+        old_ids = self.ingestion_service._chunk_ids(["intro", "old part"], "notes.md")
+        self.mock_storage_service.get_source_manifests.return_value = {"notes.md": {
+            old_ids[0]: {"source": "notes", "source_type": "document", "tags": "java",
+                         "creation_ts": 1, "chunk_index": 0, "original_filename": "notes.md"},
+            old_ids[1]: {"source": "notes", "source_type": "document", "tags": "java",
+                         "creation_ts": 1, "chunk_index": 1, "original_filename": "notes.md"},
+        }}
+        mock_chunk.iter_chunks.return_value = iter(["intro", "new part"])
+
+        result = self.ingestion_service.process("intro new part", "notes.md")
+
+        mock_extract.assert_not_called()
+        self.assertEqual(result.status, "updated")
+        self.assertEqual((result.chunks, result.reused_chunks, result.deleted_chunks), (1, 1, 1))
+        added = self.mock_storage_service.add_memory_chunks.call_args.kwargs
+        self.assertEqual(added["chunks"], ["new part"])
+        self.assertEqual(added["metadatas"][0]["tags"], "java")
+        updated_ids, updated_metas = self.mock_storage_service.update_memory_metadatas.call_args.args
+        self.assertEqual(updated_ids, [old_ids[0]])
+        self.assertEqual(updated_metas[0]["creation_ts"], 1)
+        self.mock_storage_service.delete_memory_chunks.assert_called_once_with([old_ids[1]])
+
+
+@patch('cortex.services.ingestion.INGEST_EMBED_BATCH_SIZE', 1)
+class TestAsyncIngestion(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.mock_storage_service = MagicMock()
+        self.mock_storage_service.check_if_hash_exists.return_value = False
+        self.mock_storage_service.get_source_manifests.return_value = {}
+        self.ingestion_service = IngestionService(
+            storage_service=self.mock_storage_service)
+
+    @patch('cortex.services.ingestion.chunk')
+    @patch.object(IngestionService, '_aextract_metadata_with_llm', new_callable=AsyncMock)
+    async def test_aprocess_ingests_with_async_llm(self, mock_extract, mock_chunk):
+        """测试：异步摄入使用异步的元数据提取，结果与同步摄入一致。"""
+        mock_extract.return_value = {"source": "notes", "source_type": "document", "tags": []}
+        mock_chunk.iter_chunks.return_value = iter(["one", "two"])
+
+        result = await self.ingestion_service.aprocess("one two", "notes.md")
+
+        self.assertEqual((result.status, result.chunks), ("ingested", 2))
+        mock_extract.assert_awaited_once_with("notes.md", None)
+        self.assertEqual(self.mock_storage_service.add_memory_chunks.call_count, 2)
+
+    @patch('cortex.services.ingestion.chunk')
+    @patch.object(IngestionService, '_aextract_metadata_with_llm', new_callable=AsyncMock)
+    async def test_cancel_rolls_back_written_chunks(self, mock_extract, mock_chunk):
+        """测试：取消后写入线程在下一批之前停止，并删除本次已写入的片段。"""
+        mock_extract.return_value = {"source": "notes", "source_type": "document", "tags": []}
+        mock_chunk.iter_chunks.return_value = iter(["one", "two", "three"])
+        cancel_event = threading.Event()
+        self.mock_storage_service.add_memory_chunks.side_effect = lambda **kwargs: cancel_event.set()
+
+        with self.assertRaises(IngestionCancelledError):
+            await self.ingestion_service.aprocess("one two three", "notes.md", cancel_event=cancel_event)
+
+        written_ids = self.mock_storage_service.add_memory_chunks.call_args.kwargs["ids"]
+        self.mock_storage_service.add_memory_chunks.assert_called_once()
+        self.mock_storage_service.delete_memory_chunks.assert_called_once_with(written_ids)
+
+@patch('cortex.services.ingestion.chunk')
+@patch.object(IngestionService, '_aextract_metadata_batch', new_callable=AsyncMock)
+class TestUploadPipeline(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.mock_storage_service = MagicMock()
+        self.mock_storage_service.check_if_hash_exists.return_value = False
+        self.mock_storage_service.get_source_manifests.return_value = {}
+        self.ingestion_service = IngestionService(
+            storage_service=self.mock_storage_service)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _file(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path, name, None
+
+    def _prepare_mocks(self, mock_extract, mock_chunk):
+        mock_extract.side_effect = lambda items: [{"source": "notes", "source_type": "document", "tags": []}] * len(items)
+        # 以 "|" 分隔的内容切分为多个片段
+        mock_chunk.iter_chunks.side_effect = lambda f: iter(f.read().split("|"))
+
+    async def test_files_are_batched_across_files(self, mock_extract, mock_chunk):
+        """测试：多个文件的片段合并为一次写入，内容重复的文件只摄入一次，并逐文件报告进度。"""
+        self._prepare_mocks(mock_extract, mock_chunk)
+        files = [self._file("a.md", "a1|a2"), self._file("b.md", "b1"), self._file("c.md", "a1|a2")]
+        events = []
+
+        async def on_progress(index, stage, result):
+            events.append((index, stage))
+
+        results = await self.ingestion_service.aprocess_files(files, on_progress=on_progress)
+
+        self.assertEqual([r.status for r in results], ["ingested", "ingested", "duplicate"])
+        self.mock_storage_service.add_memory_chunks.assert_called_once()
+        self.assertCountEqual(self.mock_storage_service.add_memory_chunks.call_args.kwargs["chunks"],
+                              ["a1", "a2", "b1"])
+        mock_extract.assert_awaited_once()
+        self.assertEqual([filename for filename, _ in mock_extract.call_args.args[0]], ["a.md", "b.md"])
+        for index in range(3):
+            self.assertEqual([stage for i, stage in events if i == index][-1], "done")
+
+    async def test_large_file_is_chunked_incrementally(self, mock_extract, mock_chunk):
+        """测试：文件按批惰性分块并写入，片段位置跨批次连续，不会先生成整个文件的片段列表。"""
+        self._prepare_mocks(mock_extract, mock_chunk)
+        consumed = []
+
+        def iter_chunks(f):
+            for text in f.read().split("|"):
+                consumed.append(text)
+                yield text
+
+        mock_chunk.iter_chunks.side_effect = iter_chunks
+        add_calls = self.mock_storage_service.add_memory_chunks
+        consumed_at_write = []
+        add_calls.side_effect = lambda **kwargs: consumed_at_write.append(len(consumed))
+
+        results = await self.ingestion_service.aprocess_files(
+            [self._file("big.md", "|".join(f"c{i}" for i in range(10)))], batch_size=2)
+
+        self.assertEqual((results[0].status, results[0].chunks), ("ingested", 10))
+        self.assertEqual(add_calls.call_count, 5)
+        indexes = [meta["chunk_index"] for c in add_calls.call_args_list for meta in c.kwargs["metadatas"]]
+        self.assertEqual(indexes, list(range(10)))
+        self.assertLess(consumed_at_write[0], 10)
+
+    async def test_failed_write_rolls_back_file(self, mock_extract, mock_chunk):
+        """测试：某个文件的批次写入失败时，该文件已写入的片段被回滚，其他文件不受影响。"""
+        self._prepare_mocks(mock_extract, mock_chunk)
+        files = [self._file("a.md", "a1"), self._file("b.md", "b1|b2")]
+
+        def add_memory_chunks(chunks, metadatas, ids, batch_size):
+            if chunks == ["b2"]:
+                raise RuntimeError("disk full")
+
+        self.mock_storage_service.add_memory_chunks.side_effect = add_memory_chunks
+
+        results = await self.ingestion_service.aprocess_files(files, batch_size=1)
+
+        self.assertEqual([r.status for r in results], ["ingested", "failed"])
+        self.assertIn("disk full", results[1].error)
+        b1_id = self.ingestion_service._chunk_ids(["b1"], "b.md")[0]
+        self.mock_storage_service.delete_memory_chunks.assert_any_call([b1_id])
+
 
 
 if __name__ == '__main__':
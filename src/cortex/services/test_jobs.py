@@ -0,0 +1,153 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from cortex.core.model_chat import LLMUnavailableError
+from cortex.core.models import IngestResult
+
+from .jobs import IngestionJobQueue, QueueFullError
+
+
+def _wait_for(job_queue, job_id, statuses=("succeeded", "failed"), timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = job_queue.get_job(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish in time.")
+
+
+class TestIngestionJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "jobs.sqlite3"
+        self.mock_ingestion_service = MagicMock()
+        self.mock_ingestion_service.process.return_value = IngestResult(
+            source="notes.md", status="ingested", chunks=3, file_hash="abc")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _make_queue(self, **kwargs):
+        job_queue = IngestionJobQueue(
+            ingestion_service=self.mock_ingestion_service,
+            db_path=self.db_path, retry_backoff=0, **kwargs)
+        self.addCleanup(job_queue.stop)
+        return job_queue
+
+    def test_job_runs_in_background(self):
+        """测试：任务提交后由工作线程完成，并记录结果。"""
+        job_queue = self._make_queue(workers=1)
+        job_queue.start()
+        job_id = job_queue.submit("some content", "notes.md", "desc")
+
+        job = _wait_for(job_queue, job_id)
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["result"]["chunks"], 3)
+        self.assertEqual(job["attempts"], 1)
+        kwargs = self.mock_ingestion_service.process.call_args.kwargs
+        self.assertEqual(kwargs["content"], "some content")
+        self.assertTrue(kwargs["raise_on_llm_error"])
+
+    def test_job_keeps_provided_metadata(self):
+        """测试：提交时附带的元数据随任务持久化，并传给摄入服务。"""
+        metadata = {"source": "chatgpt", "source_type": "llm_chat", "tags": ["rust"]}
+        job_queue = self._make_queue(workers=1)
+        job_queue.start()
+        job_id = job_queue.submit("some content", "notes.md", metadata=metadata)
+
+        _wait_for(job_queue, job_id)
+
+        self.assertEqual(self.mock_ingestion_service.process.call_args.kwargs["metadata"], metadata)
+
+    def test_retry_on_transient_llm_error(self):
+        """测试：LLM暂时不可用时重试，最后一次尝试回退到基础元数据。"""
+        self.mock_ingestion_service.process.side_effect = [
+            LLMUnavailableError("timeout"),
+            LLMUnavailableError("timeout"),
+            IngestResult(source="notes.md", status="ingested", chunks=1),
+        ]
+        job_queue = self._make_queue(workers=1, max_retries=2)
+        job_queue.start()
+        job_id = job_queue.submit("some content", "notes.md")
+
+        job = _wait_for(job_queue, job_id)
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["attempts"], 3)
+        last_kwargs = self.mock_ingestion_service.process.call_args.kwargs
+        self.assertFalse(last_kwargs["raise_on_llm_error"])
+
+    def test_non_transient_error_fails_job(self):
+        """测试：非LLM错误直接标记任务失败。"""
+        self.mock_ingestion_service.process.side_effect = RuntimeError("disk full")
+        job_queue = self._make_queue(workers=1)
+        job_queue.start()
+        job_id = job_queue.submit("some content", "notes.md")
+
+        job = _wait_for(job_queue, job_id)
+
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "disk full")
+
+    def test_queue_is_bounded_and_persistent(self):
+        """测试：队列满时拒绝提交；未处理的任务在重启后恢复。"""
+        job_queue = self._make_queue(max_size=1)
+        job_id = job_queue.submit("some content", "notes.md")
+        with self.assertRaises(QueueFullError):
+            job_queue.submit("other content", "other.md")
+
+        restarted = self._make_queue(workers=1)
+        restarted.start()
+        job = _wait_for(restarted, job_id)
+        self.assertEqual(job["status"], "succeeded")
+
+    def test_job_is_claimed_by_one_process(self):
+        """测试：多个进程共用任务文件时，同一任务只会被执行一次。"""
+        first, second = self._make_queue(), self._make_queue()
+        job_id = first.submit("some content", "notes.md")
+
+        first._run_job(job_id)
+        second._run_job(job_id)
+
+        self.mock_ingestion_service.process.assert_called_once()
+        self.assertEqual(second.get_job(job_id)["attempts"], 1)
+
+    def test_start_leaves_jobs_of_live_workers_alone(self):
+        """测试：另一个进程启动时，不会重新入队租约未过期（执行者仍在运行）的任务。"""
+        first = self._make_queue()
+        job_id = first.submit("some content", "notes.md")
+        self.assertTrue(first._claim(job_id, 1))
+
+        second = self._make_queue(workers=1)
+        second.start()
+        time.sleep(0.2)
+
+        self.assertEqual(second.get_job(job_id)["status"], "running")
+        self.mock_ingestion_service.process.assert_not_called()
+
+    def test_start_recovers_jobs_with_expired_lease(self):
+        """测试：执行者退出后租约过期的任务，由其他进程重新入队并完成。"""
+        crashed = self._make_queue(lease_seconds=0)
+        job_id = crashed.submit("some content", "notes.md")
+        self.assertTrue(crashed._claim(job_id, 1))
+
+        second = self._make_queue(workers=1)
+        second.start()
+        job = _wait_for(second, job_id)
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["attempts"], 2)
+
+    def test_unknown_job(self):
+        job_queue = self._make_queue()
+        self.assertIsNone(job_queue.get_job("missing"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+from datetime import datetime
+from unittest.mock import ANY, patch, MagicMock
+
+from .query_parser import QueryParser
+from .retrieval import RetrievalService
+
+# 2024-05-15 (周三) 10:00 本地时间
+NOW = int(datetime(2024, 5, 15, 10, 0).timestamp())
+
+
+def _ts(*args) -> int:
+    return int(datetime(*args).timestamp())
+
+
+class TestQueryParser(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = QueryParser(known_sources=["chatgpt", "gemini"])
+
+    def test_plain_keyword_query(self):
+        self.assertEqual(self.parser.parse("java 工作流引擎", NOW),
+                         ({"core_query": "java 工作流引擎", "filters": []}, 1.0))
+
+    def test_relative_week_and_source(self):
+        """测试：“上周”解析为上周一到本周一的时间范围，已知来源解析为过滤条件。"""
+        for query in ["上周在gemini里关于工作流引擎的讨论", "workflow engine in Gemini last week"]:
+            structured, confidence = self.parser.parse(query, NOW)
+            self.assertEqual(confidence, 1.0)
+            self.assertEqual(structured["filters"], [
+                {"field": "creation_ts", "operator": "gte", "value": _ts(2024, 5, 6)},
+                {"field": "creation_ts", "operator": "lt", "value": _ts(2024, 5, 13)},
+                {"field": "source", "operator": "eq", "value": "gemini"},
+            ])
+        self.assertEqual(self.parser.parse("上周在gemini里关于工作流引擎的讨论", NOW)[0]["core_query"],
+                         "工作流引擎的讨论")
+
+    def test_source_with_cue(self):
+        """测试：来源名称出现在“来自”“和…聊”“in my … chats”等上下文中时解析为过滤条件。"""
+        for query, core_query in [("和chatgpt聊的rust生命周期", "rust生命周期"),
+                                  ("rust lifetimes from my chatgpt chats", "rust lifetimes"),
+                                  ("what did I ask about rust lifetimes in my ChatGPT conversations",
+                                   "what did I ask about rust lifetimes")]:
+            structured, confidence = self.parser.parse(query, NOW)
+            self.assertEqual(confidence, 1.0, query)
+            self.assertEqual(structured, {
+                "core_query": core_query,
+                "filters": [{"field": "source", "operator": "eq", "value": "chatgpt"}]})
+
+    def test_source_as_topic_is_not_a_filter(self):
+        """测试：没有来源上下文时，来源名称保留在检索词中且置信度低，由LLM判断。"""
+        parser = QueryParser(known_sources=["chatgpt", "qwen", "copilot"])
+        for query, term in [("how do I fine-tune qwen for classification", "qwen"),
+                            ("what did chatgpt say about rust lifetimes", "chatgpt"),
+                            ("how to use the copilot API", "copilot")]:
+            structured, confidence = parser.parse(query, NOW)
+            self.assertEqual(structured["filters"], [], query)
+            self.assertIn(term, structured["core_query"])
+            self.assertLess(confidence, 0.8, query)
+
+    def test_recent_days_and_tags(self):
+        structured, confidence = self.parser.parse("最近3天 #java 的笔记", NOW)
+        self.assertEqual(confidence, 1.0)
+        self.assertEqual(structured, {
+            "core_query": "java 的笔记",
+            "filters": [{"field": "creation_ts", "operator": "gte", "value": _ts(2024, 5, 13)}]})
+
+    def test_low_confidence_for_unhandled_expressions(self):
+        """测试：规则无法完整理解的表述（具体日期、模糊时间、多个来源）置信度低。"""
+        for query in ["2023年3月的对话", "what did I ask two months ago", "最近的笔记",
+                      "chatgpt 和 gemini 的对比", "上周", "去年和今年"]:
+            self.assertLess(self.parser.parse(query, NOW)[1], 0.8, query)
+
+
+@patch('cortex.services.retrieval.SPECULATIVE_RETRIEVAL_ENABLED', False)
+@patch('cortex.services.retrieval.generate_chat_completion')
+class TestRuleBasedFastPath(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_storage_service = MagicMock()
+        self.mock_storage_service.query_memories.return_value = []
+        self.retrieval_service = RetrievalService(storage_service=self.mock_storage_service)
+
+    def test_confident_parse_skips_llm(self, mock_generate_chat):
+        self.retrieval_service.retrieve_and_prepare_context("在gemini里的工作流引擎")
+        mock_generate_chat.assert_not_called()
+        self.mock_storage_service.query_memories.assert_called_once_with(
+            query_text="工作流引擎", top_k=ANY,
+            where_filter={"source": "gemini"})
+
+    @patch('cortex.services.retrieval.get_formatted_prompt', MagicMock(return_value="A prompt"))
+    def test_low_confidence_falls_back_to_llm(self, mock_generate_chat):
+        mock_generate_chat.return_value = '{"core_query": "对话", "filters": []}'
+        self.retrieval_service.retrieve_and_prepare_context("2023年3月的对话")
+        mock_generate_chat.assert_called_once()
+        self.assertEqual(
+            self.mock_storage_service.query_memories.call_args.kwargs["query_text"], "对话")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+import asyncio
+import unittest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from cortex.core.model_chat import LLM_ERROR_MESSAGE
+
+from .retrieval import RetrievalService
+
+TIME_FILTER_RESPONSE_FROM_LLM = (
+    '{"core_query": "workflow engine", "filters": ['
+    '{"field": "creation_ts", "operator": "gte", "value": 1000},'
+    '{"field": "source", "operator": "eq", "value": "gemini"}]}'
+)
+
+
+@patch('cortex.services.retrieval.get_formatted_prompt', MagicMock(return_value="A prompt"))
+class TestQueryDecompositionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.retrieval_service = RetrievalService(storage_service=MagicMock())
+
+    @patch('cortex.services.retrieval.time')
+    @patch('cortex.services.retrieval.generate_chat_completion')
+    def test_cache_hit_skips_llm_and_reanchors_time(self, mock_generate_chat, mock_time):
+        """测试：归一化后相同的查询命中缓存，相对时间过滤条件按当前时间平移。"""
+        mock_generate_chat.return_value = TIME_FILTER_RESPONSE_FROM_LLM
+        mock_time.time.return_value = 5000
+        first = self.retrieval_service._understand_query_with_llm("Workflow engine last week?")
+
+        mock_time.time.return_value = 5060
+        second = self.retrieval_service._understand_query_with_llm("  workflow   ENGINE last week ")
+
+        mock_generate_chat.assert_called_once()
+        self.assertEqual(first["filters"][0]["value"], 1000)
+        self.assertEqual(second["filters"][0]["value"], 1060)
+        self.assertEqual(second["filters"][1]["value"], "gemini")
+        self.assertEqual(self.retrieval_service.query_cache.stats()["hits"], 1)
+
+    @patch('cortex.services.retrieval.generate_chat_completion')
+    def test_fallback_result_is_not_cached(self, mock_generate_chat):
+        """测试：LLM返回无法解析的内容时回退，且不缓存回退结果。"""
+        mock_generate_chat.return_value = "无法连接到语言模型进行摘要合成。"
+        result = self.retrieval_service._understand_query_with_llm("java")
+        self.assertEqual(result, {"core_query": "java", "filters": []})
+
+        self.retrieval_service._understand_query_with_llm("java")
+        self.assertEqual(mock_generate_chat.call_count, 2)
+
+
+@patch('cortex.services.retrieval.get_template_version', MagicMock(return_value="v1"))
+@patch('cortex.services.retrieval.get_synthesis_prompt', MagicMock(return_value="A prompt"))
+class TestSynthesisCache(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_storage_service = MagicMock()
+        self.retrieval_service = RetrievalService(
+            storage_service=self.mock_storage_service)
+
+    @patch('cortex.services.retrieval.generate_chat_completion')
+    def test_same_chunks_hit_cache(self, mock_generate_chat):
+        """测试：相同的记忆片段序列直接返回缓存的合成结果。"""
+        mock_generate_chat.return_value = "summary"
+        first = self.retrieval_service.synthesize_context("ctx", ["a", "b"])
+        second = self.retrieval_service.synthesize_context("ctx", ["a", "b"])
+        self.retrieval_service.synthesize_context("ctx", ["b", "a"])
+
+        self.assertEqual(first, "summary")
+        self.assertEqual(second, "summary")
+        self.assertEqual(mock_generate_chat.call_count, 2)
+
+    @patch('cortex.services.retrieval.generate_chat_completion')
+    def test_new_chunks_miss_without_clearing_cache(self, mock_generate_chat):
+        """测试：写入新记忆后检索到的片段变化即为新的缓存键，其他查询的缓存结果不受写入影响。"""
+        mock_generate_chat.return_value = "summary"
+        self.retrieval_service.synthesize_context("ctx", ["a"])
+        self.retrieval_service.synthesize_context("ctx", ["new", "a"])
+        self.retrieval_service.synthesize_context("ctx", ["a"])
+
+        self.mock_storage_service.add_write_listener.assert_not_called()
+        self.assertEqual(mock_generate_chat.call_count, 2)
+
+    @patch('cortex.services.retrieval.generate_chat_completion_stream')
+    def test_stream_error_is_not_cached(self, mock_stream):
+        """测试：LLM不可用时返回的错误信息不会被缓存。"""
+        mock_stream.return_value = iter([LLM_ERROR_MESSAGE])
+        list(self.retrieval_service.synthesize_context_stream("ctx", ["a"]))
+        self.assertEqual(len(self.retrieval_service.synthesis_cache), 0)
+
+
+
+def _memory(chunk_id, source, distance):
+    return {"id": chunk_id, "text": chunk_id, "metadata": {"source": source}, "distance": distance}
+
+
+@patch('cortex.services.retrieval.RETRIEVAL_TOP_K', 2)
+@patch('cortex.services.retrieval.get_formatted_prompt', MagicMock(return_value="A prompt"))
+@patch('cortex.services.retrieval.generate_chat_completion')
+class TestSpeculativeRetrieval(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_storage_service = MagicMock()
+        self.mock_storage_service.query_memories.return_value = [
+            _memory("a", "gemini", 0.1), _memory("b", "chatgpt", 0.2),
+            _memory("c", "gemini", 0.3), _memory("d", "chatgpt", 0.4)]
+        self.retrieval_service = RetrievalService(storage_service=self.mock_storage_service)
+        self.query = "2023年3月的对话"  # 规则解析置信度不足，需要LLM拆解
+
+    def test_reuse_when_no_filters(self, mock_generate_chat):
+        """测试：拆解结果没有过滤条件且检索词未改写时，直接复用推测性检索的结果。"""
+        mock_generate_chat.return_value = '{"core_query": "2023年3月的对话", "filters": []}'
+        _, _, chunk_ids = self.retrieval_service.retrieve_and_prepare_context(self.query)
+        self.assertEqual(chunk_ids, ["a", "b"])
+        self.mock_storage_service.query_memories.assert_called_once_with(
+            query_text=self.query, top_k=6, where_filter=None)
+
+    def test_filter_in_memory(self, mock_generate_chat):
+        """测试：有过滤条件且推测结果中满足条件的片段足够时，在内存中筛选，不再检索。"""
+        mock_generate_chat.return_value = (
+            '{"core_query": "2023年3月的对话", "filters": [{"field": "source", "operator": "eq", "value": "gemini"}]}')
+        _, _, chunk_ids = self.retrieval_service.retrieve_and_prepare_context(self.query)
+        self.assertEqual(chunk_ids, ["a", "c"])
+        self.mock_storage_service.query_memories.assert_called_once()
+
+    def test_top_up_with_filtered_search(self, mock_generate_chat):
+        """测试：满足条件的片段不足时，执行一次带过滤条件的检索补足。"""
+        mock_generate_chat.return_value = (
+            '{"core_query": "2023年3月的对话", "filters": [{"field": "source", "operator": "eq", "value": "qwen"}]}')
+        speculative = self.mock_storage_service.query_memories.return_value
+        self.mock_storage_service.query_memories.side_effect = [
+            speculative, [_memory("q", "qwen", 0.5)]]
+        _, sources, chunk_ids = self.retrieval_service.retrieve_and_prepare_context(self.query)
+        self.assertEqual(chunk_ids, ["q"])
+        self.assertEqual(self.mock_storage_service.query_memories.call_args.kwargs["where_filter"],
+                         {"source": "qwen"})
+
+    def test_discard_when_query_rewritten(self, mock_generate_chat):
+        """测试：检索词被改写时，推测结果的距离不可比较，丢弃并用改写后的查询重新检索。"""
+        mock_generate_chat.return_value = '{"core_query": "对话", "filters": []}'
+        speculative = self.mock_storage_service.query_memories.return_value
+        self.mock_storage_service.query_memories.side_effect = [
+            speculative, [_memory("x", "gemini", 0.5)]]
+        _, _, chunk_ids = self.retrieval_service.retrieve_and_prepare_context(self.query)
+        self.assertEqual(chunk_ids, ["x"])
+        self.mock_storage_service.query_memories.assert_called_with(
+            query_text="对话", top_k=2, where_filter=None)
+
+
+@patch('cortex.services.retrieval.get_synthesis_prompt', MagicMock(return_value="A prompt"))
+@patch('cortex.services.retrieval.get_template_version', MagicMock(return_value="v1"))
+@patch('cortex.services.retrieval.generate_chat_completion')
+class TestBatchQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_storage_service = MagicMock()
+        self.mock_storage_service.query_memories_batch.return_value = [
+            [_memory("a", "gemini", 0.1)], []]
+        self.retrieval_service = RetrievalService(storage_service=self.mock_storage_service)
+
+    def test_batch_search_and_synthesis(self, mock_generate_chat):
+        """测试：批量查询一次调用批量检索，并为有结果的查询合成摘要。"""
+        mock_generate_chat.return_value = "summary"
+        responses = self.retrieval_service.query_and_synthesize_batch(["来自gemini的工作流", "java"])
+
+        self.mock_storage_service.query_memories_batch.assert_called_once()
+        core_queries, _, where_filters = self.mock_storage_service.query_memories_batch.call_args.args
+        self.assertEqual(core_queries, ["工作流", "java"])
+        self.assertEqual(where_filters, [{"source": "gemini"}, None])
+        self.assertEqual([r.context for r in responses], ["summary", "未找到与您查询相关的记忆。"])
+        self.assertEqual(responses[0].retrieved_sources, ["gemini"])
+
+    def test_batch_does_not_use_speculative_executor(self, mock_generate_chat):
+        """测试：批量查询的合成不占用单次查询推测性检索的线程池。"""
+        mock_generate_chat.return_value = "summary"
+        self.retrieval_service._executor = MagicMock()
+        responses = self.retrieval_service.query_and_synthesize_batch(["来自gemini的工作流", "java"])
+        self.retrieval_service._executor.assert_not_called()
+        self.assertEqual(self.retrieval_service._executor.method_calls, [])
+        self.assertEqual(responses[0].context, "summary")
+
+
+@patch('cortex.services.retrieval.RETRIEVAL_TOP_K', 2)
+@patch('cortex.services.retrieval.get_formatted_prompt', MagicMock(return_value="A prompt"))
+@patch('cortex.services.retrieval.get_synthesis_prompt', MagicMock(return_value="A prompt"))
+@patch('cortex.services.retrieval.get_template_version', MagicMock(return_value="v1"))
+class TestAsyncRetrieval(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.mock_storage_service = MagicMock()
+        self.mock_storage_service.query_memories.return_value = [
+            _memory("a", "gemini", 0.1), _memory("b", "chatgpt", 0.2), _memory("c", "gemini", 0.3)]
+        self.retrieval_service = RetrievalService(storage_service=self.mock_storage_service)
+
+    @patch('cortex.services.retrieval.generate_chat_completion')
+    @patch('cortex.services.retrieval.agenerate_chat_completion', new_callable=AsyncMock)
+    async def test_speculative_retrieval_uses_async_llm(self, mock_agenerate, mock_generate):
+        """测试：异步检索通过异步客户端拆解查询，并复用推测性检索的结果。"""
+        mock_agenerate.return_value = '{"core_query": "2023年3月的对话", "filters": []}'
+        _, _, chunk_ids = await self.retrieval_service.aretrieve_and_prepare_context("2023年3月的对话")
+        self.assertEqual(chunk_ids, ["a", "b"])
+        mock_agenerate.assert_awaited_once()
+        mock_generate.assert_not_called()
+        self.mock_storage_service.query_memories.assert_called_once()
+
+    @patch('cortex.services.retrieval.agenerate_chat_completion_stream')
+    async def test_cancelled_stream_closes_connection_and_skips_cache(self, mock_stream):
+        """测试：合成被取消时关闭模型的流式连接，不完整的结果不写入缓存。"""
+        closed = asyncio.Event()
+
+        async def stream(prompt):
+            try:
+                yield "部分"
+                await asyncio.Event().wait()
+                yield "永远不会产出"
+            finally:
+                closed.set()
+
+        mock_stream.side_effect = stream
+        received = []
+
+        async def consume():
+            async for token in self.retrieval_service.asynthesize_context_stream("context", ["a"]):
+                received.append(token)
+
+        task = asyncio.create_task(consume())
+        while not received:
+            await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertTrue(closed.is_set())
+        self.assertEqual(len(self.retrieval_service.synthesis_cache), 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import MagicMock
+
+from .startup import StartupTask
+
+
+class TestStartupTask(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_service = MagicMock(is_ready=False)
+
+        def initialize():
+            self.storage_service.is_ready = True
+        self.storage_service.initialize.side_effect = initialize
+        self.llm_warmup = MagicMock()
+
+    def test_not_ready_until_storage_initialized(self):
+        """测试：存储服务初始化完成前报告未就绪，run() 之后就绪，未开启预热时不调用LLM。"""
+        task = StartupTask(self.storage_service, warmup_on_start=False, llm_warmup=self.llm_warmup)
+        self.assertFalse(task.status()["ready"])
+
+        task.run()
+        status = task.status()
+        self.assertTrue(status["ready"])
+        self.assertEqual(status["components"]["storage"]["status"], "ready")
+        self.llm_warmup.assert_not_called()
+
+    def test_llm_warmup_failure_does_not_block_readiness(self):
+        """测试：LLM预热失败只记录在状态中，服务依然就绪。"""
+        self.llm_warmup.side_effect = ConnectionError("refused")
+        task = StartupTask(self.storage_service, warmup_on_start=True, llm_warmup=self.llm_warmup)
+        task.run()
+
+        status = task.status()
+        self.assertTrue(status["ready"])
+        self.storage_service.warmup.assert_called_once()
+        self.assertEqual(status["components"]["llm_warmup"],
+                         {"status": "failed", "error": "refused"})
+
+    def test_storage_failure_is_reported(self):
+        """测试：存储服务初始化失败时保持未就绪，并跳过预热。"""
+        self.storage_service.initialize.side_effect = RuntimeError("disk full")
+        task = StartupTask(self.storage_service, warmup_on_start=True, llm_warmup=self.llm_warmup)
+        task.run()
+
+        status = task.status()
+        self.assertFalse(status["ready"])
+        self.assertEqual(status["components"]["storage"]["status"], "failed")
+        self.llm_warmup.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import MagicMock
+
+from .storage import StorageService
+
+
+def _query_result(embeddings):
+    """按 Chroma 的返回格式，为每个查询向量构造一条检索结果（测试中向量即查询文本）。"""
+    return {
+        "ids": [[f"id-{e}"] for e in embeddings],
+        "documents": [[f"doc-{e}"] for e in embeddings],
+        "metadatas": [[{"source": e}] for e in embeddings],
+        "distances": [[0.5] for _ in embeddings],
+    }
+
+
+class TestStorageService(unittest.TestCase):
+
+    def setUp(self):
+        # 跳过真实的数据库和嵌入模型初始化
+        self.storage_service = object.__new__(StorageService)
+        StorageService.__init__(self.storage_service)
+        self.storage_service._ready = True
+        self.storage_service._embedding_function = MagicMock(side_effect=lambda texts: list(texts))
+        self.storage_service._collection = MagicMock()
+        self.storage_service._collection.query.side_effect = \
+            lambda query_embeddings, n_results, where: _query_result(query_embeddings)
+
+    def test_groups_queries_by_filter(self):
+        """测试：所有查询一次计算嵌入，过滤条件相同的查询合并为一次检索调用，结果按原顺序返回。"""
+        gemini = {"$and": [{"source": "gemini"}]}
+        results = self.storage_service.query_memories_batch(
+            ["a", "b", "c"], top_k=3, where_filters=[None, gemini, None])
+
+        self.storage_service._embedding_function.assert_called_once_with(["a", "b", "c"])
+        self.assertEqual(self.storage_service._collection.query.call_count, 2)
+        first_call = self.storage_service._collection.query.call_args_list[0].kwargs
+        self.assertEqual((first_call["query_embeddings"], first_call["where"]), (["a", "c"], None))
+        self.assertEqual([r[0]["id"] for r in results], ["id-a", "id-b", "id-c"])
+
+    def test_construction_is_lazy(self):
+        """测试：构造存储服务不加载任何组件，保存索引和注册监听器也不会触发初始化。"""
+        storage_service = object.__new__(StorageService)
+        StorageService.__init__(storage_service)
+        storage_service.initialize = MagicMock()
+        storage_service.add_write_listener(lambda: None)
+        storage_service.save_hash_index()
+
+        self.assertFalse(storage_service.is_ready)
+        storage_service.initialize.assert_not_called()
+        _ = storage_service.collection
+        storage_service.initialize.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from fastapi.testclient import TestClient
+
+from cortex.benchmark.stubs import HashingEmbeddingFunction
+
+from .storage import StorageService
+from .storage_client import StorageClient, StorageServerError
+from .storage_server import create_app
+
+HASH_1, HASH_2 = "a1" * 32, "b2" * 32
+
+
+class TestStorageClientServer(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        storage_service = StorageService(
+            db_path=Path(tmp_dir.name) / "db", embedding_function=HashingEmbeddingFunction(),
+            hash_index_path=Path(tmp_dir.name) / "file_hash_index.bin")
+        http = TestClient(create_app(storage_service, background_init=False))
+        self.addCleanup(http.close)
+        # 同一个存储服务的两个客户端，相当于两个 API worker 进程
+        self.client = StorageClient(http_client=http)
+        self.other_client = StorageClient(http_client=http)
+
+    def test_round_trip(self):
+        """测试：通过客户端写入、去重检查、读取清单和检索，结果与进程内的存储服务一致。"""
+        metadatas = [{"source": "notes", "file_hash": HASH_1, "original_filename": "notes.md", "chunk_index": i}
+                     for i in range(2)]
+        self.client.add_memory_chunks(
+            ["vector index rebuild notes", "marathon pacing plan"], metadatas, ["c0", "c1"])
+
+        self.assertTrue(self.client.is_ready)
+        self.assertEqual(self.other_client.get_existing_hashes([HASH_1, HASH_2]), {HASH_1})
+        self.assertFalse(self.other_client.check_if_hash_exists(HASH_2))
+        self.assertEqual(set(self.other_client.get_source_manifests(["notes.md"])["notes.md"]), {"c0", "c1"})
+        memories = self.other_client.query_memories("marathon pacing", top_k=1)
+        self.assertEqual(memories[0]["id"], "c1")
+        batch = self.other_client.query_memories_batch(
+            ["vector index", "marathon"], top_k=1, where_filters=[{"source": "notes"}, None])
+        self.assertEqual([m[0]["id"] for m in batch], ["c0", "c1"])
+
+    def test_writes_from_other_process_notify_listeners(self):
+        """测试：其他进程写入记忆后，本进程的写入监听器在下一次调用时被触发。"""
+        listener = MagicMock()
+        self.other_client.add_write_listener(listener)
+        self.other_client.check_if_hash_exists(HASH_1)
+        listener.assert_not_called()
+
+        self.client.add_memory_chunks(["some text"], [{"source": "notes", "file_hash": HASH_1}], ["c0"])
+        self.other_client.query_memories("some text", top_k=1)
+        listener.assert_called_once()
+
+    def test_server_errors_are_raised(self):
+        """测试：服务端调用失败或参数错误时，客户端抛出 StorageServerError。"""
+        with self.assertRaises(StorageServerError):
+            self.client._call("query_memories", query_text="x")
+        with self.assertRaises(StorageServerError):
+            self.client._call("initialize")
+
+
+if __name__ == '__main__':
+    unittest.main()
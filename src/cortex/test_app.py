@@ -0,0 +1,63 @@
+import importlib
+import importlib.util
+import unittest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from cortex.services.retrieval import RetrievalService
+
+
+@unittest.skipUnless(importlib.util.find_spec("chainlit"), "the Chainlit app requires the chainlit package")
+@patch('cortex.services.retrieval.get_template_version', MagicMock(return_value="v1"))
+@patch('cortex.services.retrieval.get_synthesis_prompt', MagicMock(return_value="A prompt"))
+class TestAnswerQueryStream(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        # 导入 app 时不启动后台加载
+        with patch('cortex.services.startup.StartupTask.start'):
+            self.app = importlib.import_module("cortex.app")
+        self.retrieval_service = RetrievalService(storage_service=MagicMock())
+        self.retrieval_service.aretrieve_and_prepare_context = AsyncMock(
+            return_value=("context", ["notes.md", "chatgpt/1"], ["c1", "c2"]))
+        self.message = MagicMock(send=AsyncMock(), stream_token=AsyncMock(), update=AsyncMock())
+        for patcher in (patch.object(self.app, "retrieval_service", self.retrieval_service),
+                        patch.object(self.app.cl, "Message", MagicMock(return_value=self.message)),
+                        patch.object(self.app.cl, "Text")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _streamed_tokens(self):
+        return [call.args[0] for call in self.message.stream_token.await_args_list]
+
+    @patch('cortex.services.retrieval.agenerate_chat_completion_stream')
+    async def test_tokens_streamed_in_order_then_message_updated(self, mock_stream):
+        """测试：摘要片段按生成顺序推送到消息中，结束后以完整的记忆包更新消息。"""
+        async def stream(prompt):
+            for token in ["工作流", "引擎", "的路由"]:
+                yield token
+        mock_stream.side_effect = stream
+
+        await self.app.answer_query("workflow engine", [])
+
+        self.assertEqual(self._streamed_tokens()[-3:], ["工作流", "引擎", "的路由"])
+        self.message.update.assert_awaited_once()
+        self.assertEqual(self.app.cl.Text.call_args.kwargs["content"], "工作流引擎的路由")
+        self.assertIn("notes.md", self.message.content)
+
+    @patch('cortex.services.retrieval.agenerate_chat_completion_stream')
+    async def test_llm_error_mid_stream_propagates(self, mock_stream):
+        """测试：LLM在生成途中出错时，已推送的片段保留，错误向上抛出且不以部分结果更新消息。"""
+        async def stream(prompt):
+            yield "工作流"
+            raise RuntimeError("connection reset")
+        mock_stream.side_effect = stream
+
+        with self.assertRaises(RuntimeError):
+            await self.app.answer_query("workflow engine", [])
+
+        self.assertEqual(self._streamed_tokens()[-1], "工作流")
+        self.message.update.assert_not_awaited()
+        self.assertEqual(len(self.retrieval_service.synthesis_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+
+from fastapi.testclient import TestClient
+
+from cortex import main
+from cortex.services.retrieval import RetrievalService
+
+
+def _parse_sse(text: str):
+    """将 SSE 响应体解析为 (event, data) 列表。"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+@patch('cortex.services.retrieval.get_template_version', MagicMock(return_value="v1"))
+@patch('cortex.services.retrieval.get_synthesis_prompt', MagicMock(return_value="A prompt"))
+class TestQueryStream(unittest.TestCase):
+
+    def setUp(self):
+        # 不进入 lifespan，避免启动后台加载和摄入任务
+        self.client = TestClient(main.app)
+        self.retrieval_service = RetrievalService(storage_service=MagicMock())
+        self.retrieval_service.retrieve_and_prepare_context = MagicMock(
+            return_value=("context", ["notes.md", "chatgpt/1"], ["c1", "c2"]))
+        patcher = patch.object(main, "retrieval_service", self.retrieval_service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('cortex.services.retrieval.generate_chat_completion_stream')
+    def test_streams_sources_tokens_then_done(self, mock_stream):
+        """测试：依次发送记忆来源、按生成顺序的摘要片段，最后发送 done。"""
+        mock_stream.return_value = iter(["工作流", "引擎", "的路由"])
+
+        response = self.client.post("/query/stream", json={"query": "workflow engine"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+        self.assertEqual(_parse_sse(response.text), [
+            ("sources", ["notes.md", "chatgpt/1"]),
+            ("message", "工作流"),
+            ("message", "引擎"),
+            ("message", "的路由"),
+            ("done", ""),
+        ])
+
+    @patch('cortex.services.retrieval.generate_chat_completion_stream')
+    def test_llm_error_mid_stream_sends_error_event(self, mock_stream):
+        """测试：LLM在生成途中出错时，已发送的片段保留，随后发送 error 而不是 done，且不缓存部分结果。"""
+        def broken_stream(prompt):
+            yield "工作流"
+            raise RuntimeError("connection reset")
+        mock_stream.side_effect = broken_stream
+
+        response = self.client.post("/query/stream", json={"query": "workflow engine"})
+
+        self.assertEqual(_parse_sse(response.text), [
+            ("sources", ["notes.md", "chatgpt/1"]),
+            ("message", "工作流"),
+            ("error", "connection reset"),
+        ])
+        self.assertEqual(len(self.retrieval_service.synthesis_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()